@@ -1,4 +1,4 @@
-from lib.constants import DetectorType
+from lib.constants import DetectorType, ODWorkerType
 from lib.detection_buffer import SimpleDetectionBuffer
 from notifier import NotificationTypes
 
@@ -26,12 +26,42 @@ class ConfigBase:
         self.md_box_threshold_x = 0
         self.md_mask = None
         self.md_nmask = None
+        self.md_restrict_to_mask = False
         self.md_blur_output_frame = False
         self.md_show_masks = False
+        self.md_timing_breakdown = False
+        self.md_analysis_scale = 1
+        self.md_connected_components = False
+        self.md_max_regions = 1
+        self.md_region_merge_distance = 50
         self.od_blur_output_frame = False
 
         self.od_frame_rate = -1
         self.od_task_q_size = 1000
+        self.od_max_frame_age = None
+        self.od_max_lag_frames = None
+        self.od_coalesce_window = None
+        self.od_batch_size = 1
+        self.od_num_workers = 1
+        self.tf_num_threads = None
+        self.tf_zero_copy = False
+        self.od_pipelined = False
+        self.od_async_writer = False
+        self.od_writer_threads = 1
+        self.od_writer_q_size = 100
+        self.od_worker_type = ODWorkerType.THREAD
+        self.od_shared_frame_slots = 4
+        self.od_tracker_enabled = False
+        self.od_tracker_iou_threshold = 0.3
+        self.od_tracker_max_centroid_distance = 50
+        self.od_tracker_reinference_frames = 5
+        self.od_tracker_max_misses = 1
+        self.od_tracker_max_age = 2
+        self.od_cache_enabled = False
+        self.od_cache_size = 256
+        self.od_cache_hamming_tolerance = 4
+        self.od_cache_ttl = 10
+        self.od_cache_location_tolerance = 8
         self.tf_model_path = None
         self.tf_path_to_labelmap = None
         self.tf_accuracy_threshold = 0
@@ -50,7 +80,11 @@ class ConfigBase:
         self.pattern_detection_state_history_length = 20
         self.pattern_detection_state_history_length_partial = 300
         self.pattern_detection_interval = 1
+        self.pattern_detection_event_driven = False
+        self.pattern_detection_state_history_log = None
+        self.pattern_detection_columnar_state_history = False
         self.door_state_detector = None
+        self.door_state_detectors = None
         self.door_state_detector_show_detection = False
         self.debug_mode = False
 
@@ -1,6 +1,6 @@
 from configs.config_base import ConfigBase
 from configs.config_patterns import door_movement
-from lib.constants import InputMode, DetectorType
+from lib.constants import InputMode, DetectorType, ODWorkerType
 from detection.door_state_detectors import SingleShotFrameDiffDoorStateDetector
 from lib.detection_buffer import SlidingWindowDetectionBuffer, SimpleDetectionBuffer
 from notifier import NotificationTypes
@@ -57,17 +57,51 @@ class Config(ConfigBase):
         self.md_box_threshold_y = 200
         self.md_box_threshold_x = 200
 
-        # do motion detection only within this mask
+        # do motion detection only within this mask, a rectangle (minX, minY, maxX, maxY)
+        # or a polygon [(x, y), (x, y), ...]. motion crossing the outline of the mask is reported as
+        # motion outside the mask
         self.md_mask = (250, 0, 690, 520)
 
-        # don't do motion detection in this mask
+        # don't do motion detection in this mask (a rectangle or a polygon as well)
         self.md_nmask = None
 
+        # only analyse the pixels within md_mask and outside md_nmask: the motion detector works on the
+        # bounding box of md_mask and the other pixels never show any motion, instead of the crops being
+        # narrowed to the masks after the motion was detected on the whole frame. motion far from the
+        # mask doesn't then stretch the crop and md_nmask excludes its pixels rather than the crops within it
+        self.md_restrict_to_mask = False
+
         # blur the output video wherever there is motion
         # useful to share videos of argos in action or even
         # if you are privacy conscious at home
         self.md_blur_output_frame = False
 
+        # measure the time taken by every stage of the motion detector on every frame
+        # (reported as motion_detector.<stage>_ms appmetrics gauges)
+        self.md_timing_breakdown = False
+
+        # analyse the motion on a downsampled frame: 1 (the whole frame), 1/2, 1/4, 1/8..
+        # e.g. at 1/4 the motion detector works on 16 times fewer pixels. the crops, masks, box thresholds and
+        # md_min_cont_area are still in pixels of the frame, so the object detector still gets full resolution crops
+        self.md_analysis_scale = 1
+
+        # find the blobs of motion with a single cv2.connectedComponentsWithStats call instead of tracing their
+        # contours. it pays off on noisy frames with hundreds of blobs and on downsampled frames (md_analysis_scale),
+        # on a clean full resolution frame tracing the few contours is cheaper. md_min_cont_area is then compared
+        # to the number of pixels of a blob rather than to the area enclosed by its contour, which is slightly smaller
+        self.md_connected_components = False
+
+        # split the motion into up to these many separate crops instead of a single box around all of it
+        # (1 disables it), e.g. two people at opposite ends of the frame are detected in two small crops
+        # rather than in one crop of nearly the whole frame, which loses small objects when it is resized to
+        # the input of the model. every crop is a separate object detector task, set od_batch_size to at least
+        # md_max_regions to detect the crops of a frame in a single (batched) inference.
+        # the crops are subject to md_mask, md_nmask and the box thresholds on their own
+        self.md_max_regions = 1
+
+        # motion boxes which are at most these many pixels apart are always kept in the same crop
+        self.md_region_merge_distance = 50
+
         # blurs the output frame of the object detector
         self.od_blur_output_frame = False
 
@@ -87,7 +121,8 @@ class Config(ConfigBase):
         # i just use coco
         self.tf_detection_labels = ['person', 'dog']
 
-        # list of masks to filter the detections by (objects detected outside these masks are ignored)
+        # list of masks to filter the detections by (objects detected outside these masks are ignored).
+        # a mask is a rectangle (minX, minY, maxX, maxY) or a polygon [(x, y), (x, y), ...]
         self.tf_detection_masks = None
 
         # list of negative masks to filter the detections by (objects detected inside these masks are ignored)
@@ -121,6 +156,16 @@ class Config(ConfigBase):
         # path where above jpegs are stored
         self.tf_output_detection_path = '/home/pi/detections'
 
+        # draw and write the above jpegs and xml files on background threads so that
+        # a slow disk (e.g. an SD card) doesn't stall the object detector.
+        # the queue depth and number of dropped writes are shown in /status.
+        # with ODWorkerType.PROCESS the worker processes write them, off the main process already
+        self.od_async_writer = False
+        self.od_writer_threads = 1
+
+        # number of detected frames waiting to be written, the oldest one is dropped when it is full
+        self.od_writer_q_size = 100
+
         # limit the speed of the object detector (useful in testing)
         self.od_frame_rate = -1
 
@@ -128,6 +173,88 @@ class Config(ConfigBase):
         # increasing this will cause more lagged detection
         self.od_task_q_size = 1000
 
+        # drop the queued tasks which are older than these many seconds instead of detecting them
+        # late (None to never drop them). the dropped frames are still committed in order, so the
+        # pattern detector does not wait on them
+        self.od_max_frame_age = None
+
+        # when more than these many tasks are queued, drop the oldest ones so that
+        # the newest frames are detected first (None to never drop them)
+        self.od_max_lag_frames = None
+
+        # coalesce a queued task into the next queued one if it is at most these many
+        # seconds older than it, i.e. only detect the latest of a burst of frames (None to disable)
+        self.od_coalesce_window = None
+
+        # maximum number of queued tasks (motion crops) the object detector drains from
+        # the task queue and runs through the model in a single (batched) inference.
+        # only kicks in when the task queue backs up, 1 disables batching
+        self.od_batch_size = 1
+
+        # number of object detector workers consuming the task queue in parallel.
+        # for tflite every worker gets its own interpreter. detections are still
+        # reported in the order the frames were queued
+        self.od_num_workers = 1
+
+        # number of threads every tflite interpreter is allowed to use (None lets tflite decide)
+        # keep od_num_workers * tf_num_threads around the number of cores you have
+        self.tf_num_threads = None
+
+        # resize and color convert frames straight into the tflite interpreter's input tensor
+        # and read its outputs in place, avoiding all per frame allocations of the input path
+        self.tf_zero_copy = False
+
+        # pipeline every object detector worker: the next frame is preprocessed and the
+        # detections of the previous frame are drawn/written/notified on separate threads
+        # while the current frame is being run through the model.
+        # the frames are prepared into buffers of the pipeline which are copied into the interpreter's
+        # input tensor, so tf_zero_copy then only reads the outputs in place
+        self.od_pipelined = False
+
+        # run the object detector workers as threads or as separate processes.
+        # processes also take the filtering, drawing and writing of detections off
+        # the GIL of the main process. frames are handed to them through shared memory
+        self.od_worker_type = ODWorkerType.THREAD
+
+        # number of frames which can be in flight to the object detector processes at a time
+        self.od_shared_frame_slots = 4
+
+        # track the detected objects across the motion crops and carry their last detection over to the
+        # following crops instead of running the object detector on every one of them (thread workers only)
+        self.od_tracker_enabled = False
+
+        # a motion crop is associated with a tracked object if their IoU is at least this much..
+        self.od_tracker_iou_threshold = 0.3
+
+        # ..or if their centers are at most these many pixels apart
+        self.od_tracker_max_centroid_distance = 50
+
+        # re-run the object detector on a tracked object after its detection was carried over these many frames
+        self.od_tracker_reinference_frames = 5
+
+        # number of detections in which a tracked object may be missing before it is considered lost
+        self.od_tracker_max_misses = 1
+
+        # seconds after which a tracked object which hasn't been seen is considered lost
+        self.od_tracker_max_age = 2
+
+        # cache the detections of the motion crops by a perceptual hash of the crop and its location,
+        # so that the near identical crops of a flickering static scene don't each cost an inference.
+        # a cache hit reuses the detections (and the images) of the cached crop, no artifacts are written for it
+        self.od_cache_enabled = False
+
+        # max number of cached crops (least recently used ones are evicted first)
+        self.od_cache_size = 256
+
+        # max number of bits (out of 64) by which the hashes of two crops may differ to consider them the same
+        self.od_cache_hamming_tolerance = 4
+
+        # seconds after which a cached crop expires and is detected again
+        self.od_cache_ttl = 10
+
+        # max number of pixels by which the coordinates of two crops may differ to consider them the same
+        self.od_cache_location_tolerance = 8
+
         ## PATTERN DETECTOR CONFIG
 
         # enable the movement pattern detector
@@ -154,6 +281,19 @@ class Config(ConfigBase):
         # run the pattern detector even interval seconds
         self.pattern_detection_interval = 1
 
+        # run the pattern detector as soon as a state is added to the state history, and exactly when
+        # a trailing NotState's duration expires, instead of every `pattern_detection_interval` seconds.
+        # the interval is then only used to re-run it while a state manager (the object detector) is lagging
+        self.pattern_detection_event_driven = False
+
+        # append the states added to the pattern detector's state history to this file (None to not log them).
+        # the log can be replayed offline to backtest pattern configs, see `tools/backtest_patterns.py`
+        self.pattern_detection_state_history_log = None
+
+        # store the state history in numpy arrays (state codes and timestamps) instead of a list of steps,
+        # which takes less memory with long (`pattern_detection_state_history_length_partial`) and chatty histories
+        self.pattern_detection_columnar_state_history = False
+
         # see the docs for the respective door state detectors to understand how they work
         # and how their parameters make them behave. you can choose one based on your environment
         # self.door_state_detector = SingleShotDoorStateDetector((215, 114, 227, 123), (118, 80, 26), (151, 117, 72))
@@ -161,6 +301,18 @@ class Config(ConfigBase):
         #                                  (DoorStates.DOOR_CLOSED, DoorStates.DOOR_OPEN))
         self.door_state_detector = SingleShotFrameDiffDoorStateDetector((215, 114, 227, 123), (196, 131, 215, 147))
 
+        # when the camera watches more than one door (or zone), a dict of door name -> door state detector.
+        # their states are detected together in a single pass over the frame, and every door gets its own
+        # door state manager: the door states are added to the state history as DoorState(<door name>, <door state>)
+        # and notified as "<door name>:<door state>". the patterns then need to say which door their door steps
+        # are about, e.g. DoorState('garage', DoorStates.DOOR_OPEN) (plain DoorStates steps are refused, unless
+        # door_state_detector is set as well)
+        # self.door_state_detectors = {
+        #     'front': SingleShotFrameDiffDoorStateDetector((215, 114, 227, 123), (196, 131, 215, 147)),
+        #     'garage': SingleShotDoorStateDetector((415, 214, 427, 223), (118, 80, 26), (151, 117, 72))
+        # }
+        self.door_state_detectors = None
+
         # show the door state in the output video frame
         self.door_state_detector_show_detection = True
 
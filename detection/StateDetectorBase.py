@@ -3,24 +3,32 @@ from abc import ABC, abstractmethod
 
 from termcolor import colored
 
+from lib import gauge, get_metric_prefix
+
 log = logging.getLogger(__name__)
 
 class SkipAheadOptimizer(ABC):
     """
     skip-ahead optimizer for lagging state detectors
     """
-    def __init__(self, skip_state_type):
+    def __init__(self, skip_state_type, metric_prefix=None):
         self.skip_state_type = skip_state_type
+        self.metric_prefix = get_metric_prefix(self, metric_prefix)
         self.total_frames = 0
         self.total_skipped = 0
 
     def measure_speedup(self, skip_ahead):
+        """
+        called for every task, the ratio of the tasks skipped is reported by the speedup gauge
+        """
         self.total_frames += 1
         if skip_ahead:
             self.total_skipped += 1
 
-        speedup = round((self.total_skipped / self.total_frames) * 100, 1)
-        log.info(colored("%s detector speedup: %d%% (%d/%d)" % (self.skip_state_type, speedup, self.total_skipped, self.total_frames), 'white'))
+        gauge(self.metric_prefix, "speedup").notify(self.total_skipped / self.total_frames)
+        if log.isEnabledFor(logging.DEBUG):
+            speedup = round((self.total_skipped / self.total_frames) * 100, 1)
+            log.debug(colored("%s detector speedup: %d%% (%d/%d)" % (self.skip_state_type, speedup, self.total_skipped, self.total_frames), 'white'))
 
     @abstractmethod
     def skip_task(self, ts):
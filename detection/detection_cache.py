@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from lib import gauge
+
+
+class DetectionCache():
+    """
+    LRU cache of the filtered detections of crops, keyed by a difference hash of the crop and its location.
+    a crop hits the cache if a cached crop at (nearly) the same location has a hash which is at most
+    `hamming_tolerance` bits apart, so the near identical crops of a flickering static scene
+    (a swaying plant, headlights) don't each cost an inference
+    """
+
+    def __init__(self, max_size=256, hamming_tolerance=4, ttl=10, location_tolerance=8, metric_prefix='od_cache'):
+        """
+        :param max_size: max number of cached crops, the least recently used one is evicted first
+        :param hamming_tolerance: max number of differing bits of the (64 bit) hashes of two crops to consider them the same
+        :param ttl: seconds after which a cached crop expires
+        :param location_tolerance: max number of pixels the coordinates of two crops can differ by to consider them the same
+        """
+        self.max_size = max_size
+        self.hamming_tolerance = hamming_tolerance
+        self.ttl = ttl
+        self.location_tolerance = location_tolerance
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.metric_prefix = metric_prefix
+
+    @staticmethod
+    def image_hash(frame):
+        """
+        :return: 64 bit difference hash of the frame: whether each pixel of a 9x8 grayscale thumbnail
+                 is brighter than its right neighbour
+        """
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        thumbnail = cv2.resize(frame, (9, 8), interpolation=cv2.INTER_AREA)
+        bits = thumbnail[:, 1:] > thumbnail[:, :-1]
+        return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+    def key(self, frame, location):
+        """
+        :param location: (minx, miny, maxx, maxy) box of the crop in the full frame
+        """
+        return DetectionCache.image_hash(frame), tuple(location)
+
+    def _matches(self, key, cached_key):
+        image_hash, location = key
+        cached_hash, cached_location = cached_key
+        return all(abs(a - b) <= self.location_tolerance for a, b in zip(location, cached_location)) and \
+               bin(image_hash ^ cached_hash).count('1') <= self.hamming_tolerance
+
+    def _notify(self, hit):
+        if hit:
+            self.hits += 1
+            gauge(self.metric_prefix, "hits").notify(self.hits)
+        else:
+            self.misses += 1
+            gauge(self.metric_prefix, "misses").notify(self.misses)
+        gauge(self.metric_prefix, "hit_ratio").notify(self.hits / (self.hits + self.misses))
+
+    def get(self, key, now=None):
+        """
+        :return: the cached detections of the crop or None on a cache miss
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            for cached_key in [k for k, (det_boxes, ts) in self.entries.items() if now - ts > self.ttl]:
+                del self.entries[cached_key]
+
+            entry_key = key if key in self.entries else next(
+                (cached_key for cached_key in reversed(self.entries) if self._matches(key, cached_key)), None)
+            self._notify(entry_key is not None)
+            if entry_key is None:
+                return None
+            self.entries.move_to_end(entry_key)
+            return self.entries[entry_key][0]
+
+    def put(self, key, det_boxes, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            self.entries[key] = (det_boxes, now)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            gauge(self.metric_prefix, "size").notify(len(self.entries))
+
+    def status(self):
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -0,0 +1,66 @@
+import logging
+import threading
+
+from lib.task_queue import NonBlockingTaskQueue
+
+log = logging.getLogger(__name__)
+
+
+class AsyncDetectionWriter():
+    """
+    renders the detections of a frame, publishes them to the object detector's video feed and writes
+    the detection artifacts (jpeg frame and pascal VOC annotations) on a pool of background threads,
+    so that a slow disk (e.g. an SD card) does not stall the object detector.
+    the job queue is bounded, when it is full the oldest pending job is dropped
+    """
+
+    def __init__(self, object_detector, num_threads=1, max_size=100, metric_prefix='od_writer'):
+        self.od = object_detector
+        self.job_q = NonBlockingTaskQueue(max_size, metric_prefix=metric_prefix)
+        self.written = 0
+        self.written_lock = threading.Lock()
+        self.threads = []
+        for _ in range(max(num_threads, 1)):
+            t = threading.Thread(target=self.write_continuously)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def write(self, frame, detections):
+        """
+        :param frame: the full frame the detections were made on. it is only referenced, not copied
+        :param detections: list of (box, image path)
+        """
+        self.job_q.enqueue((frame, detections))
+
+    def write_continuously(self):
+        while True:
+            job = self.job_q.dequeue()
+            if job == -1:
+                break
+            frame, detections = job
+            try:
+                output_frame = self.od.render_detections(frame, [box for (box, image_path) in detections])
+                self.od.publish_output_frame(output_frame)
+                self.od.write_detections(output_frame, frame.shape, detections)
+                with self.written_lock:
+                    self.written += 1
+            except Exception:
+                log.exception("failed writing detections %s" % str(detections))
+
+    def stop(self):
+        # finish writing the pending detections before stopping
+        while self.job_q.size() > 0 and any(t.is_alive() for t in self.threads):
+            self.job_q.wait_for_empty(0.1)
+        for _ in self.threads:
+            self.job_q.abrupt_stop(-1)
+        for t in self.threads:
+            if t.is_alive():
+                t.join()
+
+    def status(self):
+        return {
+            'queue_size': self.job_q.size(),
+            'dropped': self.job_q.dropped,
+            'written': self.written
+        }
@@ -1,12 +1,11 @@
 from abc import ABC, abstractmethod
 
 import cv2
-from colormath.color_conversions import convert_color
-from colormath.color_diff import delta_e_cmc
-from colormath.color_objects import sRGBColor, LabColor
+import numpy as np
 
 from detection.StateDetectorBase import StateDetectorBase
 from detection.state_managers.door_state_manager import DoorStates
+from lib.color import rgb_to_lab, delta_e_cmc, contours_avg_rgb
 
 
 class DoorStateDetector(StateDetectorBase):
@@ -25,8 +24,20 @@ class DoorStateDetector(StateDetectorBase):
         cv2.putText(output_frame, detection.name, (minX, minY - 7), cv2.FONT_HERSHEY_SIMPLEX, 0.3,
                     (0, 255, 0), 1)
 
-    @abstractmethod
+    def contours(self):
+        """
+        :return: the contours whose average colors the door state is detected from
+        """
+        return [self.open_door_contour]
+
     def detect_door_state(self, frame):
+        return self.door_state_from_avg(contours_avg_rgb(frame, self.contours()))
+
+    @abstractmethod
+    def door_state_from_avg(self, averages):
+        """
+        :param averages: int array of the average rgb colors of `contours()`
+        """
         pass
 
 
@@ -41,24 +52,13 @@ class SingleShotDoorStateDetector(DoorStateDetector):
         super().__init__(open_door_contour)
         self.door_closed_avg_rgb = door_closed_avg_rgb
         self.door_open_avg_rgb = door_open_avg_rgb
+        self.target_states = [DoorStates.DOOR_CLOSED, DoorStates.DOOR_OPEN]
+        self.target_colors = rgb_to_lab([door_closed_avg_rgb, door_open_avg_rgb])
 
-    def detect_door_state(self, frame):
-        minX, minY, maxX, maxY = self.open_door_contour
-        img = frame[minY:maxY, minX:maxX]
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        average = img.mean(axis=0).mean(axis=0)
-        average = (int(average[0]), int(average[1]), int(average[2]))
-        avg_color = convert_color(sRGBColor(*average), LabColor)
-
-        TARGET_COLORS = {DoorStates.DOOR_CLOSED: convert_color(sRGBColor(*self.door_closed_avg_rgb), LabColor),
-                         DoorStates.DOOR_OPEN: convert_color(sRGBColor(*self.door_open_avg_rgb), LabColor)}
-
-        differences = [[delta_e_cmc(avg_color, target_value, pl=1, pc=1), target_name] for target_name, target_value in
-                       TARGET_COLORS.items()]
-        differences.sort()  # sorted by the first element of inner lists
-
-        door_state = differences[0][1]
-        return door_state
+    def door_state_from_avg(self, averages):
+        avg_color = rgb_to_lab(averages[0])
+        differences = delta_e_cmc(avg_color, self.target_colors)
+        return self.target_states[int(np.argmin(differences))]
 
 
 class AdaptiveDoorStateDetector(DoorStateDetector):
@@ -84,6 +84,8 @@ class AdaptiveDoorStateDetector(DoorStateDetector):
         self.door_state_order = door_state_order
         self.avg_update_frames = avg_update_frames
         self.first_door_state_avg = None
+        # the Lab color of first_door_state_avg, converted again only when the average is updated
+        self.first_door_state_lab = None
         self.total_frames = 0
 
     def add_to_avg(self, avg_rgb, new_rgb):
@@ -94,21 +96,13 @@ class AdaptiveDoorStateDetector(DoorStateDetector):
                     (avg_rgb[1] + new_rgb[1]) / 2,
                     (avg_rgb[2] + new_rgb[2]) / 2)
 
-    def get_current_contour_avg(self, frame):
-        minX, minY, maxX, maxY = self.open_door_contour
-        img = frame[minY:maxY, minX:maxX]
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        average = img.mean(axis=0).mean(axis=0)
-        average = (int(average[0]), int(average[1]), int(average[2]))
-        return average
-
-    def detect_door_state(self, frame):
+    def door_state_from_avg(self, averages):
         self.total_frames += 1
-        new_contour_avg = self.get_current_contour_avg(frame)
+        new_contour_avg = tuple(int(c) for c in averages[0])
         if self.total_frames > self.warmup_frames:
-            new_contour_avg_clr = convert_color(sRGBColor(*new_contour_avg), LabColor)
-            init_cont_avg_clr = convert_color(sRGBColor(*self.first_door_state_avg), LabColor)
-            diff = delta_e_cmc(new_contour_avg_clr, init_cont_avg_clr, pl=1, pc=1)
+            if self.first_door_state_lab is None:
+                self.first_door_state_lab = rgb_to_lab(self.first_door_state_avg)
+            diff = delta_e_cmc(rgb_to_lab(new_contour_avg), self.first_door_state_lab)
             if diff > self.diff_threshold:
                 # print("%s/%s/%s" % (str(self.first_door_state_avg), self.door_state_order[1], str(diff)))
                 return self.door_state_order[1]
@@ -118,12 +112,14 @@ class AdaptiveDoorStateDetector(DoorStateDetector):
             if self.total_frames % self.avg_update_frames == 0:
                 self.first_door_state_avg = self.add_to_avg(
                     self.first_door_state_avg, new_contour_avg)
+                self.first_door_state_lab = None
         else:
             self.first_door_state_avg = self.add_to_avg(
                 self.first_door_state_avg, new_contour_avg)
 
         return self.door_state_order[0]
 
+
 class SingleShotFrameDiffDoorStateDetector(DoorStateDetector):
     def __init__(self, open_door_contour, door_frame_contour, threshold=500):
         """
@@ -139,23 +135,130 @@ class SingleShotFrameDiffDoorStateDetector(DoorStateDetector):
         self.door_frame_contour = door_frame_contour
         self.threshold = threshold
 
-    def get_contour_avg(self, frame, contour):
-        minX, minY, maxX, maxY = contour
-        img = frame[minY:maxY, minX:maxX]
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        average = img.mean(axis=0).mean(axis=0)
-        average = (int(average[0]), int(average[1]), int(average[2]))
-        return average
-
-    def detect_door_state(self, frame):
-        open_door_cont_avg = self.get_contour_avg(frame, self.open_door_contour)
-        door_frame_cont_avg = self.get_contour_avg(frame, self.door_frame_contour)
+    def contours(self):
+        return [self.open_door_contour, self.door_frame_contour]
 
-        open_door_cont_avg_clr = convert_color(sRGBColor(*open_door_cont_avg), LabColor)
-        door_frame_cont_avg_clr = convert_color(sRGBColor(*door_frame_cont_avg), LabColor)
-        diff = delta_e_cmc(open_door_cont_avg_clr, door_frame_cont_avg_clr, pl=1, pc=1)
+    def door_state_from_avg(self, averages):
+        # both contours are converted in one go
+        open_door_cont_avg_clr, door_frame_cont_avg_clr = rgb_to_lab(averages)
+        diff = delta_e_cmc(open_door_cont_avg_clr, door_frame_cont_avg_clr)
 
         if diff > self.threshold:
             return DoorStates.DOOR_OPEN
         else:
-            return DoorStates.DOOR_CLOSED
\ No newline at end of file
+            return DoorStates.DOOR_CLOSED
+
+
+class DoorStateDetectorGroup():
+    def __init__(self, detectors):
+        """
+        detects the states of many doors (or zones) of the same camera in a single pass over the frame:
+        the average colors of all the contours are computed from integral images of the areas covering the
+        clusters of nearby contours, converted to Lab at once, and the single shot (and frame diff) detectors
+        compare them with their reference colors (thresholds) at once. the other detectors are given their averages one by one
+
+        :param detectors: dict of door name -> DoorStateDetector
+        """
+        self.detectors = detectors
+        self.doors = list(detectors)
+        contours = []
+        self.contour_slices = {}
+        for door, detector in detectors.items():
+            self.contour_slices[door] = slice(len(contours), len(contours) + len(detector.contours()))
+            contours.extend(detector.contours())
+        contours = np.array(contours, dtype=np.int64).reshape(-1, 4)
+
+        # the integral images only need to cover the contours. contours far apart (e.g. doors at opposite
+        # corners of the frame) get an integral image each, rather than one of most of the frame
+        self.clusters = []
+        for idx in self.cluster_contours(contours):
+            minX, minY = contours[idx, 0].min(), contours[idx, 1].min()
+            maxX, maxY = contours[idx, 2].max(), contours[idx, 3].max()
+            # 32 bit sums overflow beyond 2^31 / 255 pixels
+            integral_depth = cv2.CV_32S if (maxX - minX) * (maxY - minY) * 255 < 2 ** 31 else cv2.CV_64F
+            self.clusters.append(((minX, minY, maxX, maxY), integral_depth, idx,
+                                  contours[idx, 0] - minX, contours[idx, 1] - minY,
+                                  contours[idx, 2] - minX, contours[idx, 3] - minY))
+        self.areas = ((contours[:, 2] - contours[:, 0]) * (contours[:, 3] - contours[:, 1]))[:, None]
+
+        self.single_shot_doors = [door for door, detector in detectors.items()
+                                  if type(detector) is SingleShotDoorStateDetector]
+        self.single_shot_idx = np.array([self.contour_slices[door].start for door in self.single_shot_doors],
+                                        dtype=np.int64)
+        self.single_shot_targets = np.array([detectors[door].target_colors for door in self.single_shot_doors],
+                                            dtype=np.float64).reshape(-1, 3)
+        self.frame_diff_doors = [door for door, detector in detectors.items()
+                                 if type(detector) is SingleShotFrameDiffDoorStateDetector]
+        self.frame_diff_idx = np.array([self.contour_slices[door].start for door in self.frame_diff_doors],
+                                       dtype=np.int64)
+        self.other_doors = [door for door in self.doors
+                            if door not in self.single_shot_doors and door not in self.frame_diff_doors]
+        # the frame diff and single shot comparisons are made by a single Delta E call: the door contours of
+        # the frame diff doors against their frame contours, then the door contour of every single shot door
+        # against both its reference colors
+        self.compared_idx = np.concatenate([self.frame_diff_idx, np.repeat(self.single_shot_idx, 2)])
+
+    @staticmethod
+    def cluster_contours(contours, max_area_ratio=2):
+        """
+        merge the contours into clusters for as long as the box of a merged cluster is at most max_area_ratio
+        times the area of the boxes of the clusters it merges
+
+        :return: list of the arrays of the indexes of the contours of every cluster
+        """
+        clusters = [([i], tuple(contour)) for i, contour in enumerate(contours.tolist())]
+        area = lambda box: (box[2] - box[0]) * (box[3] - box[1])
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(clusters)):
+                for j in range(i + 1, len(clusters)):
+                    (idx_i, box_i), (idx_j, box_j) = clusters[i], clusters[j]
+                    box = (min(box_i[0], box_j[0]), min(box_i[1], box_j[1]),
+                           max(box_i[2], box_j[2]), max(box_i[3], box_j[3]))
+                    if area(box) <= max_area_ratio * (area(box_i) + area(box_j)):
+                        clusters[i] = (idx_i + idx_j, box)
+                        del clusters[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return [np.array(idx, dtype=np.int64) for idx, _ in clusters]
+
+    def contours_avg_rgb(self, frame):
+        """
+        :return: int array of the average rgb colors of the contours of all the detectors
+        """
+        sums = np.empty((len(self.areas), 3), dtype=np.float64)
+        for (minX, minY, maxX, maxY), integral_depth, idx, c_minX, c_minY, c_maxX, c_maxY in self.clusters:
+            integral = cv2.integral(frame[minY:maxY, minX:maxX], sdepth=integral_depth)
+            # BGR -> RGB
+            sums[idx] = (integral[c_maxY, c_maxX] - integral[c_minY, c_maxX] -
+                         integral[c_maxY, c_minX] + integral[c_minY, c_minX])[:, 2::-1]
+        return np.rint(sums).astype(np.int64) // self.areas
+
+    def detect_door_states(self, frame):
+        """
+        :return: dict of door name -> DoorStates
+        """
+        averages = self.contours_avg_rgb(frame)
+        door_states = {}
+        if self.single_shot_doors or self.frame_diff_doors:
+            labs = rgb_to_lab(averages)
+            differences = delta_e_cmc(labs[self.compared_idx],
+                                      np.concatenate([labs[self.frame_diff_idx + 1], self.single_shot_targets]))
+            frame_diff_differences = differences[:len(self.frame_diff_doors)].tolist()
+            for door, difference in zip(self.frame_diff_doors, frame_diff_differences):
+                door_states[door] = DoorStates.DOOR_OPEN if difference > self.detectors[door].threshold \
+                    else DoorStates.DOOR_CLOSED
+            single_shot_differences = differences[len(self.frame_diff_doors):].reshape(-1, 2)
+            single_shot_targets = np.argmin(single_shot_differences, axis=1).tolist()
+            for door, target in zip(self.single_shot_doors, single_shot_targets):
+                door_states[door] = self.detectors[door].target_states[target]
+        for door in self.other_doors:
+            door_states[door] = self.detectors[door].door_state_from_avg(averages[self.contour_slices[door]])
+        return door_states
+
+    def show_detection(self, output_frame, door_states):
+        for door, door_state in door_states.items():
+            self.detectors[door].show_detection(output_frame, door_state)
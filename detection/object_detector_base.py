@@ -1,10 +1,16 @@
 import logging
 import threading
+from datetime import datetime
 
+import cv2
+import numpy as np
+import pascal_voc_writer
 from termcolor import colored
 
 from detection.StateDetectorBase import StateDetectorBase
+from detection.detection_cache import DetectionCache
 from lib.constants import DetectorType
+from lib.masks import Mask, mask_key
 
 log = logging.getLogger(__name__)
 
@@ -14,7 +20,21 @@ class BaseTFObjectDetector(StateDetectorBase):
         super().__init__()
         self.config = config
         self.ready = False
+        self.label_filters = {}
+        self.rasterized_masks = {}
         self.__cv = threading.Condition()
+        self.detection_cache = self.create_detection_cache()
+
+    def create_detection_cache(self):
+        if not self.config.od_cache_enabled:
+            return None
+        return DetectionCache(self.config.od_cache_size,
+                              self.config.od_cache_hamming_tolerance,
+                              self.config.od_cache_ttl,
+                              self.config.od_cache_location_tolerance)
+
+    def detection_cache_status(self):
+        return self.detection_cache.status() if self.detection_cache else None
 
     def wait_for_ready(self):
         with self.__cv:
@@ -22,24 +42,39 @@ class BaseTFObjectDetector(StateDetectorBase):
                 self.__cv.wait()
             return self.ready
 
+    def create_tf_detector(self):
+        if self.config.tf_detector_type == DetectorType.TF2:
+            from tflib.tf2_util import DetectorTF2
+            return DetectorTF2(self.config.tf_model_path,
+                               self.config.tf_path_to_labelmap)
+        elif self.config.tf_detector_type == DetectorType.TFLITE:
+            from tflib.tflite_util import DetectorTFLite
+            return DetectorTFLite(self.config.tf_model_path,
+                                  self.config.tf_path_to_labelmap,
+                                  num_threads=self.config.tf_num_threads,
+                                  zero_copy=self.config.tf_zero_copy)
+
     def initialize_tf_model(self):
         with self.__cv:
-            if self.config.tf_detector_type == DetectorType.TF2:
-                from tflib.tf2_util import DetectorTF2
-                self.tf_detector = DetectorTF2(self.config.tf_model_path,
-                                               self.config.tf_path_to_labelmap)
-            elif self.config.tf_detector_type == DetectorType.TFLITE:
-                from tflib.tflite_util import DetectorTFLite
-                self.tf_detector = DetectorTFLite(self.config.tf_model_path,
-                                                  self.config.tf_path_to_labelmap)
+            self.load_tf_models()
             self.ready = True
             self.__cv.notifyAll()
 
+    def load_tf_models(self):
+        num_detectors = max(self.config.od_num_workers, 1)
+        if self.config.tf_detector_type == DetectorType.TFLITE:
+            # a tflite interpreter can only be invoked by one thread at a time
+            self.tf_detectors = [self.create_tf_detector() for _ in range(num_detectors)]
+        else:
+            # a TF2 saved model is thread safe and parallelizes on its own
+            self.tf_detectors = [self.create_tf_detector()] * num_detectors
+        self.tf_detector = self.tf_detectors[0]
+
     def apply_od_filters(self, det_boxes, accuracy_threshold=None, box_thresholds=None, masks=None, nmasks=None):
         accuracy_threshold = self.config.tf_accuracy_threshold if accuracy_threshold is None else accuracy_threshold
         box_thresholds = self.config.tf_box_thresholds if box_thresholds is None else box_thresholds
-        masks = self.config.tf_detection_masks if masks is None else masks
-        nmasks = self.config.tf_detection_nmasks if nmasks is None else nmasks
+        masks = self.get_masks(self.config.tf_detection_masks if masks is None else masks)
+        nmasks = self.get_masks(self.config.tf_detection_nmasks if nmasks is None else nmasks)
         filter_labels = self.config.tf_detection_labels
 
         filtered_det_boxes = []
@@ -57,8 +92,7 @@ class BaseTFObjectDetector(StateDetectorBase):
                         if masks:
                             detection_is_masked = True
                             for mask in masks:
-                                mask_minx, mask_miny, mask_maxx, mask_maxy = mask
-                                if minx > mask_minx and maxx < mask_maxx and miny > mask_miny and maxy < mask_maxy:
+                                if mask.contains_box(minx, miny, maxx, maxy):
                                     log.info(colored("detection [%s] allowed by mask [%s]" % (
                                         str((minx, miny, maxx, maxy)), str(mask)), 'grey'))
                                     detection_is_masked = False
@@ -70,8 +104,7 @@ class BaseTFObjectDetector(StateDetectorBase):
                         if not detection_is_masked:
                             if nmasks:
                                 for nmask in nmasks:
-                                    mask_minx, mask_miny, mask_maxx, mask_maxy = nmask
-                                    if minx > mask_minx and maxx < mask_maxx and miny > mask_miny and maxy < mask_maxy:
+                                    if nmask.contains_box(minx, miny, maxx, maxy):
                                         log.info(colored("detection [%s] not allowed by nmask [%s]" % (
                                             str((minx, miny, maxx, maxy)), str(nmask)), 'grey'))
                                         detection_is_masked = True
@@ -81,8 +114,170 @@ class BaseTFObjectDetector(StateDetectorBase):
 
         return filtered_det_boxes
 
-    def detect_image(self, frame, threshold=None, masks=None, nmasks=None):
-        return self.apply_od_filters(
-            self.tf_detector.DetectFromImage(frame),
-            accuracy_threshold=threshold, masks=masks, nmasks=nmasks
-        )
+    def get_masks(self, masks):
+        """
+        :param masks: list of rectangles (minX, minY, maxX, maxY) and/or polygons [(x, y), ...]
+        :return: list of their `Mask`s, which are rasterized only the first time they are asked for
+        """
+        if not masks:
+            return masks
+        key = tuple(mask_key(mask) for mask in masks)
+        rasterized = self.rasterized_masks.get(key)
+        if rasterized is None:
+            rasterized = [Mask(mask) for mask in masks]
+            self.rasterized_masks[key] = rasterized
+        return rasterized
+
+    def label_filter(self, label_names, filter_labels):
+        """
+        :return: boolean array indexed by class id, True for the classes whose label is in filter_labels
+        """
+        key = (id(label_names), tuple(filter_labels))
+        allowed = self.label_filters.get(key)
+        if allowed is None:
+            allowed = np.array([label in filter_labels for label in label_names], dtype=bool)
+            self.label_filters[key] = allowed
+        return allowed
+
+    def apply_od_filters_raw(self, raw_detections, label_names, accuracy_threshold=None, box_thresholds=None,
+                             masks=None, nmasks=None):
+        """
+        vectorized version of `apply_od_filters` which works directly on the raw detector output
+        and only builds the box tuples for the detections which pass all the filters
+
+        :param raw_detections: (pixel boxes, class ids, scores) arrays, pixel boxes being (minx, miny, maxx, maxy) rows
+        :param label_names: array of label names indexed by class id
+        """
+        accuracy_threshold = self.config.tf_accuracy_threshold if accuracy_threshold is None else accuracy_threshold
+        box_thresholds = self.config.tf_box_thresholds if box_thresholds is None else box_thresholds
+        masks = self.get_masks(self.config.tf_detection_masks if masks is None else masks)
+        nmasks = self.get_masks(self.config.tf_detection_nmasks if nmasks is None else nmasks)
+        filter_labels = self.config.tf_detection_labels
+
+        pixel_boxes, class_ids, scores = raw_detections
+        passed = (scores > accuracy_threshold) & (scores <= 1.0)
+        if filter_labels is not None:
+            passed &= self.label_filter(label_names, filter_labels)[class_ids]
+        if not passed.any():
+            return []
+
+        minx, miny, maxx, maxy = pixel_boxes.T
+        if box_thresholds:
+            too_small = passed & ((maxx - minx < box_thresholds[0]) | (maxy - miny < box_thresholds[1]))
+            for i in np.flatnonzero(too_small):
+                log.info(colored("detection [%s] smaller than box thresholds [%s]" % (
+                    str(tuple(pixel_boxes[i].tolist())), str(box_thresholds)), 'grey'))
+            passed &= ~too_small
+
+        if masks:
+            allowed = np.zeros_like(passed)
+            for mask in masks:
+                allowed |= mask.contains(pixel_boxes)
+            for i in np.flatnonzero(passed & ~allowed):
+                log.info(colored("detection [%s] NOT allowed by any mask" % str(tuple(pixel_boxes[i].tolist())),
+                                 'grey'))
+            passed &= allowed
+
+        if nmasks:
+            for nmask in nmasks:
+                masked = passed & nmask.contains(pixel_boxes)
+                for i in np.flatnonzero(masked):
+                    log.info(colored("detection [%s] not allowed by nmask [%s]" % (
+                        str(tuple(pixel_boxes[i].tolist())), str(nmask)), 'grey'))
+                passed &= ~masked
+
+        survivors = np.flatnonzero(passed)
+        return [tuple(pixel_boxes[i].tolist()) + (label_names[class_ids[i]], float(scores[i])) for i in survivors]
+
+    def detection_image_path(self, label, ts):
+        return "%s/detection_%s_%s.jpg" % (
+            self.config.tf_output_detection_path, label,
+            datetime.fromtimestamp(ts).strftime("%d-%m-%Y-%H-%M-%S-%f"))
+
+    def render_detections(self, frame, orig_boxes):
+        """
+        draws all the detected boxes on a single copy of the frame (blurred if configured to)
+        """
+        if self.config.od_blur_output_frame:
+            outputFrame = cv2.blur(frame, (80, 80))
+        else:
+            outputFrame = frame.copy()
+        for orig_box in orig_boxes:
+            outputFrame = self.tf_detector.DisplayDetection(outputFrame, orig_box)
+        return outputFrame
+
+    def write_detections(self, outputFrame, frame_shape, detections):
+        """
+        writes the frame with the detections drawn on it and/or the pascal VOC annotations
+        of the detections, if configured to. the frame is encoded only once and written to
+        every distinct image path of the detections
+
+        :param detections: list of (box, image path)
+        """
+        image_paths = list(dict.fromkeys(image_path for (box, image_path) in detections))
+        if self.config.tf_od_frame_write:
+            (flag, encodedImage) = cv2.imencode(".jpg", outputFrame)
+            if flag:
+                for image_path in image_paths:
+                    encodedImage.tofile(image_path)
+        if self.config.tf_od_annotation_write:
+            imH, imW, _ = frame_shape
+            for image_path in image_paths:
+                writer = pascal_voc_writer.Writer(image_path, imW, imH)
+                for (minX, minY, maxX, maxY, klass, confidence), box_image_path in detections:
+                    if box_image_path == image_path:
+                        writer.addObject(klass, minX, minY, maxX, maxY)
+                writer.save(image_path.replace('.jpg', '.xml'))
+
+    def frame_detections(self, det_boxes, crop_offset, ts):
+        """
+        :param det_boxes: filtered detected boxes of a crop
+        :return: list of (box, image path) of the detections in full frame coordinates
+        """
+        cropOffsetX, cropOffsetY = crop_offset
+        return [((minx + cropOffsetX, miny + cropOffsetY, maxx + cropOffsetX, maxy + cropOffsetY, label, accuracy),
+                 self.detection_image_path(label, ts)) for (minx, miny, maxx, maxy, label, accuracy) in det_boxes]
+
+    def cached_detections(self, cropped_frame, crop_box):
+        """
+        look a crop up in the detection cache
+        :param crop_box: (minx, miny, maxx, maxy) box of the crop in the full frame
+        :return: (cache key, (filtered detected boxes, ts of the detection) of the cached crop or None on a miss).
+                 the cache key is None if the cache is disabled
+        """
+        if not self.detection_cache:
+            return None, None
+        cache_key = self.detection_cache.key(cropped_frame, crop_box)
+        return cache_key, self.detection_cache.get(cache_key)
+
+    def cache_detections(self, cache_key, det_boxes, ts):
+        """
+        cache the detections of a crop which missed the cache. the ts of the detection is cached along, as the
+        image path of the (artifacts of the) detections the later hits refer to
+        """
+        if cache_key is not None:
+            self.detection_cache.put(cache_key, (det_boxes, ts))
+
+    def detect_image(self, frame, threshold=None, masks=None, nmasks=None, tf_detector=None):
+        return self.detect_images([frame], threshold=threshold, masks=masks, nmasks=nmasks,
+                                  tf_detector=tf_detector)[0]
+
+    def detect_images(self, frames, threshold=None, masks=None, nmasks=None, tf_detector=None):
+        """
+        detect objects in a batch of frames with a single inference
+        :return: list of filtered detected boxes for every frame
+        """
+        tf_detector = self.tf_detector if tf_detector is None else tf_detector
+        return [self.apply_od_filters_raw(raw_detections, tf_detector.label_names,
+                                          accuracy_threshold=threshold, masks=masks, nmasks=nmasks)
+                for raw_detections in tf_detector.DetectRawFromImages(frames)]
+
+    def detect_prepared(self, prepared, threshold=None, masks=None, nmasks=None, tf_detector=None):
+        """
+        detect objects in a batch of frames which was already preprocessed by `tf_detector.PrepareImages`
+        :return: list of filtered detected boxes for every frame
+        """
+        tf_detector = self.tf_detector if tf_detector is None else tf_detector
+        return [self.apply_od_filters_raw(raw_detections, tf_detector.label_names,
+                                          accuracy_threshold=threshold, masks=masks, nmasks=nmasks)
+                for raw_detections in tf_detector.DetectRawFromPrepared(prepared)]
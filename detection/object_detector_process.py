@@ -0,0 +1,282 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+import numpy as np
+
+from detection.object_detector_base import BaseTFObjectDetector
+from detection.object_detector_streaming import StreamingTFObjectDetector, ResultKind
+from lib import setup_logging
+from lib.framelimiter import FrameLimiter
+from lib.shared_frames import SharedFramePool, SharedFrameReader
+from lib.task_queue import BlockingTaskSingleton, DroppedTasks
+
+log = logging.getLogger(__name__)
+
+
+def od_worker_process(config, worker_id, job_q, result_q):
+    """
+    runs in a separate process. reads frames from the shared memory slots named in the jobs,
+    runs the detector and the od filters on the crop, writes the detection artifacts and draws
+    the output frame back into the slot. only the (small) filtered boxes are sent back, the detections of
+    the crops which hit the detection cache of the worker are neither drawn nor written again.
+    the sequence numbers of a batch are sent before it's detected, so that the jobs of a worker
+    which dies can be failed by the main process. a job which fails is reported as skipped.
+    the status of the worker's detection cache is sent after every batch
+    """
+    setup_logging()
+    od = BaseTFObjectDetector(config)
+    od.tf_detector = od.create_tf_detector()
+    reader = SharedFrameReader()
+    result_q.put((worker_id, None))
+
+    stopped = False
+    while not stopped:
+        jobs = [job_q.get()]
+        while len(jobs) < max(config.od_batch_size, 1):
+            try:
+                jobs.append(job_q.get_nowait())
+            except queue.Empty:
+                break
+        if None in jobs:
+            jobs = jobs[:jobs.index(None)]
+            stopped = True
+        if not jobs:
+            break
+        result_q.put((worker_id, [job[0] for job in jobs]))
+
+        # job index -> (ResultKind, detections in full frame coordinates)
+        results = {}
+        frames = {}
+        detected, cropped_frames, cache_keys = [], [], []
+        for i, (seq, slot_name, shape, dtype, crop, ts) in enumerate(jobs):
+            try:
+                frames[i] = reader.get(slot_name, shape, dtype)
+            except Exception:
+                log.exception("reading the frame of job [%d] failed in worker [%d]" % (seq, worker_id))
+                results[i] = (ResultKind.SKIPPED, None)
+                continue
+            (minX, minY, maxX, maxY) = crop
+            cropped_frame = frames[i][minY:maxY, minX:maxX]
+            cache_key, cached = od.cached_detections(cropped_frame, crop)
+            if cached is not None:
+                det_boxes, detected_ts = cached
+                results[i] = (ResultKind.CACHED, od.frame_detections(det_boxes, (minX, minY), detected_ts))
+                continue
+            detected.append(i)
+            cache_keys.append(cache_key)
+            cropped_frames.append(np.copy(cropped_frame))
+
+        batch_det_boxes = []
+        try:
+            if len(cropped_frames) == 1:
+                batch_det_boxes = [od.detect_image(cropped_frames[0])]
+            elif cropped_frames:
+                batch_det_boxes = od.detect_images(cropped_frames)
+        except Exception:
+            log.exception("object detection failed in worker [%d]" % worker_id)
+            batch_det_boxes = [None] * len(detected)
+        for i, cache_key, det_boxes in zip(detected, cache_keys, batch_det_boxes):
+            if det_boxes is None:
+                results[i] = (ResultKind.SKIPPED, None)
+                continue
+            (seq, slot_name, shape, dtype, (minX, minY, maxX, maxY), ts) = jobs[i]
+            od.cache_detections(cache_key, det_boxes, ts)
+            results[i] = (ResultKind.DETECTED, od.frame_detections(det_boxes, (minX, minY), ts))
+
+        for i, (seq, slot_name, shape, dtype, crop, ts) in enumerate(jobs):
+            kind, detections = results[i]
+            if kind == ResultKind.DETECTED and len(detections) > 0:
+                frame = frames[i]
+                try:
+                    output_frame = od.render_detections(frame, [orig_box for (orig_box, image_path) in detections])
+                    od.write_detections(output_frame, frame.shape, detections)
+                    # the slot is owned by this job till the main process releases it
+                    np.copyto(frame, output_frame)
+                except Exception:
+                    log.exception("writing the detections of job [%d] failed in worker [%d]" % (seq, worker_id))
+            result_q.put((worker_id, (seq, kind, detections)))
+        if od.detection_cache:
+            result_q.put((worker_id, od.detection_cache.status()))
+
+    reader.close()
+    result_q.put((worker_id, -1))
+
+
+class ProcessTFObjectDetector(StreamingTFObjectDetector):
+    """
+    object detector which runs the detectors in `od_num_workers` worker processes so that
+    the python heavy parts of detection (od filters, box extraction, drawing and writing the
+    detections) are not bound to the GIL of the main process.
+    frames are handed over through shared memory slots instead of being pickled
+    """
+
+    def __init__(self, config, broker_q: BlockingTaskSingleton):
+        super().__init__(config, broker_q)
+        self.num_workers = max(self.config.od_num_workers, 1)
+        self.frame_pool = SharedFramePool(max(self.config.od_shared_frame_slots, self.num_workers),
+                                          metric_prefix='od_shared_frame_pool')
+        self.mp_context = multiprocessing.get_context('spawn')
+        self.job_q = self.mp_context.Queue()
+        self.result_q = self.mp_context.Queue()
+        self.worker_processes = []
+        self.in_flight = {}
+        # worker id -> sequence numbers of the batch the worker is detecting
+        self.taken = {}
+        # worker id -> status of the detection cache of the worker
+        self.worker_cache_status = {}
+
+    def create_detection_cache(self):
+        # every worker process caches the detections of its own detector
+        return None
+
+    def create_detection_writer(self):
+        # the workers write the detection artifacts themselves
+        return None
+
+    def detection_cache_status(self):
+        """
+        :return: the status of the detection caches of all the workers, summed up
+        """
+        if not self.config.od_cache_enabled:
+            return None
+        worker_cache_status = list(self.worker_cache_status.values())
+        return {key: sum(status[key] for status in worker_cache_status) for key in ['size', 'hits', 'misses']}
+
+    def stop(self):
+        super().stop()
+        # the committed results were read from the slots, they're not needed anymore
+        self.frame_pool.close()
+
+    def is_alive(self):
+        return super().is_alive() and all(p.is_alive() for p in self.worker_processes)
+
+    def load_tf_models(self):
+        self.tf_detectors = []
+        for worker_id in range(self.num_workers):
+            p = self.mp_context.Process(target=od_worker_process,
+                                        args=(self.config, worker_id, self.job_q, self.result_q))
+            p.daemon = True
+            p.start()
+            self.worker_processes.append(p)
+
+        # wait for all the workers to load their model
+        loaded_workers = 0
+        while loaded_workers < self.num_workers:
+            try:
+                self.result_q.get(timeout=1)
+                loaded_workers += 1
+            except queue.Empty:
+                if not all(p.is_alive() for p in self.worker_processes):
+                    raise RuntimeError("an object detector worker process died while loading its model")
+
+        t = threading.Thread(target=self.collect_results)
+        t.daemon = True
+        t.start()
+        self.worker_threads.append(t)
+
+    def detect_continuously(self):
+        self.initialize_tf_model()
+
+        limiter = FrameLimiter(self.config.od_frame_rate)
+        stopped = False
+        while not stopped:
+            for task in self.input_frame_q.dequeue_batch(1):
+                if task == -1:
+                    stopped = True
+                    break
+                seq = self.reorder_buffer.next_sequence()
+                if isinstance(task, DroppedTasks):
+                    self.reorder_buffer.complete(seq, (None, task.max_ts, ResultKind.SKIPPED, None))
+                    continue
+                (frame, cropped_frame, crop_offset, ts) = task
+                if not ts:
+                    ts = time.time()
+                if self.task_skipper.skip_task(ts):
+                    self.reorder_buffer.complete(seq, (None, ts, ResultKind.SKIPPED, None))
+                    continue
+                crop = self.crop_box(cropped_frame, crop_offset)
+                if self.object_tracker:
+                    # the tracks are kept by this process, the detections are carried over without a worker
+                    carried_detections = self.object_tracker.track(crop, ts)
+                    if carried_detections is not None:
+                        self.reorder_buffer.complete(seq, (None, ts, ResultKind.CARRIED_OVER,
+                                                           (None, None, crop, carried_detections)))
+                        continue
+                limiter.limit()
+                slot_id, slot_name = self.frame_pool.acquire(frame)
+                self.in_flight[seq] = (slot_id, frame.shape, frame.dtype, crop, ts)
+                self.job_q.put((seq, slot_name, frame.shape, frame.dtype.str, crop, ts))
+
+        for _ in self.worker_processes:
+            self.job_q.put(None)
+        for p in self.worker_processes:
+            p.join()
+
+    def collect_results(self):
+        live_workers = set(range(self.num_workers))
+        died = False
+        while live_workers:
+            try:
+                worker_id, result = self.result_q.get(timeout=1)
+            except queue.Empty:
+                for worker_id in list(live_workers):
+                    if not self.worker_processes[worker_id].is_alive():
+                        log.error("object detector worker [%d] died" % worker_id)
+                        live_workers.discard(worker_id)
+                        died = True
+                        self.fail_jobs(self.taken.pop(worker_id, []))
+                continue
+            if result == -1:
+                live_workers.discard(worker_id)
+            elif isinstance(result, list):
+                self.taken[worker_id] = set(result)
+            elif isinstance(result, dict):
+                self.worker_cache_status[worker_id] = result
+            else:
+                seq, kind, detections = result
+                self.taken[worker_id].discard(seq)
+                self.complete_job(seq, kind, detections)
+        if died:
+            # no worker is left to detect the frames, stop taking them
+            self.input_frame_q.abrupt_stop(-1)
+        self.fail_jobs(self.in_flight)
+
+    def complete_job(self, seq, kind, detections):
+        slot_id, shape, dtype, crop, ts = self.in_flight.pop(seq)
+        self.reorder_buffer.complete(seq, (slot_id, ts, kind, (shape, dtype, crop, detections)))
+
+    def fail_jobs(self, seqs):
+        """
+        completes the jobs as skipped, so that the jobs queued after them get committed
+        """
+        for seq in sorted(seqs):
+            if seq in self.in_flight:
+                self.complete_job(seq, ResultKind.SKIPPED, None)
+
+    def commit_task(self, result):
+        """
+        called strictly in the order in which tasks were queued
+        """
+        slot_id, ts, kind, detection_result = result
+        if kind == ResultKind.DETECTED:
+            self.fps.count()
+            shape, dtype, crop, detections = detection_result
+            if len(detections) > 0:
+                for detection in detections:
+                    self.config.tf_detection_buffer.add_detection(detection)
+                self.publish_output_frame(self.frame_pool.get(slot_id, shape, dtype).copy())
+                label, accuracy, image_path = self.config.tf_detection_buffer.get_max_accuracy_label()
+                self.process_detection_final(label, accuracy, image_path, ts)
+        elif kind in (ResultKind.CARRIED_OVER, ResultKind.CACHED):
+            # not an inference, the object tracker (or the worker's detection cache) counts it
+            shape, dtype, crop, detections = detection_result
+            self.process_reused_detections(detections, ts)
+        if self.object_tracker and kind in (ResultKind.DETECTED, ResultKind.CACHED):
+            self.object_tracker.update(crop, detections, ts)
+        if slot_id is not None:
+            self.frame_pool.release(slot_id)
+        if ts is not None:
+            self.latest_committed_offset = ts
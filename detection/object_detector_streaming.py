@@ -1,31 +1,73 @@
+import logging
 import threading
 import time
-from datetime import datetime
+from enum import Enum
 
 import cv2
 import numpy as np
-import pascal_voc_writer
 
+from detection.detection_writer import AsyncDetectionWriter
 from detection.object_detector_base import BaseTFObjectDetector
+from detection.object_tracker import ObjectTracker
 from detection.state_managers.state_manager import CommittedOffset
 from lib.fps import FPS
 from lib.framelimiter import FrameLimiter
-from lib.task_queue import BlockingTaskSingleton, NonBlockingTaskSingleton, BlockingTaskQueue
+from lib.reorder_buffer import ReorderBuffer
+from lib.task_queue import BlockingTaskSingleton, NonBlockingTaskSingleton, DeadlineTaskQueue, DroppedTasks
 from notifier import NotificationTypes
 
+log = logging.getLogger(__name__)
+
+
+class ResultKind(Enum):
+    # not detected: dropped, skipped, or failed
+    SKIPPED = 0
+    # detected by an inference
+    DETECTED = 1
+    # the detections of the objects tracked in the crop, carried over by the object tracker
+    CARRIED_OVER = 2
+    # the detections of a near identical crop, from the detection cache
+    CACHED = 3
+
 
 class StreamingTFObjectDetector(BaseTFObjectDetector):
     def __init__(self, config, broker_q: BlockingTaskSingleton):
         super().__init__(config)
-        self.input_frame_q = BlockingTaskQueue(max_size=self.config.od_task_q_size, metric_prefix='object_detector')
+        self.input_frame_q = DeadlineTaskQueue(max_size=self.config.od_task_q_size,
+                                               max_age=self.config.od_max_frame_age,
+                                               max_lag=self.config.od_max_lag_frames,
+                                               coalesce_window=self.config.od_coalesce_window,
+                                               metric_prefix='object_detector')
         self.fps = FPS(600, 100)
 
         self.latest_committed_offset = CommittedOffset.CURRENT
         self.broker_q = broker_q
         self.output_video_frame_q = NonBlockingTaskSingleton(metric_prefix='od_video_frame_q')
         self.active_video_feeds = 0
+        self.dequeue_lock = threading.Lock()
+        # the results of up to two batches per worker wait to be committed
+        self.reorder_buffer = ReorderBuffer(self.commit_task, max_pending=2 * max(self.config.od_num_workers, 1) *
+                                            max(self.config.od_batch_size, 1), metric_prefix='od_reorder_buffer')
+        self.worker_threads = []
+        self.detection_writer = self.create_detection_writer()
+        self.object_tracker = None
+        if self.config.od_tracker_enabled:
+            self.object_tracker = ObjectTracker(self.config.od_tracker_iou_threshold,
+                                                self.config.od_tracker_max_centroid_distance,
+                                                self.config.od_tracker_reinference_frames,
+                                                self.config.od_tracker_max_misses,
+                                                self.config.od_tracker_max_age)
+
+    def create_detection_writer(self):
+        if not self.config.od_async_writer:
+            return None
+        return AsyncDetectionWriter(self, self.config.od_writer_threads, self.config.od_writer_q_size)
 
     def start(self):
+        # the results are committed in queue order by a single thread, off the workers
+        self.commit_thread = threading.Thread(target=self.reorder_buffer.process_continuously, args=())
+        self.commit_thread.daemon = True
+        self.commit_thread.start()
         self.t = threading.Thread(target=self.detect_continuously, args=())
         self.t.daemon = True
         self.t.start()
@@ -33,68 +75,255 @@ class StreamingTFObjectDetector(BaseTFObjectDetector):
 
     def stop(self):
         self.input_frame_q.abrupt_stop(-1)
-        if self.t.is_alive():
-            self.t.join()
+        for t in [self.t] + self.worker_threads:
+            if t.is_alive():
+                t.join()
+        # the workers are done, the commit thread returns once their results are committed
+        self.reorder_buffer.stop()
+        if self.commit_thread.is_alive():
+            self.commit_thread.join()
+        if self.detection_writer:
+            self.detection_writer.stop()
         self.fps.stop()
 
     def is_alive(self):
-        return self.t.is_alive()
+        return self.t.is_alive() and self.commit_thread.is_alive() and all(t.is_alive() for t in self.worker_threads)
 
     def add_task(self, task):
         self.input_frame_q.enqueue(task)
 
+    def get_current_lag(self):
+        """
+        :return: number of tasks which are either queued or being detected, and are not committed yet
+        """
+        return self.input_frame_q.size() + self.reorder_buffer.pending()
+
     def detect_continuously(self):
         self.initialize_tf_model()
+        if self.config.od_pipelined and self.config.tf_zero_copy:
+            log.warning("od_pipelined prepares the frames into buffers of its own which are copied into the "
+                        "interpreter, tf_zero_copy only applies to its outputs")
+
+        # every detector in the pool gets its own worker thread, all of them
+        # consume the same task queue and commit their results in queue order
+        for tf_detector in self.tf_detectors[1:]:
+            self.start_worker_thread(self.detect_worker, tf_detector)
+
+        self.detect_worker(self.tf_detectors[0])
+
+    def start_worker_thread(self, target, *args):
+        t = threading.Thread(target=target, args=args)
+        t.daemon = True
+        t.start()
+        self.worker_threads.append(t)
+
+    def dequeue_tasks(self):
+        """
+        :return: (tasks, sequence number of the first task, whether the stop element was seen)
+        """
+        with self.dequeue_lock:
+            tasks = self.input_frame_q.dequeue_batch(max(self.config.od_batch_size, 1))
+            stopped = -1 in tasks
+            if stopped:
+                tasks = tasks[:tasks.index(-1)]
+                # let the other workers see the stop element as well
+                self.input_frame_q.abrupt_stop(-1)
+            seq = self.reorder_buffer.next_sequence(len(tasks))
+        return tasks, seq, stopped
+
+    def detect_worker(self, tf_detector):
+        frame_rate = self.config.od_frame_rate
+        if frame_rate > 0:
+            frame_rate = frame_rate / len(self.tf_detectors)
+        limiter = FrameLimiter(frame_rate)
+        if self.config.od_pipelined:
+            self.detect_worker_pipelined(tf_detector, limiter)
+            return
 
-        limiter = FrameLimiter(self.config.od_frame_rate)
         while True:
-            task = self.input_frame_q.dequeue()
-            if task == -1:
+            tasks, seq, stopped = self.dequeue_tasks()
+            for i, result in enumerate(self.detect_tasks(tasks, limiter, tf_detector)):
+                self.reorder_buffer.complete(seq + i, result)
+            if stopped:
                 break
-            (frame, cropped_frame, (cropOffsetX, cropOffsetY), ts) = task
-            if not self.task_skipper.skip_task(ts):
+
+    def detect_worker_pipelined(self, tf_detector, limiter):
+        """
+        runs the worker as a 3 stage pipeline. while this thread runs the inference of batch N,
+        a prepare thread dequeues and preprocesses batch N+1 and the commit thread processes
+        the side effects (drawing, writing, notifying) of batch N-1
+        """
+        prepared_q = BlockingTaskSingleton()
+        self.start_worker_thread(self.prepare_continuously, tf_detector, limiter, prepared_q)
+        while True:
+            prepared = prepared_q.dequeue()
+            if prepared == -1:
+                break
+            seq, results, cache_keys, prepared_input = prepared
+            batch_det_boxes = []
+            if prepared_input is not None:
+                batch_det_boxes = self.detect_prepared(prepared_input, tf_detector=tf_detector)
+            for i, result in enumerate(self.match_detections(results, cache_keys, batch_det_boxes)):
+                self.reorder_buffer.complete(seq + i, result)
+
+    def prepare_continuously(self, tf_detector, limiter, prepared_q):
+        # one input buffer is being invoked, one is waiting in prepared_q and one is being prepared
+        batch_size = max(self.config.od_batch_size, 1)
+        input_buffers = [tf_detector.AllocateInputBuffer(batch_size) for _ in range(3)]
+        num_prepared = 0
+        while True:
+            tasks, seq, stopped = self.dequeue_tasks()
+            results, cropped_frames, cache_keys = self.prepare_tasks(tasks)
+            prepared_input = None
+            if cropped_frames:
                 limiter.limit()
-                self.fps.count()
-                cropped_frame = np.copy(cropped_frame)
-                cropped_frame.setflags(write=1)
-                self.detect_image_buffered(frame, cropped_frame, cropOffsetX, cropOffsetY, ts)
-            self.latest_committed_offset = ts
+                prepared_input = tf_detector.PrepareImages(cropped_frames, input_buffers[num_prepared % 3])
+                num_prepared += 1
+            prepared_q.enqueue((seq, results, cache_keys, prepared_input))
+            if stopped:
+                prepared_q.enqueue(-1)
+                break
+
+    def prepare_tasks(self, tasks):
+        """
+        resolve the tasks which don't need an inference: the skipped ones, the ones whose detections are
+        carried over by the object tracker and the ones which hit the detection cache
+        :return: (list of (task, ResultKind, detections) in the order of tasks, with the kind None for the tasks
+                  which need to be detected, the copied crops of the tasks which need to be detected,
+                  their detection cache keys)
+        """
+        results = []
+        cropped_frames = []
+        cache_keys = []
+        for task in tasks:
+            if isinstance(task, DroppedTasks):
+                results.append((task, ResultKind.SKIPPED, None))
+                continue
+            (frame, cropped_frame, crop_offset, ts) = task
+            if not ts:
+                # the detections (and their cached image paths) are timestamped when they are detected
+                ts = time.time()
+                task = (frame, cropped_frame, crop_offset, ts)
+            if self.task_skipper.skip_task(ts):
+                results.append((task, ResultKind.SKIPPED, None))
+                continue
+            crop_box = self.crop_box(cropped_frame, crop_offset)
+            if self.object_tracker:
+                carried_detections = self.object_tracker.track(crop_box, ts)
+                if carried_detections is not None:
+                    results.append((task, ResultKind.CARRIED_OVER, carried_detections))
+                    continue
+            cache_key, cached = self.cached_detections(cropped_frame, crop_box)
+            if cached is not None:
+                det_boxes, detected_ts = cached
+                results.append((task, ResultKind.CACHED, self.frame_detections(det_boxes, crop_offset, detected_ts)))
+                continue
+            results.append((task, None, None))
+            cache_keys.append(cache_key)
+            cropped_frame = np.copy(cropped_frame)
+            cropped_frame.setflags(write=1)
+            cropped_frames.append(cropped_frame)
+        return results, cropped_frames, cache_keys
+
+    def match_detections(self, results, cache_keys, batch_det_boxes):
+        """
+        :return: list of (task, ResultKind, detections) in the order of tasks. the detections are the detected
+                 boxes of the crop if it was detected, the (box, image path) list of the detections in full frame
+                 coordinates if they are carried over or cached, None if the task was skipped
+        """
+        det_boxes_iter = iter(batch_det_boxes)
+        cache_keys_iter = iter(cache_keys)
+        for i, (task, kind, detections) in enumerate(results):
+            if kind is None:
+                det_boxes = next(det_boxes_iter)
+                self.cache_detections(next(cache_keys_iter), det_boxes, task[3])
+                results[i] = (task, ResultKind.DETECTED, det_boxes)
+        return results
+
+    @staticmethod
+    def crop_box(cropped_frame, crop_offset):
+        cropOffsetX, cropOffsetY = crop_offset
+        cropH, cropW = cropped_frame.shape[:2]
+        return cropOffsetX, cropOffsetY, cropOffsetX + cropW, cropOffsetY + cropH
+
+    def detect_tasks(self, tasks, limiter, tf_detector=None):
+        """
+        run a single (batched) inference over all the tasks which are not skipped
+        :return: list of (task, ResultKind, detections) in the order of tasks
+        """
+        results, cropped_frames, cache_keys = self.prepare_tasks(tasks)
+
+        batch_det_boxes = []
+        if len(cropped_frames) == 1:
+            limiter.limit()
+            batch_det_boxes = [self.detect_image(cropped_frames[0], tf_detector=tf_detector)]
+        elif len(cropped_frames) > 1:
+            limiter.limit()
+            batch_det_boxes = self.detect_images(cropped_frames, tf_detector=tf_detector)
 
-    def detect_image_buffered(self, frame, cropped_frame, cropOffsetX, cropOffsetY, ts):
+        return self.match_detections(results, cache_keys, batch_det_boxes)
+
+    def commit_task(self, result):
+        """
+        called strictly in the order in which tasks were queued
+        """
+        task, kind, detections = result
+        if isinstance(task, DroppedTasks):
+            # the dropped tasks are committed without being detected
+            if task.max_ts is not None:
+                self.latest_committed_offset = task.max_ts
+            return
+        (frame, cropped_frame, crop_offset, ts) = task
+        if kind == ResultKind.DETECTED:
+            self.fps.count()
+            detections = self.process_detections(frame, detections, crop_offset[0], crop_offset[1], ts)
+        elif kind in (ResultKind.CARRIED_OVER, ResultKind.CACHED):
+            # not an inference, the object tracker (or the detection cache) counts it
+            self.process_reused_detections(detections, ts)
+        if self.object_tracker and kind in (ResultKind.DETECTED, ResultKind.CACHED):
+            self.object_tracker.update(self.crop_box(cropped_frame, crop_offset), detections, ts)
+        self.latest_committed_offset = ts
+
+    def process_detections(self, frame, det_boxes, cropOffsetX, cropOffsetY, ts):
+        """
+        :return: list of (box, image path) of the detections in full frame coordinates
+        """
         if not ts:
             ts = time.time()
-        det_boxes = self.detect_image(cropped_frame)
         if det_boxes is not None and len(det_boxes) > 0:
-            for box in det_boxes:
-                minx, miny, maxx, maxy, label, accuracy = box
-                image_path = "%s/detection_%s_%s.jpg" % (
-                    self.config.tf_output_detection_path, label,
-                    datetime.fromtimestamp(ts).strftime("%d-%m-%Y-%H-%M-%S-%f"))
-                orig_box = minx + cropOffsetX, miny + cropOffsetY, maxx + cropOffsetX, maxy + cropOffsetY, label, accuracy
-                self.config.tf_detection_buffer.add_detection((orig_box, image_path))
-                self.process_detection_intermediate(frame, orig_box, image_path)
+            detections = self.frame_detections(det_boxes, (cropOffsetX, cropOffsetY), ts)
+            for detection in detections:
+                self.config.tf_detection_buffer.add_detection(detection)
+            self.process_detections_intermediate(frame, detections)
 
             label, accuracy, image_path = self.config.tf_detection_buffer.get_max_accuracy_label()
             self.process_detection_final(label, accuracy, image_path, ts)
-            return label, accuracy
-
-        return None, None
-
-    def process_detection_intermediate(self, frame, orig_box, image_path):
-        minx, miny, maxx, maxy, label, accuracy = orig_box
-        outputFrame = frame.copy()
-        if self.config.od_blur_output_frame:
-            outputFrame = cv2.blur(outputFrame, (80, 80))
-        outputFrame = self.tf_detector.DisplayDetection(outputFrame, orig_box)
-        if self.config.tf_od_frame_write:
-            cv2.imwrite(image_path,
-                        outputFrame)
-        if self.config.tf_od_annotation_write:
-            imH, imW, _ = frame.shape
-            writer = pascal_voc_writer.Writer(image_path, imW, imH)
-            minX, minY, maxX, maxY, klass, confidence = orig_box
-            writer.addObject(klass, minX, minY, maxX, maxY)
-            writer.save(image_path.replace('.jpg', '.xml'))
+            return detections
+
+        return []
+
+    def process_reused_detections(self, detections, ts):
+        """
+        the detections carried over by the object tracker or hit in the detection cache are only fed to the
+        detection buffer. their image path is the one of the last real detection, so no artifacts are written
+        for them
+        """
+        if not detections:
+            return
+        for detection in detections:
+            self.config.tf_detection_buffer.add_detection(detection)
+        label, accuracy, image_path = self.config.tf_detection_buffer.get_max_accuracy_label()
+        self.process_detection_final(label, accuracy, image_path, ts)
+
+    def process_detections_intermediate(self, frame, detections):
+        if self.detection_writer:
+            self.detection_writer.write(frame, detections)
+        else:
+            outputFrame = self.render_detections(frame, [orig_box for (orig_box, image_path) in detections])
+            self.write_detections(outputFrame, frame.shape, detections)
+            self.publish_output_frame(outputFrame)
+
+    def publish_output_frame(self, outputFrame):
         if self.config.show_fps:
             cv2.putText(outputFrame, "%.2f fps" % self.fps.fps, (10, outputFrame.shape[0] - 10),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 255, 255), 1)
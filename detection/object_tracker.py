@@ -0,0 +1,127 @@
+import logging
+import threading
+
+from termcolor import colored
+
+from lib import counter
+
+log = logging.getLogger(__name__)
+
+
+def box_iou(box_a, box_b):
+    minx_a, miny_a, maxx_a, maxy_a = box_a[:4]
+    minx_b, miny_b, maxx_b, maxy_b = box_b[:4]
+    inter_w = min(maxx_a, maxx_b) - max(minx_a, minx_b)
+    inter_h = min(maxy_a, maxy_b) - max(miny_a, miny_b)
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    union = (maxx_a - minx_a) * (maxy_a - miny_a) + (maxx_b - minx_b) * (maxy_b - miny_b) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def box_centroid_distance(box_a, box_b):
+    minx_a, miny_a, maxx_a, maxy_a = box_a[:4]
+    minx_b, miny_b, maxx_b, maxy_b = box_b[:4]
+    dx = (minx_a + maxx_a - minx_b - maxx_b) / 2
+    dy = (miny_a + maxy_a - miny_b - maxy_b) / 2
+    return (dx * dx + dy * dy) ** 0.5
+
+
+class Track():
+    def __init__(self, box, image_path, ts):
+        self.box = box
+        self.image_path = image_path
+        self.last_seen_ts = ts
+        self.frames_since_inference = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return 'Track%s' % str(self.box)
+
+
+class ObjectTracker():
+    """
+    a lightweight tracker of the objects found by the object detector. it associates the motion crops
+    sent to the object detector with recently detected objects by IoU or centroid distance. while an object
+    is tracked, its last detection is carried over to the crops and the inference is only re-run every
+    `reinference_frames` frames, or when the object is not tracked yet or has been lost
+    """
+
+    def __init__(self, iou_threshold=0.3, max_centroid_distance=50, reinference_frames=5, max_misses=1,
+                 max_age=2, metric_prefix='object_tracker'):
+        """
+        :param iou_threshold: minimum IoU of a motion crop (or a new detection) with a tracked object to associate them
+        :param max_centroid_distance: a motion crop is also associated with a tracked object if their centers
+                                      are at most these many pixels apart
+        :param reinference_frames: number of frames for which a tracked object's detection is carried over before
+                                   the object detector is run on it again
+        :param max_misses: number of inferences which may fail to find a tracked object before it is considered lost
+        :param max_age: seconds after which an object which hasn't been seen is considered lost
+        """
+        self.iou_threshold = iou_threshold
+        self.max_centroid_distance = max_centroid_distance
+        self.reinference_frames = reinference_frames
+        self.max_misses = max_misses
+        self.max_age = max_age
+        self.tracks = []
+        self.lock = threading.Lock()
+        self.metric_prefix = metric_prefix
+
+    def _associated(self, track, box):
+        return box_iou(track.box, box) >= self.iou_threshold or \
+               box_centroid_distance(track.box, box) <= self.max_centroid_distance
+
+    def _expire(self, ts):
+        for track in [track for track in self.tracks if ts - track.last_seen_ts > self.max_age]:
+            log.info(colored("lost track of %s, not seen for %.2f seconds" % (track, ts - track.last_seen_ts), 'grey'))
+            self.tracks.remove(track)
+
+    def track(self, crop_box, ts):
+        """
+        :param crop_box: the (minx, miny, maxx, maxy) box of the motion crop which is to be detected
+        :return: list of (box, image path) detections to carry over to this crop if the inference can be skipped
+                 or None if the object detector needs to be run on it
+        """
+        with self.lock:
+            self._expire(ts)
+            tracks = [track for track in self.tracks if self._associated(track, crop_box)]
+            if not tracks or any(track.frames_since_inference >= self.reinference_frames for track in tracks):
+                for track in tracks:
+                    track.frames_since_inference = 0
+                counter(self.metric_prefix, "inferred").notify(1)
+                return None
+
+            for track in tracks:
+                track.frames_since_inference += 1
+                track.last_seen_ts = ts
+            counter(self.metric_prefix, "carried_over").notify(1)
+            return [(track.box, track.image_path) for track in tracks]
+
+    def update(self, crop_box, detections, ts):
+        """
+        update the tracks with the result of running the object detector on a crop
+        :param detections: list of (box, image path) detected in the crop, in full frame coordinates
+        """
+        with self.lock:
+            updated_tracks = []
+            for (box, image_path) in detections:
+                candidates = [track for track in self.tracks if track not in updated_tracks]
+                best_track = max(candidates, key=lambda track: box_iou(track.box, box), default=None)
+                if best_track is not None and box_iou(best_track.box, box) >= self.iou_threshold:
+                    best_track.box = box
+                    best_track.image_path = image_path
+                    best_track.last_seen_ts = ts
+                    best_track.misses = 0
+                else:
+                    best_track = Track(box, image_path, ts)
+                    self.tracks.append(best_track)
+                    log.info(colored("tracking new object %s" % best_track, 'grey'))
+                updated_tracks.append(best_track)
+
+            for track in list(self.tracks):
+                if track not in updated_tracks and self._associated(track, crop_box):
+                    track.misses += 1
+                    if track.misses > self.max_misses:
+                        log.info(colored("lost track of %s, not detected %d times" % (track, track.misses), 'grey'))
+                        self.tracks.remove(track)
@@ -0,0 +1,449 @@
+import bisect
+import time
+from collections import namedtuple, defaultdict
+from enum import Enum
+
+import numpy as np
+
+from detection.state_managers.state_manager import CommittedOffset
+from detection.states import NotState
+
+"""
+    patterns compiled into an automaton which is advanced incrementally as steps are appended to the
+    state history, instead of re-scanning the state history from every index on every evaluation.
+
+    for every pattern it tracks the partial matches ("runs") that `PatternDetector.find_mov_ptn_in_state_history_at_idx`
+    would find from all the start indexes of the state history at once:
+    - all the start indexes which haven't matched the first (non NotState) step yet behave the same, they
+      are a single "waiting" run
+    - two runs waiting for the same step behave the same from there on, except that the one which matched
+      its previous step later sees fewer steps in a preceding NotState's window. it matches whenever the other
+      one does, so only the later one is kept
+    - runs waiting on a trailing NotState only need the time of their last match and whether a forbidden
+      state was seen after it
+
+    what a run waiting for a step does only depends on the steps of the pattern up to that step, so the patterns
+    are compiled into a trie of their steps and the runs are kept on its nodes: patterns sharing a prefix
+    (e.g. OBJECT_DETECTED, DOOR_OPEN) share its runs, which are advanced once for all of them. appending a step
+    costs O(nodes of the trie waiting for the state of the step), however many patterns there are. the runs are
+    snapshotted after every step, so that the patterns can be evaluated at any `now` (e.g. a lagging committed
+    offset) exactly like `find_mov_ptn_in_state_history` would
+
+    the indexes in the runs are absolute: evicting steps from the front of the state history just moves `base`,
+    the index of the first step left, and drops the snapshots of the evicted steps. the runs remember the index
+    of the step they started from, and the ones which started from an evicted step are ignored from then on
+    (the runs which are kept started from the latest index, so none they replaced started after them)
+"""
+
+
+class PatternMatch(Enum):
+    MATCHED = 0
+    NOT_MATCHED = 1
+    PARTIAL_MATCH = 2
+
+
+Run = namedtuple('Run', 'prev_idx prev_ts doomed start_idx')
+WAITING_RUN = Run(-1, 0, False, -1)
+# runs: node id -> the run waiting for the (non NotState) step of the node
+# pending: node id -> the run which just matched the step before the NotState of the node
+# trailing: node id -> the runs waiting on the trailing NotState of a pattern
+# matched: ids of the last nodes of the patterns which matched -> the latest start index of their matches
+# seen: the first (non NotState) steps of the patterns seen so far -> the index they were last seen at
+# last_seen: (state, (idx, ts)) of the states of the NotStates seen so far
+Snapshot = namedtuple('Snapshot', 'runs pending trailing matched seen last_seen')
+EMPTY_SNAPSHOT = Snapshot({}, {}, {}, {}, {}, ())
+
+
+class TrieNode():
+    """
+    the node of a prefix of the patterns, its runs wait for the last step of the prefix
+    """
+    __slots__ = ('id', 'step', 'prev_step', 'is_not', 'terminal', 'advance', 'targets')
+
+    def __init__(self, id, prefix):
+        self.id = id
+        self.step = prefix[-1]
+        self.prev_step = prefix[-2] if len(prefix) > 1 else None
+        self.is_not = type(self.step) is NotState
+        # whether a pattern ends with the (non NotState) step of the node
+        self.terminal = False
+        # (node, whether it's a trailing NotState) the runs go to when they match the step of the node
+        self.advance = set()
+        # (node, whether it's a trailing NotState) the runs of a NotState node skip to on the next step
+        self.targets = set()
+
+
+class CompiledPattern():
+    def __init__(self, pattern_steps, path):
+        self.pattern_steps = pattern_steps
+        self.is_not = [type(step) is NotState for step in pattern_steps]
+        self.num_steps = len(pattern_steps)
+        # the first step which is not a NotState
+        self.first_idx = next((i for i, is_not in enumerate(self.is_not) if not is_not), None)
+        self.trailing_not_state = pattern_steps[-1] if self.is_not[-1] and self.num_steps > 1 else None
+        # the nodes of the prefixes of the pattern
+        self.path = path
+
+    def skip_not_states(self, ptn_idx):
+        while self.is_not[ptn_idx] and ptn_idx < self.num_steps - 1:
+            ptn_idx += 1
+        return ptn_idx
+
+    def states_to_find(self, ptn_idx):
+        if self.is_not[ptn_idx - 1]:
+            return [self.pattern_steps[ptn_idx], self.pattern_steps[ptn_idx - 1]]
+        return [self.pattern_steps[ptn_idx]]
+
+
+class PatternTrie():
+    def __init__(self, patterns_steps):
+        """
+        :param patterns_steps: the steps of every pattern, the patterns are referred to by their index in it
+        """
+        self.nodes = []
+        self.patterns = []
+        nodes_by_prefix = {}
+        for pattern_steps in patterns_steps:
+            path = []
+            for i in range(len(pattern_steps)):
+                prefix = tuple(pattern_steps[:i + 1])
+                node = nodes_by_prefix.get(prefix)
+                if node is None:
+                    node = nodes_by_prefix[prefix] = TrieNode(len(self.nodes), prefix)
+                    self.nodes.append(node)
+                path.append(node)
+            self.patterns.append(CompiledPattern(pattern_steps, path))
+
+        # the nodes of the first (non NotState) steps of the patterns, where the waiting runs are
+        self.first_nodes = defaultdict(list)
+        # the leading NotStates of the patterns, which the waiting runs check against the steps before them
+        self.leading_not_states = set()
+        # only the last time the states of the NotStates were seen is needed
+        self.not_state_states = set()
+        for ptn in self.patterns:
+            if ptn.first_idx is None:
+                continue
+            self.not_state_states.update(step.state for step in ptn.pattern_steps if type(step) is NotState)
+            first_node = ptn.path[ptn.first_idx]
+            if first_node not in self.first_nodes[first_node.step]:
+                self.first_nodes[first_node.step].append(first_node)
+            if ptn.first_idx > 0:
+                self.leading_not_states.add((ptn.pattern_steps[ptn.first_idx - 1], first_node.step))
+            last_idx = ptn.num_steps - 1
+            if ptn.trailing_not_state is None:
+                ptn.path[last_idx].terminal = True
+            for i, node in enumerate(ptn.path[:last_idx]):
+                if not node.is_not:
+                    node.advance.add((ptn.path[i + 1], ptn.trailing_not_state is not None and i + 1 == last_idx))
+                elif i > ptn.first_idx:
+                    target_idx = ptn.skip_not_states(i)
+                    node.targets.add((ptn.path[target_idx], ptn.trailing_not_state is not None
+                                      and target_idx == last_idx))
+        # the regular nodes by the state they're waiting for
+        self.waiting_nodes = defaultdict(list)
+        for node in self.nodes:
+            if not node.is_not:
+                self.waiting_nodes[node.step].append(node)
+        self.reset()
+
+    def reset(self, states=(), timestamps=()):
+        """
+        rebuild the automaton from the states and the timestamps of the steps of a state history
+        """
+        self.base = 0
+        self.states = []
+        self.timestamps = []
+        self.snapshots = []
+        self.last_seen = {}
+        for state, ts in zip(states, timestamps):
+            self._append(state, ts)
+
+    def insert(self, idx, state_step):
+        """
+        to be called when a step was inserted at index idx of the state history
+        """
+        if idx == len(self.states):
+            self._append(state_step.state, state_step.ts)
+            return
+
+        states = self.states[idx:]
+        timestamps = self.timestamps[idx:]
+        del self.states[idx:]
+        del self.timestamps[idx:]
+        del self.snapshots[idx:]
+        self.last_seen = dict(self.snapshots[-1].last_seen) if self.snapshots else {}
+        self._append(state_step.state, state_step.ts)
+        for state, ts in zip(states, timestamps):
+            self._append(state, ts)
+
+    def evict(self, count):
+        """
+        to be called when the first count steps of the state history were evicted
+        """
+        if count == 0:
+            return
+        if count >= len(self.states):
+            self.reset()
+            return
+        # a waiting run of a pattern starting with a NotState which didn't advance because of an evicted step
+        # advances now: the snapshots are recomputed from the first step which may have been held back
+        recompute_idx, recompute_end = None, 0
+        evicted_last_seen = dict(self.snapshots[count - 1].last_seen)
+        for (not_state, first_step) in self.leading_not_states:
+            last_seen = evicted_last_seen.get(not_state.state)
+            if last_seen is None or last_seen[0] < self.base:
+                continue
+            # the steps held back by it are the ones within its duration, till the state is seen again
+            for i in range(count, bisect.bisect_right(self.timestamps, last_seen[1] + not_state.duration)):
+                if self.states[i] == first_step:
+                    recompute_idx = i if recompute_idx is None else min(recompute_idx, i)
+                    recompute_end = max(recompute_end, i + 1)
+                if self.states[i] == not_state.state:
+                    break
+
+        self.base += count
+        del self.states[:count]
+        del self.timestamps[:count]
+        del self.snapshots[:count]
+        self.last_seen = {state: seen for state, seen in self.last_seen.items() if seen[0] >= self.base}
+        if recompute_idx is None:
+            return
+
+        i = recompute_idx - count
+        self.last_seen = dict(self._live(self.snapshots[i - 1]).last_seen) if i > 0 else {}
+        for i in range(i, len(self.states)):
+            snapshot = self._step(self.snapshots[i - 1] if i > 0 else EMPTY_SNAPSHOT,
+                                  self.base + i, self.states[i], self.timestamps[i])
+            if i >= recompute_end - count and self._live(snapshot) == self._live(self.snapshots[i]):
+                # from here on the snapshots are the same as they were, but for the evicted runs
+                break
+            self.snapshots[i] = snapshot
+        self.last_seen = dict(self._live(self.snapshots[-1]).last_seen)
+
+    def _live(self, snapshot):
+        """
+        :return: the snapshot without the runs which started from evicted steps
+        """
+        base = self.base
+        return Snapshot({node_id: run for node_id, run in snapshot.runs.items() if run.start_idx >= base},
+                        {node_id: run for node_id, run in snapshot.pending.items() if run.start_idx >= base},
+                        {node_id: live_runs for node_id, live_runs in
+                         ((node_id, tuple(run for run in runs if run.start_idx >= base))
+                          for node_id, runs in snapshot.trailing.items()) if live_runs},
+                        {node_id: start_idx for node_id, start_idx in snapshot.matched.items() if start_idx >= base},
+                        {state: idx for state, idx in snapshot.seen.items() if idx >= base},
+                        # in any order, the order of the states seen differs once the earlier ones are evicted
+                        frozenset((state, seen) for state, seen in snapshot.last_seen if seen[0] >= base))
+
+    def _not_state_seen(self, not_state, prev_idx, ts):
+        """
+        whether the NotState's state was seen after prev_idx and within its duration before ts
+        (the last time the state was seen is the latest one, as the state history is sorted)
+        """
+        last_seen = self.last_seen.get(not_state.state)
+        return last_seen is not None and last_seen[0] > prev_idx and last_seen[0] >= self.base and \
+            ts - last_seen[1] <= not_state.duration
+
+    def _append(self, state, ts):
+        idx = self.base + len(self.states)
+        self.states.append(state)
+        self.timestamps.append(ts)
+        self.snapshots.append(self._step(self.snapshots[-1] if self.snapshots else EMPTY_SNAPSHOT, idx, state, ts))
+
+    def _step(self, prev, idx, state, ts):
+        """
+        :return: the snapshot after the step of absolute index idx, given the snapshot before it
+        """
+        base = self.base
+        runs = {node_id: run for node_id, run in prev.runs.items() if run.start_idx >= base}
+        pending = {}
+        new_trailing = defaultdict(list)
+        matched = prev.matched
+
+        def arrive(node, run):
+            current = runs.get(node.id)
+            if current is None or (current.prev_idx, current.start_idx) < (run.prev_idx, run.start_idx):
+                runs[node.id] = run
+
+        def advance(node, run):
+            """
+            a run waiting for the step of the node, which is this step
+            """
+            nonlocal matched
+            if type(node.prev_step) is NotState and self._not_state_seen(node.prev_step, run.prev_idx, ts):
+                return
+            start_idx = idx if run is WAITING_RUN else run.start_idx
+            if node.terminal and matched.get(node.id, -1) < start_idx:
+                matched = dict(matched)
+                matched[node.id] = start_idx
+            new_run = Run(idx, ts, False, start_idx)
+            for (next_node, trailing) in node.advance:
+                if trailing:
+                    new_trailing[next_node].append(new_run)
+                elif next_node.is_not:
+                    if next_node.id not in pending or pending[next_node.id].start_idx < start_idx:
+                        pending[next_node.id] = new_run
+                else:
+                    arrive(next_node, new_run)
+
+        advancing = [(node, runs[node.id]) for node in self.waiting_nodes.get(state, ()) if node.id in runs]
+        for (node, run) in advancing:
+            del runs[node.id]
+        # the runs which just matched the step before a NotState skip it
+        for node_id, run in prev.pending.items():
+            if run.start_idx < base:
+                continue
+            for (target, trailing) in self.nodes[node_id].targets:
+                if trailing:
+                    new_trailing[target].append(run)
+                elif target.step == state:
+                    advancing.append((target, run))
+                else:
+                    arrive(target, run)
+        advancing.extend((node, WAITING_RUN) for node in self.first_nodes.get(state, ()))
+        for (node, run) in advancing:
+            advance(node, run)
+
+        trailing_runs = prev.trailing
+        if trailing_runs or new_trailing:
+            trailing_runs = dict(trailing_runs)
+            for node in {self.nodes[node_id] for node_id in prev.trailing} | set(new_trailing):
+                not_state = node.step
+                kept_trailing = []
+                # runs which skipped a NotState to get here matched their previous step before this one,
+                # so this step can already fail them
+                for run in prev.trailing.get(node.id, ()) + tuple(new_trailing.get(node, ())):
+                    if run.start_idx < base:
+                        continue
+                    if run.prev_idx < idx:
+                        if ts - run.prev_ts > not_state.duration:
+                            # no later `now` can see this run as a partial match anymore
+                            if not run.doomed and matched.get(node.id, -1) < run.start_idx:
+                                matched = dict(matched)
+                                matched[node.id] = run.start_idx
+                            continue
+                        if not_state.state == state:
+                            if not_state.duration == np.inf:
+                                continue
+                            run = run._replace(doomed=True)
+                    kept_trailing.append(run)
+                kept_trailing.sort(key=lambda run: (run.prev_idx, run.start_idx))
+                if not_state.duration == np.inf:
+                    # these can only be partial matches, the latest one says as much as all of them
+                    kept_trailing = kept_trailing[-1:]
+                if kept_trailing:
+                    trailing_runs[node.id] = tuple(kept_trailing)
+                else:
+                    trailing_runs.pop(node.id, None)
+
+        seen = prev.seen
+        if state in self.first_nodes:
+            seen = dict(seen)
+            seen[state] = idx
+        last_seen = prev.last_seen
+        if state in self.not_state_states:
+            self.last_seen[state] = (idx, ts)
+            last_seen = tuple(self.last_seen.items())
+        snapshot = Snapshot(runs, pending, trailing_runs, matched, seen, last_seen)
+        if snapshot == prev:
+            # a step which doesn't change anything (e.g. a state no pattern is interested in)
+            # shares the snapshot of the step before it
+            snapshot = prev
+        return snapshot
+
+    def next_deadline(self):
+        """
+        :return: the earliest time at which a run waiting on a trailing NotState matches,
+                 if nothing else is added to the state history (None if there's no such run)
+        """
+        if not self.snapshots:
+            return None
+        return min((run.prev_ts + self.nodes[node_id].step.duration
+                    for node_id, runs in self.snapshots[-1].trailing.items()
+                    if self.nodes[node_id].step.duration != np.inf
+                    for run in runs if not run.doomed and run.start_idx >= self.base), default=None)
+
+    def deadline_after(self, now):
+        """
+        :return: the time after `now` when a run waiting on a trailing NotState in the state history seen at `now`
+                 stops being a partial match, i.e. when `match` changes without any change of the state history
+                 (None if there's no such time)
+        """
+        last_idx = bisect.bisect_right(self.timestamps, now) - 1
+        if last_idx < 0:
+            return None
+        return min((run.prev_ts + self.nodes[node_id].step.duration
+                    for node_id, runs in self.snapshots[last_idx].trailing.items()
+                    if self.nodes[node_id].step.duration != np.inf
+                    for run in runs if now - run.prev_ts <= self.nodes[node_id].step.duration
+                    and run.start_idx >= self.base), default=None)
+
+    def match(self, ptn_idx, now=None):
+        """
+        :param ptn_idx: the index of the pattern in the patterns the trie was compiled from
+        :return: (PatternMatch, states to find) exactly like `PatternDetector.find_mov_ptn_in_state_history`
+                 over the state history this automaton was built from
+        """
+        ptn = self.patterns[ptn_idx]
+        pattern_steps = ptn.pattern_steps
+        if not self.states:
+            return PatternMatch.NOT_MATCHED, []
+        if not now or now == CommittedOffset.CURRENT:
+            now = max(time.time(), self.timestamps[-1])
+        last_idx = bisect.bisect_right(self.timestamps, now) - 1
+        if ptn.first_idx is None or last_idx < 0:
+            return PatternMatch.NOT_MATCHED, [] if ptn.is_not[0] else [pattern_steps[0]]
+
+        snapshot = self.snapshots[last_idx]
+        base = self.base
+        last_node = ptn.path[-1]
+        if snapshot.matched.get(last_node.id, -1) >= base:
+            return PatternMatch.MATCHED, []
+
+        first_step = pattern_steps[ptn.first_idx]
+        # whether any start index is still waiting, i.e. the waiting run did not leave with the last step
+        waiting = not (first_step == self.states[last_idx])
+        partial_idx = ptn.first_idx if waiting and ptn.first_idx >= 2 else -1
+        for i in range(ptn.num_steps - 1 if ptn.trailing_not_state is not None else ptn.num_steps):
+            node = ptn.path[i]
+            run = (snapshot.pending if node.is_not else snapshot.runs).get(node.id)
+            if run is not None and run.start_idx >= base and not (i == 1 and ptn.is_not[0]):
+                partial_idx = max(partial_idx, i)
+
+        trailing = [run for run in snapshot.trailing.get(last_node.id, ()) if run.start_idx >= base] \
+            if ptn.trailing_not_state is not None else None
+        if trailing:
+            not_state = ptn.trailing_not_state
+            if not_state.duration == np.inf:
+                # a forbidden state after the last match fails it, even if it is seen after `now`
+                last_seen = self.last_seen.get(not_state.state)
+                run = trailing[-1]
+                if run.prev_idx == base + last_idx or last_seen is None or last_seen[0] <= base + last_idx:
+                    partial_idx = ptn.num_steps - 1
+            else:
+                for run in trailing:
+                    if now - run.prev_ts > not_state.duration:
+                        if not run.doomed:
+                            return PatternMatch.MATCHED, []
+                    else:
+                        partial_idx = ptn.num_steps - 1
+
+        if partial_idx > 0:
+            return PatternMatch.PARTIAL_MATCH, ptn.states_to_find(partial_idx)
+        if snapshot.seen.get(first_step, -1) < base:
+            return PatternMatch.NOT_MATCHED, [pattern_steps[0]] if ptn.first_idx == 0 else \
+                [pattern_steps[1], pattern_steps[0]]
+        return PatternMatch.NOT_MATCHED, [] if ptn.is_not[0] else [pattern_steps[0]]
+
+
+class PatternAutomaton(PatternTrie):
+    """
+    the automaton of a single pattern
+    """
+
+    def __init__(self, pattern_steps):
+        self.pattern_steps = pattern_steps
+        super().__init__([pattern_steps])
+
+    def match(self, now=None):
+        return super().match(0, now)
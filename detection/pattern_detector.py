@@ -1,21 +1,24 @@
-import copy
 import logging
-import threading
 import time
-from enum import Enum
+from collections import namedtuple
 
 import numpy as np
 from termcolor import colored
 
+from detection.pattern_automaton import PatternTrie, PatternMatch
+from detection.state_history import StateHistory, StateHistoryView, ColumnarStateHistory
+from detection.state_history_log import StateHistoryLog
 from detection.state_managers.object_state_manager import ObjectStates
 from detection.state_managers.state_manager import StateManager, CommittedOffset
 from detection.states import NotState, StateHistoryStep
 from lib.task_queue import BlockingTaskSingleton
-from lib.timer import RepeatedTimer
+from lib.timer import RepeatedTimer, TriggeredTimer
 from notifier import NotificationTypes
 
 log = logging.getLogger(__name__)
 
+StatesInDemand = namedtuple('StatesInDemand', 'version valid_from valid_till deadline states')
+
 """
     potential improvement with object tracking:
         https://www.pyimagesearch.com/2018/08/13/opencv-people-counter/
@@ -24,46 +27,61 @@ log = logging.getLogger(__name__)
 """
 
 
-class PatternMatch(Enum):
-    MATCHED = 0
-    NOT_MATCHED = 1
-    PARTIAL_MATCH = 2
-
-
 class PatternDetector():
     def __init__(self, broker_q: BlockingTaskSingleton, pattern_steps, state_history_length=20,
-                 state_history_length_partial=300, detection_interval=1):
+                 state_history_length_partial=300, detection_interval=1, event_driven=False,
+                 state_history_log_path=None, clock=time.time, columnar_state_history=False):
+        """
+        :param detection_interval: seconds between evaluations of the patterns (None to not evaluate them on a timer)
+        :param event_driven: instead of every `detection_interval`, evaluate the patterns whenever a state is added
+                             to the state history and exactly when a trailing NotState's duration expires.
+                             `detection_interval` is then only used to re-evaluate while a state manager is lagging
+        :param state_history_log_path: file to append the states added to the state history to, so that they
+                                       can be replayed by `tools/backtest_patterns.py`
+        :param clock: the current time of the patterns (a simulated clock when replaying a state history log)
+        :param columnar_state_history: store the state history in numpy arrays instead of a list of steps
+        """
         self.broker_q = broker_q
         self.pattern_steps = pattern_steps
-        self.state_history = []
+        self.state_history = ColumnarStateHistory() if columnar_state_history else StateHistory()
         self.state_history_length = state_history_length
         self.state_history_length_partial = state_history_length_partial
         self.detection_interval = detection_interval
-        self.state_history_update_lock = threading.Lock()
+        self.event_driven = event_driven
+        self.clock = clock
+        self.state_history_log = StateHistoryLog(state_history_log_path) if state_history_log_path else None
+        # the compiled patterns are updated under the state history's lock, so they're read under it as well
+        self.state_history_update_lock = self.state_history.lock
         self.state_managers = []
+        # the patterns are compiled into a single trie, so that the steps they share are advanced once.
+        # patterns with no step other than NotStates can never match and are left to the plain scan
+        compiled_patterns = [(ptn, ptn_steps) for (ptn, ptn_steps) in self.pattern_steps
+                             if any(type(step) is not NotState for step in ptn_steps)]
+        self.pattern_trie = PatternTrie([ptn_steps for (ptn, ptn_steps) in compiled_patterns])
+        self.pattern_trie_idx = {ptn: idx for idx, (ptn, ptn_steps) in enumerate(compiled_patterns)}
+        self.state_history.add_listener(self.pattern_trie)
+        self.states_in_demand_cache = None
         if self.detection_interval:
-            self.pattern_detection_timer = RepeatedTimer(detection_interval, self.detect_patterns)
+            if self.event_driven:
+                self.pattern_detection_timer = TriggeredTimer(self.detect_patterns)
+            else:
+                self.pattern_detection_timer = RepeatedTimer(detection_interval, self.detect_patterns)
 
     def stop(self):
         if self.detection_interval:
             self.pattern_detection_timer.stop()
+        if self.state_history_log:
+            self.state_history_log.stop()
 
     def register_state_manager(self, state_manager: StateManager):
         self.state_managers.append(state_manager)
 
     def add_to_state_history(self, new_state: StateHistoryStep, avoid_duplicates=False):
-        inserted = False
-        with self.state_history_update_lock:
-            i = 0
-            while i < len(self.state_history) and new_state.ts >= self.state_history[i].ts:
-                i += 1
-
-            if not avoid_duplicates or (
-                    avoid_duplicates and (i == 0 or self.state_history[i - 1].state is not new_state.state)):
-                self.state_history.insert(i, new_state)
-                inserted = True
-
-        # self.detect_patterns()
+        if self.state_history_log:
+            self.state_history_log.append(self.clock(), new_state, avoid_duplicates)
+        inserted = self.state_history.insert(new_state, avoid_duplicates) is not None
+        if inserted and self.detection_interval and self.event_driven:
+            self.pattern_detection_timer.trigger()
         return inserted
 
     def find_not_state_before_step(self, not_state: NotState, state_history, after_step_ts, from_idx, to_idx):
@@ -78,7 +96,7 @@ class PatternDetector():
         prev_match_idx = -1
         prev_match_ts = 0
         if not now or now == CommittedOffset.CURRENT:
-            now = max(time.time(), state_history[-1].ts)
+            now = max(self.clock(), state_history[-1].ts)
 
         while ptn_idx < len(pattern_steps) and shist_idx < len(state_history) and state_history[shist_idx].ts <= now:
             ptn_step = pattern_steps[ptn_idx]
@@ -218,19 +236,21 @@ class PatternDetector():
         if len(self.state_history) > 0:
             min_committed_offset_ts = self.get_min_committed_offset_ts()
             any_partial_match = False
-            state_history_till_ts = self.get_state_history_till(min_committed_offset_ts)
-            state_history_after_ts = self.get_state_history_after(min_committed_offset_ts)
-            log.info("%s, %s " % (
-                colored("state history seen by pattern detector: %s" % state_history_till_ts, 'white', attrs=['bold']),
-                colored(state_history_after_ts, 'white')))
+            if log.isEnabledFor(logging.INFO):
+                state_history_till_ts = self.get_state_history_till(min_committed_offset_ts)
+                state_history_after_ts = self.get_state_history_after(min_committed_offset_ts)
+                log.info("%s, %s " % (
+                    colored("state history seen by pattern detector: %s" % state_history_till_ts, 'white',
+                            attrs=['bold']),
+                    colored(state_history_after_ts, 'white')))
+            match_ts = min_committed_offset_ts
+            if match_ts == CommittedOffset.CURRENT:
+                match_ts = self.current_ts()
             for (ptn, ptn_steps) in self.pattern_steps:
-                ptn_match_result, states_to_find = self.find_mov_ptn_in_state_history(ptn_steps, self.state_history, now=min_committed_offset_ts)
+                ptn_match_result, states_to_find = self.match_pattern(ptn, ptn_steps, now=match_ts)
                 if ptn_match_result is PatternMatch.MATCHED:
                     log.info(colored("pattern detected: %s" % ptn.name, 'red', attrs=['bold']))
-                    state_attrs = None
-                    for state_step in self.state_history:
-                        if state_step.state == ObjectStates.OBJECT_DETECTED:
-                            state_attrs = state_step.state_attrs
+                    state_attrs = self.state_history.latest_state_attrs(ObjectStates.OBJECT_DETECTED)
                     self.clear_state_history_till(min_committed_offset_ts)
                     self.broker_q.enqueue((NotificationTypes.PATTERN_DETECTED, (ptn, state_attrs)))
                 elif ptn_match_result is PatternMatch.PARTIAL_MATCH:
@@ -238,51 +258,90 @@ class PatternDetector():
                     any_partial_match = True
 
             self.prune_state_history(any_partial_match)
+            if self.detection_interval and self.event_driven:
+                self.schedule_pattern_detection(min_committed_offset_ts)
+
+    def current_ts(self):
+        """
+        :return: the time the patterns are matched at when no state manager is lagging: the clock, or the
+                 latest step of the state history if it is ahead of the clock
+        """
+        with self.state_history_update_lock:
+            latest_ts = self.state_history.latest_ts()
+            return self.clock() if latest_ts is None else max(self.clock(), latest_ts)
+
+    def schedule_pattern_detection(self, min_committed_offset_ts):
+        """
+        schedule the next evaluation of the patterns which is not triggered by a new state: when the duration of
+        a trailing NotState expires, and after `detection_interval` while a state manager is lagging (as its
+        committed offset moves on without adding any state)
+        """
+        if min_committed_offset_ts != CommittedOffset.CURRENT:
+            self.pattern_detection_timer.schedule(time.time() + self.detection_interval)
+        with self.state_history_update_lock:
+            deadline = self.pattern_trie.next_deadline()
+        if deadline is not None:
+            self.pattern_detection_timer.schedule(deadline)
+
+    def match_pattern(self, ptn, ptn_steps, now=None):
+        """
+        same as `find_mov_ptn_in_state_history` over the state history, using the compiled patterns
+        """
+        with self.state_history_update_lock:
+            ptn_idx = self.pattern_trie_idx.get(ptn)
+            if ptn_idx is not None:
+                return self.pattern_trie.match(ptn_idx, now)
+            return self.find_mov_ptn_in_state_history(ptn_steps, self.state_history.snapshot(), now=now)
 
     def states_in_demand(self, ts):
-        all_states_to_find = set()
-        for (ptn, ptn_steps) in self.pattern_steps:
-            ptn_match_result, states_to_find = self.find_mov_ptn_in_state_history(ptn_steps, self.state_history, now=ts)
-            log.info("states_in_demand by [%s] pattern: %s" % (ptn, str(states_to_find)))
-            all_states_to_find.update(states_to_find)
-        return all_states_to_find
+        """
+        the states (or NotStates) the patterns are looking for in the state history seen at ts.
+        the answer is memoized till the state history changes, or ts moves past the next step of the state history
+        or across the deadline of a trailing NotState
+        :return: (set of states, whether the answer was memoized)
+        """
+        cacheable = ts and ts != CommittedOffset.CURRENT and len(self.pattern_trie_idx) == len(self.pattern_steps)
+        with self.state_history_update_lock:
+            cached = self.states_in_demand_cache
+            if cacheable and cached is not None and cached.version == self.state_history.version and \
+                    cached.valid_from <= ts < min(cached.valid_till, cached.deadline):
+                return cached.states, True
+
+            all_states_to_find = set()
+            for (ptn, ptn_steps) in self.pattern_steps:
+                ptn_match_result, states_to_find = self.match_pattern(ptn, ptn_steps, now=ts)
+                log.info("states_in_demand by [%s] pattern: %s" % (ptn, str(states_to_find)))
+                all_states_to_find.update(states_to_find)
+
+            if cacheable:
+                valid_from, valid_till = self.state_history.time_range(ts)
+                deadline = self.pattern_trie.deadline_after(ts)
+                self.states_in_demand_cache = StatesInDemand(self.state_history.version, valid_from, valid_till,
+                                                             deadline if deadline is not None else np.inf,
+                                                             frozenset(all_states_to_find))
+            return frozenset(all_states_to_find), False
 
     def clear_state_history_till(self, now):
-        with self.state_history_update_lock:
-            if now != CommittedOffset.CURRENT:
-                new_state_history = []
-                for i in range(0, len(self.state_history)):
-                    if self.state_history[i].ts > now:
-                        new_state_history.append(self.state_history[i])
-                self.state_history = new_state_history
-            else:
-                self.state_history.clear()
+        if now != CommittedOffset.CURRENT:
+            self.state_history.evict_till(now)
+        else:
+            self.state_history.clear()
 
     def get_state_history_till(self, now):
         if now != CommittedOffset.CURRENT:
-            state_history_at_now = copy.deepcopy(self.state_history)
-            for state in state_history_at_now:
-                state.now = now
-            return [state_step for state_step in state_history_at_now if state_step.ts <= now]
+            return self.state_history.till(now)
         else:
-            return self.state_history
+            return self.state_history.snapshot()
 
     def get_state_history_after(self, now):
         if now != CommittedOffset.CURRENT:
-            state_history_at_now = copy.deepcopy(self.state_history)
-            for state in state_history_at_now:
-                state.now = now
-            return [state_step for state_step in state_history_at_now if state_step.ts > now]
+            return self.state_history.after(now)
         else:
-            return []
+            return StateHistoryView(())
 
     def prune_state_history(self, any_partial_match):
-        with self.state_history_update_lock:
-            now = int(round(time.time()))
-            for state_step in self.state_history:
-                if not any_partial_match:
-                    if now - state_step.ts > self.state_history_length:
-                        self.state_history.remove(state_step)
-                else:
-                    if now - state_step.ts > self.state_history_length_partial:
-                        self.state_history.remove(state_step)
+        now = int(round(self.clock()))
+        if not any_partial_match:
+            self.state_history.evict_before(now - self.state_history_length)
+        else:
+            self.state_history.evict_before(now - self.state_history_length_partial)
@@ -4,14 +4,16 @@ from termcolor import colored
 
 from detection.StateDetectorBase import SkipAheadOptimizer
 from detection.states import NotState
+from lib import counter, gauge
 
 log = logging.getLogger(__name__)
 
 
 class PatternBasedSkipAheadOptimizer(SkipAheadOptimizer):
-    def __init__(self, pattern_detector, skip_state_type):
-        super().__init__(skip_state_type)
+    def __init__(self, pattern_detector, skip_state_type, metric_prefix='pattern_skipper'):
+        super().__init__(skip_state_type, metric_prefix)
         self.pattern_detector = pattern_detector
+        self.states_in_demand_hits = 0
 
     def skip_task(self, ts):
         """
@@ -19,13 +21,14 @@ class PatternBasedSkipAheadOptimizer(SkipAheadOptimizer):
         detected by the pattern detector in the state history at time ts
         by any of the patterns
         """
-        states_in_demand = self.pattern_detector.states_in_demand(ts)
-        log.info("states_in_demand by all patterns: %s" % str(states_in_demand))
-        state_history_till_ts = self.pattern_detector.get_state_history_till(ts)
-        state_history_after_ts = self.pattern_detector.get_state_history_after(ts)
-        log.info("%s, %s " % (
-        colored("state history seen by skipper: %s" % state_history_till_ts, 'white', attrs=['bold']),
-        colored(state_history_after_ts, 'white')))
+        states_in_demand, memoized = self.pattern_detector.states_in_demand(ts)
+        if not memoized:
+            log.info("states_in_demand by all patterns: %s" % str(states_in_demand))
+            state_history_till_ts = self.pattern_detector.get_state_history_till(ts)
+            state_history_after_ts = self.pattern_detector.get_state_history_after(ts)
+            log.info("%s, %s " % (
+            colored("state history seen by skipper: %s" % state_history_till_ts, 'white', attrs=['bold']),
+            colored(state_history_after_ts, 'white')))
         skip_ahead = True
         for state_looked_for in states_in_demand:
             state = state_looked_for
@@ -36,4 +39,13 @@ class PatternBasedSkipAheadOptimizer(SkipAheadOptimizer):
                 break
 
         self.measure_speedup(skip_ahead)
+        self.measure_states_in_demand_hits(memoized)
         return skip_ahead
+
+    def measure_states_in_demand_hits(self, memoized):
+        if memoized:
+            self.states_in_demand_hits += 1
+            counter(self.metric_prefix, "states_in_demand_hits").notify(1)
+        else:
+            counter(self.metric_prefix, "states_in_demand_misses").notify(1)
+        gauge(self.metric_prefix, "states_in_demand_hit_ratio").notify(self.states_in_demand_hits / self.total_frames)
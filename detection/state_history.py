@@ -0,0 +1,315 @@
+import bisect
+import threading
+from collections.abc import Sequence
+
+import numpy as np
+
+from detection.states import StateHistoryStep
+
+
+class StateHistoryView(Sequence):
+    """
+    an immutable snapshot of (a time range of) the state history. the steps are shared with the state history
+    instead of being copied, `now` is only used to print the age of the steps
+    """
+
+    def __init__(self, steps, now=None):
+        """
+        :param steps: immutable sequence of the steps, e.g. a tuple or `ColumnarSteps`
+        """
+        self.steps = steps
+        self.now = now
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return StateHistoryView(self.steps[idx], self.now)
+        return self.steps[idx]
+
+    def __repr__(self):
+        return '[%s]' % ', '.join(step.repr_at(self.now) for step in self.steps)
+
+
+class ColumnarSteps(Sequence):
+    """
+    the steps of (a copy of) the columns of a `ColumnarStateHistory`, their `StateHistoryStep`s are only
+    created when they're read
+    """
+
+    def __init__(self, states, codes, timestamps, attrs):
+        """
+        :param states: code -> state, only ever appended to
+        """
+        self.states = states
+        self.codes = codes
+        self.timestamps = timestamps
+        self.attrs = attrs
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return ColumnarSteps(self.states, self.codes[idx], self.timestamps[idx], self.attrs[idx])
+        return StateHistoryStep(self.states[self.codes[idx]], self.attrs[idx], float(self.timestamps[idx]))
+
+    def __iter__(self):
+        for (code, state_attrs, ts) in zip(self.codes.tolist(), self.attrs, self.timestamps.tolist()):
+            yield StateHistoryStep(self.states[code], state_attrs, ts)
+
+
+class StateHistory():
+    """
+    the state history, kept sorted by the timestamp of the steps. steps are inserted with a binary search and
+    evicted by time from the front. readers get immutable `StateHistoryView` snapshots, which are built on the
+    first read after a change and cached till the next one, so they're cheap to take on every evaluation.
+
+    listeners (e.g. `PatternAutomaton`) are kept in sync under the same lock:
+        `listener.reset(states, timestamps)` is called with the states and timestamps of the steps when it's added
+        `listener.insert(idx, step)` is called when a step is inserted at index idx
+        `listener.evict(count)` is called when the first count steps are evicted
+
+    the steps are stored in lists, subclasses can store them differently by overriding the `_` storage methods
+    """
+
+    def __init__(self):
+        self.steps = []
+        self.timestamps = []
+        self.listeners = []
+        # re-entrant, so that listeners can be read consistently with the steps under it
+        self.lock = threading.RLock()
+        # incremented on every change of the state history
+        self.version = 0
+        self._snapshot = StateHistoryView(())
+
+    def __len__(self):
+        return self._size()
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __getitem__(self, idx):
+        return self.snapshot()[idx]
+
+    def add_listener(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+            listener.reset(*self._states(0, self._size()))
+
+    def insert(self, new_state: StateHistoryStep, avoid_duplicates=False):
+        """
+        insert a step after all the steps with a timestamp less than or equal to its own
+        :param avoid_duplicates: don't insert the step if it has the same state as the step before it
+        :return: the index the step was inserted at, or None if it was not inserted
+        """
+        with self.lock:
+            i = self._index(new_state.ts, right=True)
+            if avoid_duplicates and i > 0 and self._state_at(i - 1) is new_state.state:
+                return None
+            self._insert_at(i, new_state)
+            for listener in self.listeners:
+                listener.insert(i, new_state)
+            self._changed()
+            return i
+
+    def snapshot(self, now=None):
+        with self.lock:
+            if self._snapshot is None:
+                self._snapshot = StateHistoryView(self._steps(0, self._size()))
+            if now is None:
+                return self._snapshot
+            return StateHistoryView(self._snapshot.steps, now)
+
+    def till(self, ts):
+        """
+        :return: a view of the steps with a timestamp less than or equal to ts
+        """
+        with self.lock:
+            return StateHistoryView(self._steps(0, self._index(ts, right=True)), ts)
+
+    def after(self, ts):
+        """
+        :return: a view of the steps with a timestamp greater than ts
+        """
+        with self.lock:
+            return StateHistoryView(self._steps(self._index(ts, right=True), self._size()), ts)
+
+    def time_range(self, ts):
+        """
+        :return: (the timestamp of the last step seen at ts, the timestamp of the next step), the range of time
+                 in which the state history seen is the same as the one at ts
+        """
+        with self.lock:
+            i = self._index(ts, right=True)
+            return self._ts_at(i - 1) if i > 0 else -np.inf, self._ts_at(i) if i < self._size() else np.inf
+
+    def latest_ts(self):
+        """
+        :return: the timestamp of the latest step, None if the state history is empty
+        """
+        with self.lock:
+            return self._ts_at(self._size() - 1) if self._size() > 0 else None
+
+    def latest_state_attrs(self, state):
+        """
+        :return: the state attrs of the latest step of the state, None if there's no such step
+        """
+        with self.lock:
+            for i in range(self._size() - 1, -1, -1):
+                if self._state_at(i) == state:
+                    return self.steps[i].state_attrs
+
+    def evict_till(self, ts):
+        """
+        evict the steps with a timestamp less than or equal to ts
+        :return: the number of steps evicted
+        """
+        with self.lock:
+            return self._evict(self._index(ts, right=True))
+
+    def evict_before(self, ts):
+        """
+        evict the steps with a timestamp less than ts
+        :return: the number of steps evicted
+        """
+        with self.lock:
+            return self._evict(self._index(ts, right=False))
+
+    def clear(self):
+        with self.lock:
+            return self._evict(self._size())
+
+    def _evict(self, count):
+        if count == 0:
+            return 0
+        self._delete_till(count)
+        for listener in self.listeners:
+            listener.evict(count)
+        self._changed()
+        return count
+
+    def _changed(self):
+        self.version += 1
+        # built on the next read
+        self._snapshot = None
+
+    def _size(self):
+        return len(self.timestamps)
+
+    def _index(self, ts, right):
+        """
+        :return: the index to insert ts at, after (right) or before the steps with the same timestamp
+        """
+        if right:
+            return bisect.bisect_right(self.timestamps, ts)
+        return bisect.bisect_left(self.timestamps, ts)
+
+    def _state_at(self, i):
+        return self.steps[i].state
+
+    def _ts_at(self, i):
+        return self.timestamps[i]
+
+    def _steps(self, start, end):
+        """
+        :return: immutable sequence of the `StateHistoryStep`s from index start till end
+        """
+        return tuple(self.steps[start:end])
+
+    def _states(self, start, end):
+        """
+        :return: (list of the states, list of the timestamps) of the steps from index start till end
+        """
+        return [step.state for step in self.steps[start:end]], self.timestamps[start:end]
+
+    def _insert_at(self, i, new_state: StateHistoryStep):
+        self.steps.insert(i, new_state)
+        self.timestamps.insert(i, new_state.ts)
+
+    def _delete_till(self, count):
+        del self.steps[:count]
+        del self.timestamps[:count]
+
+
+class ColumnarStateHistory(StateHistory):
+    """
+    a state history stored in numpy arrays of state codes and timestamps, with the state attrs kept aside in a list.
+    it doesn't keep a `StateHistoryStep` object per step, the views copy the columns and only create them for
+    the steps which are read (see `ColumnarSteps`). searching and evicting run over the arrays: the steps live in
+    [start, end) of the arrays, evicting just moves start, and they're compacted (or grown) when end reaches
+    the capacity
+    """
+
+    def __init__(self, capacity=1024):
+        super().__init__()
+        self.codes = np.empty(capacity, dtype=np.int32)
+        self.ts = np.empty(capacity, dtype=np.float64)
+        self.attrs = []
+        self.start = 0
+        self.end = 0
+        # state <-> code
+        self.states = []
+        self.state_codes = {}
+
+    def latest_state_attrs(self, state):
+        with self.lock:
+            code = self.state_codes.get(state)
+            if code is None:
+                return None
+            idxs = np.flatnonzero(self.codes[self.start:self.end] == code)
+            return self.attrs[idxs[-1]] if len(idxs) > 0 else None
+
+    def _code(self, state):
+        code = self.state_codes.get(state)
+        if code is None:
+            code = self.state_codes[state] = len(self.states)
+            self.states.append(state)
+        return code
+
+    def _size(self):
+        return self.end - self.start
+
+    def _index(self, ts, right):
+        return int(np.searchsorted(self.ts[self.start:self.end], ts, side='right' if right else 'left'))
+
+    def _state_at(self, i):
+        return self.states[self.codes[self.start + i]]
+
+    def _ts_at(self, i):
+        return float(self.ts[self.start + i])
+
+    def _steps(self, start, end):
+        return ColumnarSteps(self.states, self.codes[self.start + start:self.start + end].copy(),
+                             self.ts[self.start + start:self.start + end].copy(), self.attrs[start:end])
+
+    def _states(self, start, end):
+        codes = self.codes[self.start + start:self.start + end].tolist()
+        return [self.states[code] for code in codes], self.ts[self.start + start:self.start + end].tolist()
+
+    def _insert_at(self, i, new_state: StateHistoryStep):
+        if self.end == len(self.ts):
+            size = self._size()
+            capacity = len(self.ts) if size < len(self.ts) // 2 else len(self.ts) * 2
+            for name in ['codes', 'ts']:
+                column = getattr(self, name)
+                compacted = np.empty(capacity, dtype=column.dtype)
+                compacted[:size] = column[self.start:self.end]
+                setattr(self, name, compacted)
+            self.start, self.end = 0, size
+        i += self.start
+        # numpy copies overlapping slices correctly
+        self.codes[i + 1:self.end + 1] = self.codes[i:self.end]
+        self.ts[i + 1:self.end + 1] = self.ts[i:self.end]
+        self.codes[i] = self._code(new_state.state)
+        self.ts[i] = new_state.ts
+        self.attrs.insert(i - self.start, new_state.state_attrs)
+        self.end += 1
+
+    def _delete_till(self, count):
+        self.start += count
+        del self.attrs[:count]
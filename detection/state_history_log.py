@@ -0,0 +1,99 @@
+import json
+import logging
+import threading
+
+from detection.state_managers.door_state_manager import DoorStates, DoorState
+from detection.state_managers.motion_state_manager import MotionStates
+from detection.state_managers.object_state_manager import ObjectStates
+from detection.states import StateHistoryStep
+from lib.task_queue import NonBlockingTaskQueue
+
+log = logging.getLogger(__name__)
+
+"""
+    an append-only log of the states added to the pattern detector's state history, one json array per line:
+        [time it was added, ts of the state, state, state attrs, avoid duplicates]
+    e.g.
+        [1612345678.12, 1612345677.9, "ObjectStates.OBJECT_DETECTED", ["person", 0.87, "/path/to/img.jpg"], false]
+
+    the states of a door (`DoorState`) are written as "<state>@<door>", e.g. "DoorStates.DOOR_OPEN@garage"
+
+    it is replayed by `tools/backtest_patterns.py` to evaluate pattern configs offline
+"""
+
+STATE_TYPES = {state_type.__name__: state_type for state_type in [DoorStates, MotionStates, ObjectStates]}
+
+
+def encode_state(state):
+    if isinstance(state, DoorState):
+        return "%s@%s" % (encode_state(state.state), state.door)
+    if type(state).__name__ in STATE_TYPES:
+        return "%s.%s" % (type(state).__name__, state.name)
+    return state
+
+
+def decode_state(state):
+    if isinstance(state, str) and '@' in state:
+        state, door = state.split('@', 1)
+        return DoorState(door, decode_state(state))
+    if isinstance(state, str) and '.' in state:
+        state_type, name = state.split('.', 1)
+        if state_type in STATE_TYPES:
+            return STATE_TYPES[state_type][name]
+    return state
+
+
+def read_state_history_log(path):
+    """
+    :return: generator of (time it was added, StateHistoryStep, avoid duplicates) in the order they were added
+    """
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            try:
+                added_ts, ts, state, state_attrs, avoid_duplicates = json.loads(line)
+            except ValueError:
+                # e.g. a line cut short by a crash
+                log.warning("skipping malformed line %d of %s" % (line_no, path))
+                continue
+            if isinstance(state_attrs, list):
+                state_attrs = tuple(state_attrs)
+            yield added_ts, StateHistoryStep(decode_state(state), state_attrs, ts), avoid_duplicates
+
+
+class StateHistoryLog():
+    """
+    appends the states to the log file on a background thread, so that adding a state to the state history
+    never waits on the disk. when the queue is full the oldest pending state is dropped
+    """
+
+    def __init__(self, path, max_size=1000, metric_prefix='state_history_log'):
+        self.path = path
+        self.event_q = NonBlockingTaskQueue(max_size, metric_prefix=metric_prefix)
+        self.written = 0
+        self.thread = threading.Thread(target=self.write_continuously)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def append(self, added_ts, state_step: StateHistoryStep, avoid_duplicates):
+        self.event_q.enqueue((added_ts, state_step.ts, state_step.state, state_step.state_attrs, avoid_duplicates))
+
+    def write_continuously(self):
+        with open(self.path, 'a') as f:
+            while True:
+                events = self.event_q.dequeue_batch(100)
+                stop = -1 in events
+                for (added_ts, ts, state, state_attrs, avoid_duplicates) in [e for e in events if e != -1]:
+                    try:
+                        f.write(json.dumps([added_ts, ts, encode_state(state), state_attrs, avoid_duplicates],
+                                           default=str) + '\n')
+                        self.written += 1
+                    except Exception:
+                        log.exception("failed writing state %s to the state history log" % str(state))
+                f.flush()
+                if stop:
+                    break
+
+    def stop(self):
+        # write the pending states before stopping
+        self.event_q.enqueue(-1)
+        self.thread.join()
@@ -1,10 +1,11 @@
 import logging
+from collections import namedtuple
 from enum import Enum
 
 from termcolor import colored
 
 from detection.state_managers.state_manager import StateManager
-from detection.states import StateHistoryStep
+from detection.states import StateHistoryStep, NotState
 from notifier import NotificationTypes
 
 log = logging.getLogger(__name__)
@@ -15,15 +16,45 @@ class DoorStates(Enum):
     DOOR_OPEN = 1
 
 
+class DoorState(namedtuple('DoorState', ['door', 'state'])):
+    """
+    the state of one of the doors of a camera which watches more than one (see `DoorStateDetectorGroup`),
+    e.g. DoorState('garage', DoorStates.DOOR_OPEN). a pattern step matches the state of that door only
+    """
+    __slots__ = ()
+
+    def __repr__(self):
+        return '%s(%s)' % (self.state, self.door)
+
+
+def door_agnostic_patterns(pattern_steps):
+    """
+    :return: the patterns which have plain DoorStates steps, which can't tell doors apart
+    """
+    return [ptn for ptn, steps in pattern_steps
+            if any(isinstance(step.state if isinstance(step, NotState) else step, DoorStates) for step in steps)]
+
+
 class DoorStateManager(StateManager):
-    def __init__(self, pattern_detector, broker_q):
+    def __init__(self, pattern_detector, broker_q, door=None):
+        """
+        :param door: name of the door, when a camera watches more than one (see `DoorStateDetectorGroup`).
+                     the door states are then added to the state history as `DoorState`s of the door (with
+                     the door as their state attrs), and the door is the source of their notifications
+        """
         super().__init__(pattern_detector, broker_q)
+        self.door = door
         self.last_door_state = None
 
     def add_state(self, door_state, ts = None):
         if door_state != self.last_door_state:
-            history_step = StateHistoryStep(door_state, ts=ts)
+            history_step = StateHistoryStep(door_state if self.door is None else DoorState(self.door, door_state),
+                                            self.door, ts=ts)
             self.pattern_detector.add_to_state_history(history_step)
             self.last_door_state = door_state
-            self.broker_q.enqueue((NotificationTypes.DOOR_STATE_CHANGED, (door_state,)))
-            log.info(colored("door state changed: %s" % history_step, 'blue', attrs=['bold']))
+            if self.door is None:
+                self.broker_q.enqueue((NotificationTypes.DOOR_STATE_CHANGED, (door_state,)))
+                log.info(colored("door state changed: %s" % history_step, 'blue', attrs=['bold']))
+            else:
+                self.broker_q.enqueue((NotificationTypes.DOOR_STATE_CHANGED, (door_state, self.door)))
+                log.info(colored("door [%s] state changed: %s" % (self.door, history_step), 'blue', attrs=['bold']))
@@ -34,4 +34,4 @@ class ObjectStateManager(StateManager):
         return self.object_detector.latest_committed_offset
 
     def get_current_lag(self):
-        return self.object_detector.input_frame_q.size()
\ No newline at end of file
+        return self.object_detector.get_current_lag()
\ No newline at end of file
@@ -4,6 +4,8 @@ import numpy as np
 
 
 class StateHistoryStep:
+    __slots__ = ('ts', 'now', 'state', 'state_attrs')
+
     def __init__(self, state, state_attrs=None, ts=None):
         if ts == None:
             ts = time.time()
@@ -13,13 +15,18 @@ class StateHistoryStep:
         self.state_attrs = state_attrs
 
     def __repr__(self):
+        return self.repr_at(self.now)
+
+    def repr_at(self, now=None):
         ts_now = time.time()
-        if self.now:
-            ts_now = self.now
+        if now:
+            ts_now = now
         return '%s[%s]' % (self.state,  round(ts_now - self.ts, 2))
 
 
 class NotState():
+    __slots__ = ('state', 'duration')
+
     def __init__(self, state, duration=np.inf):
         self.state = state
         self.duration = duration
@@ -19,6 +19,14 @@ def gauge(prefix, metric):
         return metrics.metric(name)
 
 
+def counter(prefix, metric):
+    name = "%s.%s" % (prefix, metric)
+    if name not in metrics.REGISTRY:
+        return metrics.new_counter(name)
+    else:
+        return metrics.metric(name)
+
+
 def get_metric_prefix(obj, metric_prefix):
     if metric_prefix is None:
         return "%s_%s" % (obj.__class__.__name__, id(obj))
@@ -0,0 +1,83 @@
+import cv2
+import numpy as np
+
+"""
+    vectorized sRGB -> Lab conversion and Delta E (CMC) color difference, numerically equivalent to
+    colormath's convert_color(sRGBColor(r, g, b), LabColor) and delta_e_cmc, for any number of colors at once.
+
+    like the door state detectors always did with colormath, the rgb values are passed as they are (0-255),
+    without upscaling them. the Lab values are hence way out of the usual range, which the thresholds
+    of the door state detectors are tuned to
+"""
+
+# sRGB (D65) working space, as in colormath
+SRGB_TO_XYZ = np.array([[0.412424, 0.357579, 0.180464],
+                        [0.212656, 0.715158, 0.0721856],
+                        [0.0193324, 0.119193, 0.950444]])
+D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+CIE_E = 216.0 / 24389.0
+
+
+def rgb_to_lab(rgb):
+    """
+    :param rgb: array-like of shape (..., 3) of rgb colors
+    :return: float64 array of shape (..., 3) of the Lab colors (D65)
+    """
+    rgb = np.asarray(rgb, dtype=np.float64)
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, np.power((rgb + 0.055) / 1.055, 2.4))
+    xyz = np.maximum(linear @ SRGB_TO_XYZ.T, 0.0)
+    xyz = xyz / D65_WHITE
+    xyz = np.where(xyz > CIE_E, np.power(xyz, 1.0 / 3.0), (7.787 * xyz) + (16.0 / 116.0))
+    x, y, z = xyz[..., 0], xyz[..., 1], xyz[..., 2]
+    return np.stack([(116.0 * y) - 16.0, 500.0 * (x - y), 200.0 * (y - z)], axis=-1)
+
+
+def delta_e_cmc(lab1, lab2, pl=1, pc=1):
+    """
+    the Delta E (CMC) between Lab colors, broadcasting lab1 against lab2 (e.g. one color against many references).
+    it is not symmetric: the weights are computed from lab1, the color being compared
+
+    :param pl, pc: lightness and chroma weights, 1:1 for perceptibility
+    :return: float64 array of the differences (a float for two single colors)
+    """
+    lab1 = np.asarray(lab1, dtype=np.float64)
+    lab2 = np.asarray(lab2, dtype=np.float64)
+    L, a, b = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+
+    C_1 = np.sqrt(a ** 2 + b ** 2)
+    C_2 = np.sqrt(lab2[..., 1] ** 2 + lab2[..., 2] ** 2)
+    delta_L = L - lab2[..., 0]
+    delta_C = C_1 - C_2
+    delta_H = np.sqrt(np.clip((a - lab2[..., 1]) ** 2 + (b - lab2[..., 2]) ** 2 - delta_C ** 2, 0, None))
+
+    H_1 = np.degrees(np.arctan2(b, a))
+    H_1 = np.where(H_1 < 0, H_1 + 360, H_1)
+    F = np.sqrt(C_1 ** 4 / (C_1 ** 4 + 1900.0))
+    T = np.where((164 <= H_1) & (H_1 <= 345),
+                 0.56 + np.abs(0.2 * np.cos(np.radians(H_1 + 168))),
+                 0.36 + np.abs(0.4 * np.cos(np.radians(H_1 + 35))))
+    S_L = np.where(L < 16, 0.511, (0.040975 * L) / (1 + 0.01765 * L))
+    S_C = ((0.0638 * C_1) / (1 + 0.0131 * C_1)) + 0.638
+    S_H = S_C * (F * T + 1 - F)
+
+    delta_e = np.sqrt((delta_L / (pl * S_L)) ** 2 + (delta_C / (pc * S_C)) ** 2 + (delta_H / S_H) ** 2)
+    return delta_e if delta_e.ndim else float(delta_e)
+
+
+def contours_avg_rgb(frame, contours):
+    """
+    the average color of every contour, truncated to ints
+
+    :param frame: BGR frame
+    :param contours: (minX, minY, maxX, maxY) boxes
+    :return: int array of shape (len(contours), 3) of the rgb averages
+    """
+    averages = np.empty((len(contours), 3), dtype=np.int64)
+    for i, (minX, minY, maxX, maxY) in enumerate(contours):
+        roi = frame[minY:maxY, minX:maxX]
+        area = roi.shape[0] * roi.shape[1]
+        # cv2.mean scales the (integer) sums of the channels by 1/area, which can land right below an integer
+        # average. the sums are recovered to floor the exact averages
+        sums = np.rint(np.array(cv2.mean(roi)[2::-1]) * area).astype(np.int64)
+        averages[i] = sums // area
+    return averages
@@ -6,3 +6,7 @@ class InputMode:
 class DetectorType:
     TF2 = 1
     TFLITE = 2
+
+class ODWorkerType:
+    THREAD = 1
+    PROCESS = 2
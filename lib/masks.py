@@ -0,0 +1,93 @@
+import cv2
+import numpy as np
+
+"""
+    masks of the motion detector (md_mask, md_nmask) and of the object detector (tf_detection_masks,
+    tf_detection_nmasks). a mask is either a rectangle (minX, minY, maxX, maxY) or a polygon [(x, y), ...]
+"""
+
+
+def mask_key(shape):
+    """
+    :return: hashable version of the shape of a mask (a polygon is usually configured as a list of lists)
+    """
+    return tuple(tuple(point) if isinstance(point, (list, tuple, np.ndarray)) else point for point in shape)
+
+
+class Mask():
+    """
+    a mask rasterized once into a bitmap of its bounding box, so that no pixel work is spent on it
+    per frame or per detection:
+    - bitmap: 255 on (and within) the outline of the mask, to restrict the motion detector to it
+    - the integral image of its interior (the bitmap without its outline), which tells in constant time
+      whether a box lies strictly within the mask
+    """
+
+    def __init__(self, shape):
+        self.shape = shape
+        points = np.array(shape, dtype=np.int64)
+        self.is_rectangle = points.ndim == 1
+        if self.is_rectangle:
+            minX, minY, maxX, maxY = points
+            self.polygon = np.array([[minX, minY], [maxX, minY], [maxX, maxY], [minX, maxY]])
+        else:
+            self.polygon = points.reshape(-1, 2)
+        (minX, minY), (maxX, maxY) = self.polygon.min(axis=0), self.polygon.max(axis=0)
+        self.box = (int(minX), int(minY), int(maxX), int(maxY))
+
+        self.bitmap = np.zeros((maxY - minY + 1, maxX - minX + 1), dtype=np.uint8)
+        cv2.fillPoly(self.bitmap, [(self.polygon - (minX, minY)).astype(np.int32)], 255)
+        interior = cv2.erode(self.bitmap, np.ones((3, 3), dtype=np.uint8), borderValue=0)
+        self.interior_integral = cv2.integral(interior // 255)
+
+    def __repr__(self):
+        return str(self.shape)
+
+    def contains(self, boxes):
+        """
+        :param boxes: array of (minx, miny, maxx, maxy) rows
+        :return: boolean array, True for the boxes which lie strictly within the mask
+        """
+        boxes = np.asarray(boxes).reshape(-1, 4)
+        minx, miny, maxx, maxy = boxes.T
+        mask_minx, mask_miny, mask_maxx, mask_maxy = self.box
+        if self.is_rectangle:
+            return (minx > mask_minx) & (maxx < mask_maxx) & (miny > mask_miny) & (maxy < mask_maxy)
+
+        # the boxes (inclusive pixel ranges) relative to the bitmap, clipped so that they can be looked up
+        # in the integral image. the ones sticking out of the bitmap aren't contained anyway
+        x0, y0 = np.rint(minx).astype(np.int64) - mask_minx, np.rint(miny).astype(np.int64) - mask_miny
+        x1, y1 = np.rint(maxx).astype(np.int64) - mask_minx, np.rint(maxy).astype(np.int64) - mask_miny
+        h, w = self.bitmap.shape
+        inside = (x0 >= 0) & (y0 >= 0) & (x1 < w) & (y1 < h)
+        x0, x1 = np.clip(x0, 0, w - 1), np.clip(x1, 0, w - 1)
+        y0, y1 = np.clip(y0, 0, h - 1), np.clip(y1, 0, h - 1)
+        integral = self.interior_integral
+        covered = integral[y1 + 1, x1 + 1] - integral[y0, x1 + 1] - integral[y1 + 1, x0] + integral[y0, x0]
+        return inside & (covered == (x1 - x0 + 1) * (y1 - y0 + 1))
+
+    def contains_box(self, minx, miny, maxx, maxy):
+        if self.is_rectangle:
+            mask_minx, mask_miny, mask_maxx, mask_maxy = self.box
+            return minx > mask_minx and maxx < mask_maxx and miny > mask_miny and maxy < mask_maxy
+        return bool(self.contains((minx, miny, maxx, maxy))[0])
+
+    def rasterize(self, roi):
+        """
+        :param roi: (minX, minY, maxX, maxY) box of the frame, maxX and maxY excluded
+        :return: uint8 bitmap of the roi, 255 where the mask is
+        """
+        roi_minX, roi_minY, roi_maxX, roi_maxY = roi
+        bitmap = np.zeros((roi_maxY - roi_minY, roi_maxX - roi_minX), dtype=np.uint8)
+        mask_minx, mask_miny, _, _ = self.box
+        h, w = self.bitmap.shape
+        # the overlap of the roi and the bitmap in frame coordinates
+        minX, minY = max(roi_minX, mask_minx), max(roi_minY, mask_miny)
+        maxX, maxY = min(roi_maxX, mask_minx + w), min(roi_maxY, mask_miny + h)
+        if minX < maxX and minY < maxY:
+            bitmap[minY - roi_minY:maxY - roi_minY, minX - roi_minX:maxX - roi_minX] = \
+                self.bitmap[minY - mask_miny:maxY - mask_miny, minX - mask_minx:maxX - mask_minx]
+        return bitmap
+
+    def draw(self, frame, color, thickness=1):
+        cv2.polylines(frame, [self.polygon.astype(np.int32)], True, color, thickness)
@@ -0,0 +1,80 @@
+import threading
+
+from lib import gauge, get_metric_prefix
+
+
+class ReorderBuffer():
+    """
+    hands out sequence numbers to work items which can then complete out of order
+    (e.g. on a pool of worker threads). the results are processed strictly in the
+    order of their sequence numbers, one at a time, by the single thread running
+    `process_continuously`
+    """
+
+    def __init__(self, process_fn, max_pending=None, metric_prefix=None):
+        """
+        :param max_pending: max number of completed results waiting to be processed. completing a result
+                            (but the next one to be processed) blocks while there are as many
+        """
+        self.__cv = threading.Condition()
+        self.__results = {}
+        self.__next_seq = 0
+        self.__next_commit_seq = 0
+        self.__stopped = False
+        self.process_fn = process_fn
+        self.max_pending = max_pending
+        self.metric_prefix = get_metric_prefix(self, metric_prefix)
+
+    def next_sequence(self, count=1):
+        """
+        reserve count consecutive sequence numbers
+        :return: the first sequence number reserved
+        """
+        with self.__cv:
+            seq = self.__next_seq
+            self.__next_seq += count
+            return seq
+
+    def complete(self, seq, result):
+        """
+        record the result of the work item seq, it's processed by the thread running `process_continuously`
+        """
+        with self.__cv:
+            # the next result to be processed is never held back, so the others always get processed eventually
+            while self.max_pending and len(self.__results) >= self.max_pending and seq != self.__next_commit_seq:
+                self.__cv.wait()
+            self.__results[seq] = result
+            gauge(self.metric_prefix, "pending_size").notify(len(self.__results))
+            if seq == self.__next_commit_seq:
+                self.__cv.notify_all()
+
+    def process_continuously(self):
+        """
+        process the results in order as they complete, till `stop` is called
+        """
+        while True:
+            with self.__cv:
+                while self.__next_commit_seq not in self.__results and not self.__stopped:
+                    self.__cv.wait()
+                if self.__next_commit_seq not in self.__results:
+                    return
+                result = self.__results.pop(self.__next_commit_seq)
+            self.process_fn(result)
+            with self.__cv:
+                self.__next_commit_seq += 1
+                self.__cv.notify_all()
+
+    def stop(self):
+        """
+        `process_continuously` returns once the results completed in order so far are processed
+        """
+        with self.__cv:
+            self.__stopped = True
+            self.__cv.notify_all()
+
+    def pending(self):
+        """
+        :return: number of work items handed a sequence number which are not processed yet
+        """
+        with self.__cv:
+            return self.__next_seq - self.__next_commit_seq
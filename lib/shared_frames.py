@@ -0,0 +1,88 @@
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from lib import gauge, get_metric_prefix
+
+
+class SharedFramePool():
+    """
+    a fixed number of shared memory slots used to hand frames over to other processes
+    without pickling them. a frame is copied into a free slot once, the receiving
+    process attaches to the slot by its name and reads it in place. acquiring a slot blocks
+    till one is released, which provides backpressure to the producer
+    """
+
+    def __init__(self, num_slots, metric_prefix=None):
+        self.__cv = threading.Condition()
+        self.slots = [None] * num_slots
+        self.free_slots = list(range(num_slots))
+        self.metric_prefix = get_metric_prefix(self, metric_prefix)
+
+    def acquire(self, frame):
+        """
+        copies the frame into a free slot
+        :return: (slot id, slot name) to be passed on to the other process
+        """
+        with self.__cv:
+            while not self.free_slots:
+                self.__cv.wait()
+            slot_id = self.free_slots.pop()
+            gauge(self.metric_prefix, "free_slots").notify(len(self.free_slots))
+
+        shm = self.slots[slot_id]
+        if shm is None or shm.size < frame.nbytes:
+            # slots are sized lazily by the first frame (and grown if the stream resolution changes)
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            shm = shared_memory.SharedMemory(create=True, size=frame.nbytes)
+            self.slots[slot_id] = shm
+        np.copyto(SharedFramePool.view(shm, frame.shape, frame.dtype), frame)
+        return slot_id, shm.name
+
+    def get(self, slot_id, shape, dtype):
+        return SharedFramePool.view(self.slots[slot_id], shape, dtype)
+
+    def release(self, slot_id):
+        with self.__cv:
+            self.free_slots.append(slot_id)
+            gauge(self.metric_prefix, "free_slots").notify(len(self.free_slots))
+            self.__cv.notifyAll()
+
+    def close(self):
+        for shm in self.slots:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        self.slots = [None] * len(self.slots)
+
+    @staticmethod
+    def view(shm, shape, dtype):
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+class SharedFrameReader():
+    """
+    the receiving side of a `SharedFramePool`, keeps the slots attached across frames
+    """
+
+    def __init__(self):
+        self.attached = {}
+
+    def get(self, slot_name, shape, dtype):
+        shm = self.attached.get(slot_name)
+        if shm is None:
+            shm = shared_memory.SharedMemory(name=slot_name)
+            self.attached[slot_name] = shm
+        return SharedFramePool.view(shm, shape, dtype)
+
+    def close(self):
+        for shm in self.attached.values():
+            try:
+                shm.close()
+            except BufferError:
+                # a view of the slot is still referenced, it will be unmapped when the process exits
+                pass
+        self.attached.clear()
@@ -3,9 +3,10 @@
 
 import collections
 import threading
+import time
 from abc import ABC
 
-from lib import gauge, get_metric_prefix
+from lib import gauge, counter, get_metric_prefix
 
 
 class TaskQueue(ABC):
@@ -13,6 +14,7 @@ class TaskQueue(ABC):
         self.__cv = threading.Condition()
         self.__q = collections.deque()
         self.max_size = max_size
+        self.dropped = 0
         self.metric_prefix = get_metric_prefix(self, metric_prefix)
 
     def abrupt_stop(self, stop_element):
@@ -26,11 +28,14 @@ class TaskQueue(ABC):
         :rtype: void
         """
         with self.__cv:
+            self._trim(self.__q)
             while len(self.__q) == self.max_size:
                 if wait:
                     self.__cv.wait()
                 else:
                     self.__q.popleft()
+                    self.dropped += 1
+                    counter(self.metric_prefix, "dropped").notify(1)
             self.__q.append(element)
             self.__cv.notifyAll()
             gauge(self.metric_prefix, "queue_size").notify(len(self.__q))
@@ -51,6 +56,36 @@ class TaskQueue(ABC):
             gauge(self.metric_prefix, "queue_size").notify(len(self.__q))
             return element
 
+    def _dequeue_batch(self, max_elements, notify):
+        """
+        blocks till at least one element is available and then
+        drains up to max_elements elements without waiting any further
+        """
+        with self.__cv:
+            while not self.__q:
+                self.__cv.wait()
+            elements = self._schedule(self.__q, max_elements)
+            if notify:
+                self.__cv.notifyAll()
+            gauge(self.metric_prefix, "queue_size").notify(len(self.__q))
+            return elements
+
+    def _trim(self, q):
+        """
+        called before an element is enqueued. subclasses can override it to drop elements from the queue
+        """
+        pass
+
+    def _schedule(self, q, max_elements):
+        """
+        pops up to max_elements elements to hand out from the (non empty) queue.
+        subclasses can override it to drop or coalesce elements
+        """
+        elements = []
+        while q and len(elements) < max_elements:
+            elements.append(q.popleft())
+        return elements
+
     def wait_for_empty(self, timeout=None):
         with self.__cv:
             if len(self.__q) > 0:
@@ -78,6 +113,9 @@ class BlockingTaskQueue(TaskQueue):
     def dequeue(self):
         return self._dequeue(notify=True)
 
+    def dequeue_batch(self, max_elements):
+        return self._dequeue_batch(max_elements, notify=True)
+
 
 class NonBlockingTaskQueue(TaskQueue):
     def __init__(self, max_size, metric_prefix=None):
@@ -89,6 +127,9 @@ class NonBlockingTaskQueue(TaskQueue):
     def dequeue(self):
         return self._dequeue(notify=False)
 
+    def dequeue_batch(self, max_elements):
+        return self._dequeue_batch(max_elements, notify=False)
+
 
 class BlockingTaskSingleton(BlockingTaskQueue):
     def __init__(self, metric_prefix=None):
@@ -98,3 +139,110 @@ class BlockingTaskSingleton(BlockingTaskQueue):
 class NonBlockingTaskSingleton(NonBlockingTaskQueue):
     def __init__(self, metric_prefix=None):
         super().__init__(1, metric_prefix)
+
+
+class DroppedTasks():
+    """
+    a run of consecutive tasks which were dropped by a `DeadlineTaskQueue`
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.min_ts = None
+        self.max_ts = None
+
+    def add(self, ts):
+        self.count += 1
+        if ts is not None:
+            self.min_ts = ts if self.min_ts is None else min(self.min_ts, ts)
+            self.max_ts = ts if self.max_ts is None else max(self.max_ts, ts)
+
+    def __repr__(self):
+        return 'DroppedTasks(%d, %s, %s)' % (self.count, str(self.min_ts), str(self.max_ts))
+
+
+class DeadlineTaskQueue(BlockingTaskQueue):
+    """
+    blocking queue of timestamped tasks which are scheduled against a deadline:
+    - tasks older than max_age seconds are dropped
+    - when more than max_lag tasks are queued, the oldest ones are dropped so that the newest are served first
+    - a task which is followed by another queued task within coalesce_window seconds is coalesced into it (dropped)
+
+    the dropped tasks are not lost silently: every run of consecutive dropped tasks is handed out by
+    `dequeue_batch` as a single `DroppedTasks` element in their place, so the consumer can account for them
+    in order. only `dequeue_batch` schedules the tasks, `dequeue` hands them out in plain FIFO order
+    """
+
+    def __init__(self, max_size, max_age=None, max_lag=None, coalesce_window=None, ts_fn=lambda task: task[-1],
+                 metric_prefix=None):
+        """
+        :param ts_fn: returns the timestamp of a task (or None if it has none)
+        """
+        super().__init__(max_size, metric_prefix)
+        self.max_age = max_age
+        self.max_lag = max_lag
+        self.coalesce_window = coalesce_window
+        self.ts_fn = ts_fn
+        self.trimmed = DroppedTasks()
+
+    def _is_task(self, element):
+        return type(element) is not int
+
+    def _expired(self, element, now):
+        if self.max_age is None or not self._is_task(element):
+            return False
+        ts = self.ts_fn(element)
+        return ts is not None and now - ts > self.max_age
+
+    def _coalesced(self, element, q):
+        """
+        a task is coalesced into the first queued task with a later timestamp. the tasks with the same timestamp
+        (e.g. the regions of motion of a frame) are not coalesced into each other
+        """
+        if self.coalesce_window is None or not self._is_task(element):
+            return False
+        ts = self.ts_fn(element)
+        if ts is None:
+            return False
+        for next_element in q:
+            if not self._is_task(next_element):
+                return False
+            next_ts = self.ts_fn(next_element)
+            if next_ts != ts:
+                return next_ts is not None and next_ts - ts <= self.coalesce_window
+        return False
+
+    def _drop(self, dropped, element):
+        dropped.add(self.ts_fn(element))
+        self.dropped += 1
+        counter(self.metric_prefix, "dropped").notify(1)
+
+    def _trim(self, q):
+        now = time.time()
+        while q and self._is_task(q[0]) and (
+                self._expired(q[0], now) or (self.max_lag is not None and len(q) >= self.max_lag)):
+            self._drop(self.trimmed, q.popleft())
+
+    def _schedule(self, q, max_elements):
+        now = time.time()
+        elements = []
+        dropped = self.trimmed
+        self.trimmed = DroppedTasks()
+        tasks = 0
+        while q and tasks < max_elements:
+            element = q.popleft()
+            if self._is_task(element) and (self._expired(element, now) or
+                                           (self.max_lag is not None and len(q) >= self.max_lag) or
+                                           self._coalesced(element, q)):
+                self._drop(dropped, element)
+                continue
+            if dropped.count > 0:
+                elements.append(dropped)
+                dropped = DroppedTasks()
+            elements.append(element)
+            if not self._is_task(element):
+                break
+            tasks += 1
+        if dropped.count > 0:
+            elements.append(dropped)
+        return elements
@@ -1,5 +1,6 @@
+import heapq
 import time
-from threading import Event, Thread
+from threading import Condition, Event, Thread
 
 class RepeatedTimer:
 
@@ -28,6 +29,57 @@ class RepeatedTimer:
         self.thread.join()
 
 
+class TriggeredTimer:
+
+    """Run `function` whenever `trigger()` is called or a deadline passed to `schedule()` expires.
+    triggers and deadlines which come up while `function` is running are coalesced into a single run."""
+
+    def __init__(self, function, *args, **kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.deadlines = []
+        self.triggered = False
+        self.stopped = False
+        self.cv = Condition()
+        self.thread = Thread(target=self._target, daemon=True)
+        self.thread.start()
+
+    def trigger(self):
+        with self.cv:
+            self.triggered = True
+            self.cv.notify()
+
+    def schedule(self, deadline):
+        """
+        :param deadline: time.time() after which to run `function`
+        """
+        with self.cv:
+            if deadline not in self.deadlines:
+                heapq.heappush(self.deadlines, deadline)
+                self.cv.notify()
+
+    def _target(self):
+        while True:
+            with self.cv:
+                while not self.stopped and not self.triggered and \
+                        not (self.deadlines and time.time() > self.deadlines[0]):
+                    self.cv.wait(max(self.deadlines[0] - time.time(), 0) if self.deadlines else None)
+                if self.stopped:
+                    break
+                self.triggered = False
+                now = time.time()
+                while self.deadlines and now > self.deadlines[0]:
+                    heapq.heappop(self.deadlines)
+            self.function(*self.args, **self.kwargs)
+
+    def stop(self):
+        with self.cv:
+            self.stopped = True
+            self.cv.notify()
+        self.thread.join()
+
+
 # start timer
 timer = RepeatedTimer(10, print, 'Hello world')
 
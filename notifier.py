@@ -69,12 +69,16 @@ class Notifier():
         elif self.config.send_webhook:
             self.ha_webhook_pd.send(str(pattern.name), img_path)
 
-    def notify_state_detected(self, state):
+    def notify_state_detected(self, state, source=None):
+        """
+        :param source: e.g. the name of the door whose state changed, when there are many
+        """
+        state = str(state) if source is None else "%s:%s" % (source, state)
         log.info(colored("state detection notification: %s" % state, attrs=['bold']))
         if self.config.send_mqtt:
-            self.mqtt.publish(self.config.mqtt_state_detect_topic, str(state))
+            self.mqtt.publish(self.config.mqtt_state_detect_topic, state)
         elif self.config.send_webhook:
-            self.ha_webhook_ot.send(str(state))
+            self.ha_webhook_ot.send(state)
 
     def can_notify(self, notification_type):
         if notification_type in self.config.notifier_rate_limits:
@@ -14,11 +14,13 @@ log.info("package import START")
 import importlib
 import jsonpickle
 
+from detection.door_state_detectors import DoorStateDetectorGroup
 from detection.motion_detector import SimpleMotionDetector
 from detection.object_detector_streaming import StreamingTFObjectDetector
 from detection.pattern_detector import PatternDetector
-from detection.state_managers.door_state_manager import DoorStateManager
+from detection.state_managers.door_state_manager import DoorStateManager, door_agnostic_patterns
 from detection.state_managers.motion_state_manager import MotionStateManager
+from lib.constants import ODWorkerType
 from lib.framelimiter import FrameLimiter
 
 from base_detector import DetectorView
@@ -50,7 +52,18 @@ class StreamDetector():
         self.config = config
         self.od = object_detector
         if self.config.pattern_detection_enabled:
-            self.door_state_manager = DoorStateManager(pattern_detector, pattern_detector.broker_q)
+            if self.config.door_state_detector:
+                self.door_state_manager = DoorStateManager(pattern_detector, pattern_detector.broker_q)
+            if self.config.door_state_detectors:
+                if not self.config.door_state_detector:
+                    # the doors of door_state_detectors only add DoorStates of a door to the state history
+                    patterns = door_agnostic_patterns(self.config.pattern_detection_pattern_steps)
+                    if patterns:
+                        raise ValueError("patterns %s can't tell the doors of door_state_detectors apart, use "
+                                         "DoorState(door, DoorStates..) steps" % str(patterns))
+                self.door_state_detector_group = DoorStateDetectorGroup(self.config.door_state_detectors)
+                self.door_state_managers = {door: DoorStateManager(pattern_detector, pattern_detector.broker_q, door)
+                                            for door in self.config.door_state_detectors}
             self.motion_state_manager = MotionStateManager(pattern_detector, pattern_detector.broker_q)
         self.motion_detector = SimpleMotionDetector(config)
         self.stopped = False
@@ -85,9 +98,8 @@ class StreamDetector():
         return self.t.is_alive() and self.od.is_alive()
 
     def draw_masks(self, frame):
-        if self.config.md_mask:
-            xmin, ymin, xmax, ymax = self.config.md_mask
-            cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (128, 0, 128), 1)
+        if self.motion_detector.mask:
+            self.motion_detector.mask.draw(frame, (128, 0, 128))
 
     def detect_objects(self):
         total = 0
@@ -104,13 +116,20 @@ class StreamDetector():
                 if self.config.tf_apply_md:
                     output_frame, crop, motion_outside = self.motion_detector.detect(output_frame)
                     if self.config.pattern_detection_enabled:
-                        door_state = self.config.door_state_detector.detect_door_state(frame)
-                        self.door_state_manager.add_state(door_state)
+                        if self.config.door_state_detector:
+                            door_state = self.config.door_state_detector.detect_door_state(frame)
+                            self.door_state_manager.add_state(door_state)
+                            if self.config.door_state_detector_show_detection:
+                                self.config.door_state_detector.show_detection(output_frame, door_state)
+                        if self.config.door_state_detectors:
+                            door_states = self.door_state_detector_group.detect_door_states(frame)
+                            for door, door_state in door_states.items():
+                                self.door_state_managers[door].add_state(door_state)
+                            if self.config.door_state_detector_show_detection:
+                                self.door_state_detector_group.show_detection(output_frame, door_states)
                         self.motion_state_manager.add_state(motion_outside)
-                        if self.config.door_state_detector_show_detection:
-                            self.config.door_state_detector.show_detection(output_frame, door_state)
-                    if crop is not None:
-                        minX, minY, maxX, maxY = crop
+                    # a task per region of motion (the single crop unless md_max_regions > 1)
+                    for (minX, minY, maxX, maxY) in self.motion_detector.regions:
                         cropped_frame = frame[minY:maxY, minX:maxX]
                         self.od.add_task((frame, cropped_frame, (minX, minY), ts))
                 else:
@@ -177,6 +196,8 @@ class StreamDetectorView(DetectorView):
         return jsonify ({
                 'active_video_feeds': self.sd.active_video_feeds,
                 'od_active_video_feeds': self.sd.od.active_video_feeds,
+                'od_writer': self.sd.od.detection_writer.status() if self.sd.od.detection_writer else None,
+                'od_cache': self.sd.od.detection_cache_status(),
                 'appmetrics': metrics.metrics_by_name_list(metrics.metrics())
             })
 
@@ -238,8 +259,15 @@ if __name__ == '__main__':
         pattern_detector = PatternDetector(broker_q, config.pattern_detection_pattern_steps,
                                            config.pattern_detection_state_history_length,
                                            config.pattern_detection_state_history_length_partial,
-                                           config.pattern_detection_interval)
-    od = StreamingTFObjectDetector(config, broker_q)
+                                           config.pattern_detection_interval,
+                                           config.pattern_detection_event_driven,
+                                           config.pattern_detection_state_history_log,
+                                           columnar_state_history=config.pattern_detection_columnar_state_history)
+    if config.od_worker_type == ODWorkerType.PROCESS:
+        from detection.object_detector_process import ProcessTFObjectDetector
+        od = ProcessTFObjectDetector(config, broker_q)
+    else:
+        od = StreamingTFObjectDetector(config, broker_q)
     sd = StreamDetector(config, od, pattern_detector)
     mb = Broker(sd.config, od, pattern_detector, broker_q, notify_q)
 
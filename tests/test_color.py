@@ -0,0 +1,77 @@
+import random
+import unittest
+
+import numpy as np
+from colormath import color_diff_matrix
+from colormath.color_conversions import convert_color
+from colormath.color_objects import sRGBColor, LabColor
+from parameterized import parameterized
+
+from detection.door_state_detectors import SingleShotDoorStateDetector, SingleShotFrameDiffDoorStateDetector
+from detection.state_managers.door_state_manager import DoorStates
+from lib.color import rgb_to_lab, delta_e_cmc, contours_avg_rgb
+
+
+def colormath_lab(rgb):
+    return np.array(convert_color(sRGBColor(*rgb), LabColor).get_value_tuple())
+
+
+def colormath_delta_e_cmc(rgb1, rgb2):
+    # colormath.color_diff.delta_e_cmc without numpy.asscalar, which newer numpy versions dropped
+    return color_diff_matrix.delta_e_cmc(colormath_lab(rgb1), np.array([colormath_lab(rgb2)]), pl=1, pc=1)[0]
+
+
+class TestColor(unittest.TestCase):
+    @parameterized.expand([[seed] for seed in range(3)])
+    def test_matches_colormath(self, seed):
+        rng = random.Random(seed)
+        colors = [tuple(rng.randint(0, 255) for _ in range(3)) for _ in range(200)]
+        # averages of the adaptive door state detector are halved, and small values are in the linear part of sRGB
+        colors += [tuple(rng.uniform(0, 255) for _ in range(3)) for _ in range(50)]
+        colors += [(0, 0, 0), (0.01, 0.02, 0.04), (255, 255, 255)]
+
+        labs = rgb_to_lab(colors)
+        for rgb, lab in zip(colors, labs):
+            np.testing.assert_allclose(lab, colormath_lab(rgb), rtol=1e-10, atol=1e-10)
+
+        references = labs[:10]
+        for rgb, lab in zip(colors, labs):
+            np.testing.assert_allclose(delta_e_cmc(lab, references),
+                                       [colormath_delta_e_cmc(rgb, reference_rgb) for reference_rgb in colors[:10]],
+                                       rtol=1e-10, atol=1e-10)
+
+    def test_contours_avg_rgb(self):
+        rng = np.random.default_rng(0)
+        frame = rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+        # a flat contour, whose average cv2.mean puts right below the color
+        frame[:51, :38] = (212, 132, 214)
+        contours = [(0, 0, 38, 51), (10, 20, 57, 41), (100, 0, 160, 120)]
+        averages = contours_avg_rgb(frame, contours)
+        self.assertEqual(averages.shape, (3, 3))
+        for (minX, minY, maxX, maxY), average in zip(contours, averages):
+            roi = frame[minY:maxY, minX:maxX].reshape(-1, 3).astype(np.int64)
+            self.assertEqual(list(average), list(roi.sum(axis=0)[::-1] // len(roi)))
+
+    @parameterized.expand([[seed] for seed in range(3)])
+    def test_door_state_detectors(self, seed):
+        rng = np.random.default_rng(seed)
+        door_contour, frame_contour = (215, 114, 227, 123), (196, 131, 215, 147)
+        closed_rgb, open_rgb = (118, 80, 26), (151, 117, 72)
+        single_shot = SingleShotDoorStateDetector(door_contour, closed_rgb, open_rgb)
+        frame_diff = SingleShotFrameDiffDoorStateDetector(door_contour, frame_contour, threshold=500)
+        for _ in range(20):
+            frame = np.zeros((240, 320, 3), dtype=np.uint8)
+            for (minX, minY, maxX, maxY) in [door_contour, frame_contour]:
+                bgr = rng.integers(0, 256, 3)
+                frame[minY:maxY, minX:maxX] = np.clip(bgr + rng.integers(-10, 10, (maxY - minY, maxX - minX, 3)),
+                                                      0, 255)
+
+            door_avg, frame_avg = [tuple(int(c) for c in average)
+                                   for average in contours_avg_rgb(frame, [door_contour, frame_contour])]
+            closed_diff = colormath_delta_e_cmc(door_avg, closed_rgb)
+            open_diff = colormath_delta_e_cmc(door_avg, open_rgb)
+            self.assertEqual(single_shot.detect_door_state(frame),
+                             DoorStates.DOOR_CLOSED if closed_diff <= open_diff else DoorStates.DOOR_OPEN)
+            self.assertEqual(frame_diff.detect_door_state(frame),
+                             DoorStates.DOOR_OPEN if colormath_delta_e_cmc(door_avg, frame_avg) > 500
+                             else DoorStates.DOOR_CLOSED)
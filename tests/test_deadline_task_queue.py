@@ -0,0 +1,54 @@
+import time
+import unittest
+
+from lib.task_queue import DeadlineTaskQueue, DroppedTasks
+
+
+class TestDeadlineTaskQueue(unittest.TestCase):
+    def _dequeue_all(self, q, max_elements):
+        elements = []
+        while q.size() > 0:
+            elements.extend(q.dequeue_batch(max_elements))
+        return [(e.count, e.min_ts, e.max_ts) if isinstance(e, DroppedTasks) else e for e in elements]
+
+    def test_fifo_without_deadlines(self):
+        q = DeadlineTaskQueue(10, metric_prefix='test_deadline_q')
+        for ts in range(5):
+            q.enqueue(('task', ts))
+        self.assertEqual(self._dequeue_all(q, 2), [('task', ts) for ts in range(5)])
+
+    def test_expired_tasks_are_dropped(self):
+        q = DeadlineTaskQueue(10, max_age=5, metric_prefix='test_deadline_q')
+        now = time.time()
+        for ts in [now - 20, now - 10, now - 1, now]:
+            q.enqueue(('task', ts))
+        self.assertEqual(self._dequeue_all(q, 4), [(2, now - 20, now - 10), ('task', now - 1), ('task', now)])
+        self.assertEqual(q.dropped, 2)
+
+    def test_newest_tasks_are_served_when_lagging(self):
+        q = DeadlineTaskQueue(10, max_lag=3, metric_prefix='test_deadline_q')
+        for ts in range(6):
+            q.enqueue(('task', ts))
+        self.assertEqual(q.size(), 3)
+        self.assertEqual(self._dequeue_all(q, 1), [(3, 0, 2), ('task', 3), ('task', 4), ('task', 5)])
+
+    def test_overlapping_tasks_are_coalesced(self):
+        q = DeadlineTaskQueue(10, coalesce_window=0.5, metric_prefix='test_deadline_q')
+        for ts in [0, 0.2, 0.4, 2, 3, 3.1]:
+            q.enqueue(('task', ts))
+        self.assertEqual(self._dequeue_all(q, 10), [(2, 0, 0.2), ('task', 0.4), ('task', 2), (1, 3, 3), ('task', 3.1)])
+
+    def test_tasks_of_a_frame_are_coalesced_together(self):
+        q = DeadlineTaskQueue(10, coalesce_window=0.5, metric_prefix='test_deadline_q')
+        for ts in [0, 0, 0.2, 0.2, 2, 2]:
+            q.enqueue(('task', ts))
+        self.assertEqual(self._dequeue_all(q, 10), [(2, 0, 0), ('task', 0.2), ('task', 0.2), ('task', 2), ('task', 2)])
+
+    def test_stop_element_is_not_dropped(self):
+        q = DeadlineTaskQueue(10, max_lag=1, metric_prefix='test_deadline_q')
+        q.enqueue(('task', 0))
+        q.enqueue(('task', 1))
+        q.abrupt_stop(-1)
+        elements = q.dequeue_batch(10)
+        self.assertEqual(elements[-1], -1)
+        self.assertEqual(q.size(), 1)
@@ -0,0 +1,49 @@
+import unittest
+
+import numpy as np
+
+from detection.detection_cache import DetectionCache
+
+
+class TestDetectionCache(unittest.TestCase):
+    DET_BOXES = [(10, 10, 50, 90, 'person', 0.8)]
+    LOCATION = (100, 100, 228, 228)
+
+    def setUp(self):
+        self.cache = DetectionCache(max_size=2, hamming_tolerance=4, ttl=10, location_tolerance=8,
+                                    metric_prefix='test_od_cache')
+        rng = np.random.default_rng(0)
+        self.crop = rng.integers(0, 255, size=(128, 128, 3), dtype=np.uint8)
+
+    def test_identical_crop_hits(self):
+        key = self.cache.key(self.crop, TestDetectionCache.LOCATION)
+        self.assertIsNone(self.cache.get(key, now=0))
+        self.cache.put(key, TestDetectionCache.DET_BOXES, now=0)
+        self.assertEqual(self.cache.get(key, now=1), TestDetectionCache.DET_BOXES)
+        self.assertEqual(self.cache.status(), {'size': 1, 'hits': 1, 'misses': 1})
+
+    def test_flickering_crop_hits(self):
+        self.cache.put(self.cache.key(self.crop, TestDetectionCache.LOCATION), TestDetectionCache.DET_BOXES, now=0)
+        flickered = np.clip(self.crop.astype(np.int16) + 2, 0, 255).astype(np.uint8)
+        moved_location = (104, 98, 232, 226)
+        self.assertEqual(self.cache.get(self.cache.key(flickered, moved_location), now=1),
+                         TestDetectionCache.DET_BOXES)
+
+    def test_different_crop_or_location_misses(self):
+        self.cache.put(self.cache.key(self.crop, TestDetectionCache.LOCATION), TestDetectionCache.DET_BOXES, now=0)
+        self.assertIsNone(self.cache.get(self.cache.key(255 - self.crop, TestDetectionCache.LOCATION), now=1))
+        self.assertIsNone(self.cache.get(self.cache.key(self.crop, (300, 100, 428, 228)), now=1))
+
+    def test_ttl_eviction(self):
+        key = self.cache.key(self.crop, TestDetectionCache.LOCATION)
+        self.cache.put(key, TestDetectionCache.DET_BOXES, now=0)
+        self.assertIsNone(self.cache.get(key, now=11))
+        self.assertEqual(len(self.cache.entries), 0)
+
+    def test_lru_eviction(self):
+        keys = [self.cache.key(self.crop, (i * 100, 0, i * 100 + 128, 128)) for i in range(3)]
+        self.cache.put(keys[0], [], now=0)
+        self.cache.put(keys[1], [], now=0)
+        self.cache.get(keys[0], now=0)
+        self.cache.put(keys[2], [], now=0)
+        self.assertEqual(list(self.cache.entries), [keys[0], keys[2]])
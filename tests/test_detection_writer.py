@@ -0,0 +1,176 @@
+import os
+import queue
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from configs.config_base import ConfigBase
+from detection.detection_writer import AsyncDetectionWriter
+from detection.object_detector_base import BaseTFObjectDetector
+from detection.object_detector_process import od_worker_process
+from detection.object_detector_streaming import StreamingTFObjectDetector, ResultKind
+from lib.shared_frames import SharedFramePool
+from lib.task_queue import BlockingTaskQueue
+
+
+class RecordingObjectDetector():
+    """
+    stands in for the object detector of the writer, its first render blocks till `resume` is set
+    """
+
+    def __init__(self):
+        self.rendering = threading.Event()
+        self.resume = threading.Event()
+        self.published = []
+        self.written = []
+
+    def render_detections(self, frame, orig_boxes):
+        self.rendering.set()
+        self.resume.wait()
+        return frame
+
+    def publish_output_frame(self, output_frame):
+        self.published.append(int(output_frame[0, 0, 0]))
+
+    def write_detections(self, output_frame, frame_shape, detections):
+        if detections == 'fail':
+            raise IOError('disk full')
+        self.written.append(int(output_frame[0, 0, 0]))
+
+
+class StubDetector():
+    label_names = np.array(['person', 'car'])
+
+    def DisplayDetection(self, img, box, det_time=None):
+        return img
+
+    def DetectRawFromImages(self, imgs):
+        # a person and a car in every frame
+        return [(np.array([[1, 1, 5, 5], [6, 6, 9, 9]]), np.array([0, 1]), np.array([0.9, 0.8])) for _ in imgs]
+
+
+def frame(value):
+    return np.full((20, 20, 3), value, dtype=np.uint8)
+
+
+class TestAsyncDetectionWriter(unittest.TestCase):
+    def test_drops_the_oldest_job_when_full(self):
+        od = RecordingObjectDetector()
+        writer = AsyncDetectionWriter(od, num_threads=1, max_size=2)
+        writer.write(frame(1), [])
+        # the writer thread is busy with the first job, the next ones queue up
+        od.rendering.wait()
+        for value in [2, 3, 4]:
+            writer.write(frame(value), [])
+        self.assertEqual(writer.status(), {'queue_size': 2, 'dropped': 1, 'written': 0})
+        od.resume.set()
+        writer.stop()
+
+        self.assertEqual(od.published, [1, 3, 4])
+        self.assertEqual(od.written, [1, 3, 4])
+        self.assertEqual(writer.status(), {'queue_size': 0, 'dropped': 1, 'written': 3})
+
+    def test_failed_writes_are_not_counted(self):
+        od = RecordingObjectDetector()
+        od.resume.set()
+        writer = AsyncDetectionWriter(od, num_threads=2)
+        writer.write(frame(1), [])
+        writer.write(frame(2), 'fail')
+        writer.write(frame(3), [])
+        writer.stop()
+
+        self.assertEqual(sorted(od.written), [1, 3])
+        self.assertEqual(writer.status(), {'queue_size': 0, 'dropped': 0, 'written': 2})
+
+
+class TestDetectionArtifacts(unittest.TestCase):
+    """
+    the frame of a batch of detections is encoded once, whichever path writes it
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config = ConfigBase()
+        self.config.tf_od_frame_write = True
+        self.config.tf_od_annotation_write = True
+        self.config.tf_output_detection_path = self.tmp_dir.name
+        imencode = mock.patch('detection.object_detector_base.cv2.imencode', wraps=cv2.imencode)
+        self.imencode = imencode.start()
+        self.addCleanup(imencode.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _detections(self, od, ts):
+        # two people (written to the same image) and a car
+        return [((1, 1, 5, 5, 'person', 0.9), od.detection_image_path('person', ts)),
+                ((2, 2, 6, 6, 'person', 0.7), od.detection_image_path('person', ts)),
+                ((6, 6, 9, 9, 'car', 0.8), od.detection_image_path('car', ts))]
+
+    def _assert_written(self, num_frames):
+        self.assertEqual(self.imencode.call_count, num_frames)
+        written = sorted(os.listdir(self.tmp_dir.name))
+        self.assertEqual(len([path for path in written if path.endswith('.jpg')]), 2 * num_frames)
+        self.assertEqual(len([path for path in written if path.endswith('.xml')]), 2 * num_frames)
+
+    def _streaming_detector(self, async_writer):
+        self.config.od_async_writer = async_writer
+        od = StreamingTFObjectDetector(self.config, BlockingTaskQueue(10))
+        od.tf_detector = StubDetector()
+        return od
+
+    def test_sync_writes(self):
+        od = self._streaming_detector(async_writer=False)
+        for ts in [1, 2]:
+            od.process_detections_intermediate(frame(ts), self._detections(od, ts))
+        od.fps.stop()
+        self._assert_written(2)
+
+    def test_async_writes(self):
+        od = self._streaming_detector(async_writer=True)
+        for ts in [1, 2]:
+            od.process_detections_intermediate(frame(ts), self._detections(od, ts))
+        od.detection_writer.stop()
+        od.fps.stop()
+        self.assertEqual(od.detection_writer.status()['written'], 2)
+        self._assert_written(2)
+
+    def test_worker_process_writes(self):
+        self.config.od_batch_size = 2
+        frame_pool = SharedFramePool(2)
+        job_q, result_q = queue.Queue(), queue.Queue()
+        for ts in [1, 2]:
+            slot_id, slot_name = frame_pool.acquire(frame(ts))
+            job_q.put((ts, slot_name, (20, 20, 3), np.dtype(np.uint8).str, (0, 0, 20, 20), ts))
+        job_q.put(None)
+        # the worker runs in this process, with a detector which doesn't need TF
+        with mock.patch.object(BaseTFObjectDetector, 'create_tf_detector', return_value=StubDetector()):
+            od_worker_process(self.config, 0, job_q, result_q)
+        frame_pool.close()
+
+        results = [result_q.get() for _ in range(result_q.qsize())]
+        self.assertEqual([len(result[1][2]) for result in results if isinstance(result[1], tuple)], [2, 2])
+        self._assert_written(2)
+
+    def test_worker_process_cache_hits_are_not_written(self):
+        self.config.od_cache_enabled = True
+        frame_pool = SharedFramePool(2)
+        job_q, result_q = queue.Queue(), queue.Queue()
+        # the same frame twice, in separate batches
+        for ts in [1, 2]:
+            slot_id, slot_name = frame_pool.acquire(frame(1))
+            job_q.put((ts, slot_name, (20, 20, 3), np.dtype(np.uint8).str, (0, 0, 20, 20), ts))
+        job_q.put(None)
+        with mock.patch.object(BaseTFObjectDetector, 'create_tf_detector', return_value=StubDetector()):
+            od_worker_process(self.config, 0, job_q, result_q)
+        frame_pool.close()
+
+        results = [result[1] for result in [result_q.get() for _ in range(result_q.qsize())]
+                   if isinstance(result[1], tuple)]
+        self.assertEqual([kind for (seq, kind, detections) in results], [ResultKind.DETECTED, ResultKind.CACHED])
+        self.assertEqual(results[0][2], results[1][2])
+        self._assert_written(1)
@@ -1,10 +1,13 @@
 import unittest
 
+import numpy as np
 from parameterized import parameterized
 
+from configs.config_patterns import door_movement
 from detection.door_state_detectors import SingleShotDoorStateDetector, AdaptiveDoorStateDetector, \
-    SingleShotFrameDiffDoorStateDetector
-from detection.state_managers.door_state_manager import DoorStates
+    SingleShotFrameDiffDoorStateDetector, DoorStateDetectorGroup
+from detection.state_managers.door_state_manager import DoorStates, DoorState, door_agnostic_patterns
+from detection.states import NotState
 from tests.door_state_detect_tool import DoorStateDetectTools
 
 
@@ -104,3 +107,57 @@ class TestDoorStateDetectors(unittest.TestCase):
         self.assertEqual(
             exp_door_state,
             actual_result)
+
+
+class TestDoorStateDetectorGroup(unittest.TestCase):
+    def _detectors(self):
+        door_closed_avg_rgb = TestDoorStateDetectors.door_state_detector_door_close_avg_rgb
+        door_open_avg_rgb = TestDoorStateDetectors.door_state_detector_door_open_avg_rgb
+        return {
+            'front': SingleShotFrameDiffDoorStateDetector((215, 114, 227, 123), (196, 131, 215, 147), threshold=50),
+            'back': SingleShotFrameDiffDoorStateDetector((20, 30, 40, 50), (60, 30, 75, 45), threshold=500),
+            'garage': SingleShotDoorStateDetector((300, 200, 331, 225), door_closed_avg_rgb, door_open_avg_rgb),
+            'gate': SingleShotDoorStateDetector((0, 0, 1, 1), door_closed_avg_rgb, door_open_avg_rgb),
+            'side': AdaptiveDoorStateDetector((100, 150, 140, 170), (DoorStates.DOOR_CLOSED, DoorStates.DOOR_OPEN),
+                                              warmup_frames=3, diff_threshold=300, avg_update_frames=4)
+        }
+
+    @parameterized.expand([[seed] for seed in range(3)])
+    def test_group_matches_detectors(self, seed):
+        rng = np.random.default_rng(seed)
+        detectors = self._detectors()
+        group = DoorStateDetectorGroup(self._detectors())
+        door_states = set()
+        for i in range(30):
+            frame = rng.integers(0, 256, (240, 340, 3), dtype=np.uint8)
+            if i % 2:
+                # flat colors, whose averages are exact
+                frame[:] = rng.integers(0, 256, 3)
+            expected = {door: detector.detect_door_state(frame) for door, detector in detectors.items()}
+            self.assertEqual(group.detect_door_states(frame), expected)
+            door_states.update(expected.items())
+        # both states of some doors were detected
+        self.assertGreater(len(door_states), len(detectors))
+
+    def test_group_clusters_distant_doors(self):
+        def detectors():
+            # small doors at opposite corners of a 1080p frame
+            return {
+                'front': SingleShotFrameDiffDoorStateDetector((10, 10, 30, 25), (40, 10, 55, 25)),
+                'garage': SingleShotDoorStateDetector((1880, 1040, 1910, 1070), (118, 80, 26), (151, 117, 72))
+            }
+
+        frame = np.random.default_rng(0).integers(0, 256, (1080, 1920, 3), dtype=np.uint8)
+        group, individual = DoorStateDetectorGroup(detectors()), detectors()
+        # an integral image around every door rather than one of the whole frame, see
+        # tools/benchmark_door_state_detectors.py for their timings
+        self.assertEqual(len(group.clusters), 2)
+        self.assertEqual(group.detect_door_states(frame),
+                         {door: detector.detect_door_state(frame) for door, detector in individual.items()})
+
+    def test_door_agnostic_patterns(self):
+        self.assertEqual(door_agnostic_patterns(door_movement.pattern_steps),
+                         [ptn for ptn, _ in door_movement.pattern_steps])
+        self.assertEqual(door_agnostic_patterns([
+            ('garage', [DoorState('garage', DoorStates.DOOR_OPEN), NotState(DoorState('garage', DoorStates.DOOR_CLOSED))]),
+            ('any_door', [NotState(DoorStates.DOOR_CLOSED, 5)])]), ['any_door'])
@@ -0,0 +1,41 @@
+import unittest
+
+import numpy as np
+
+from lib.masks import Mask
+
+
+class TestMask(unittest.TestCase):
+    def _random_boxes(self, num_boxes, seed):
+        rng = np.random.default_rng(seed)
+        mins = rng.integers(-20, 300, size=(num_boxes, 2))
+        return np.concatenate([mins, mins + rng.integers(0, 150, size=(num_boxes, 2))], axis=1)
+
+    def test_rectangle_polygon_contains(self):
+        rectangle = Mask((30, 40, 200, 150))
+        polygon = Mask([(30, 40), (200, 40), (200, 150), (30, 150)])
+        boxes = self._random_boxes(5000, 0)
+        # the integral image of the interior of the polygon matches the strict bounds of the rectangle
+        np.testing.assert_array_equal(rectangle.contains(boxes), polygon.contains(boxes))
+        self.assertTrue(rectangle.contains(boxes).any())
+        self.assertTrue(polygon.contains_box(31, 41, 199, 149))
+        self.assertFalse(polygon.contains_box(30, 41, 199, 149))
+
+    def test_polygon_contains(self):
+        # an L shape
+        mask = Mask([(0, 0), (100, 0), (100, 50), (50, 50), (50, 100), (0, 100)])
+        self.assertEqual(mask.box, (0, 0, 100, 100))
+        self.assertTrue(mask.contains_box(10, 10, 90, 40))
+        self.assertTrue(mask.contains_box(10, 10, 40, 90))
+        self.assertFalse(mask.contains_box(10, 10, 90, 90))
+        self.assertFalse(mask.contains_box(60, 60, 90, 90))
+        self.assertFalse(mask.contains_box(-10, 10, 40, 40))
+
+    def test_rasterize(self):
+        mask = Mask([(10, 10), (60, 10), (60, 40), (10, 40)])
+        bitmap = mask.rasterize((0, 20, 50, 60))
+        self.assertEqual(bitmap.shape, (40, 50))
+        expected = np.zeros((40, 50), dtype=np.uint8)
+        expected[0:21, 10:50] = 255
+        np.testing.assert_array_equal(bitmap, expected)
+        self.assertFalse(mask.rasterize((100, 100, 120, 120)).any())
@@ -0,0 +1,161 @@
+import unittest
+
+import numpy as np
+
+from configs.config_base import ConfigBase
+from detection.motion_detector import SimpleMotionDetector, cluster_boxes
+
+
+class TestSimpleMotionDetector(unittest.TestCase):
+    def _frames(self, num_frames, shape=(240, 320, 3)):
+        rng = np.random.default_rng(0)
+        background = rng.integers(60, 120, shape, dtype=np.uint8)
+        for i in range(num_frames):
+            frame = background.copy()
+            # a bright box moving to the right
+            frame[50:150, 10 + i * 10:60 + i * 10] = 230
+            yield frame
+
+    def _config(self):
+        config = ConfigBase()
+        config.md_min_cont_area = 50
+        config.md_timing_breakdown = True
+        return config
+
+    def test_detect_motion(self):
+        md = SimpleMotionDetector(self._config())
+        crops = [md.detect(frame)[1] for frame in self._frames(5)]
+        self.assertIsNone(crops[0])
+        for i, crop in enumerate(crops[1:], 1):
+            minX, minY, maxX, maxY = crop
+            # the box where it was (still in the background model) and where it is now
+            self.assertLessEqual(minX, 10 + (i - 1) * 10)
+            self.assertGreaterEqual(maxX, 60 + i * 10)
+            self.assertTrue(40 <= minY <= 50 and 150 <= maxY <= 160)
+        self.assertTrue(all(ms > 0 for ms in md.timing_breakdown().values()))
+
+    def test_buffers_reused(self):
+        md = SimpleMotionDetector(self._config())
+        frames = list(self._frames(3))
+        md.detect(frames[0])
+        buffers = md.buffers
+        for frame in frames[1:]:
+            md.detect(frame)
+        self.assertIs(md.buffers, buffers)
+        self.assertIs(md.bg, buffers.bg)
+        self.assertEqual(md.bg.dtype, np.float32)
+
+        # a new resolution starts a new background model
+        md.detect(np.zeros((120, 160, 3), dtype=np.uint8))
+        self.assertIsNot(md.buffers, buffers)
+        self.assertEqual(md.bg.shape, (120, 160))
+
+    def test_analysis_scale(self):
+        full_scale_md = SimpleMotionDetector(self._config())
+        config = self._config()
+        config.md_analysis_scale = 1 / 4
+        md = SimpleMotionDetector(config)
+        for frame in self._frames(5):
+            full_scale_crop = full_scale_md.detect(frame.copy())[1]
+            crop = md.detect(frame)[1]
+        self.assertEqual(md.buffers.thresh.shape, (60, 80))
+        # the crop is in frame coordinates, within the blurring of the downsampled frames of the full scale one
+        for coord, full_scale_coord in zip(crop, full_scale_crop):
+            self.assertLessEqual(abs(coord - full_scale_coord), 12)
+
+        config.md_analysis_scale = 1 / 3
+        with self.assertRaises(ValueError):
+            md.detect(frame)
+
+    def test_connected_components(self):
+        config = self._config()
+        config.md_connected_components = True
+        md = SimpleMotionDetector(config)
+        contours_md = SimpleMotionDetector(self._config())
+        for frame in self._frames(5):
+            output_frame, crop, _ = md.detect(frame.copy())
+            contours_output_frame, contours_crop, _ = contours_md.detect(frame.copy())
+            self.assertEqual(crop, contours_crop)
+            np.testing.assert_array_equal(output_frame, contours_output_frame)
+        self.assertIsNotNone(crop)
+        self.assertEqual(md.buffers.labels.dtype, np.int32)
+
+    def test_cluster_boxes(self):
+        boxes = [(0, 0, 10, 10), (15, 0, 25, 10), (28, 5, 40, 20), (200, 200, 210, 210), (100, 0, 110, 10)]
+        # a chain of near boxes is a single region
+        self.assertEqual(sorted(cluster_boxes(boxes, 5, merge_distance=5)),
+                         [(0, 0, 40, 20), (100, 0, 110, 10), (200, 200, 210, 210)])
+        # the regions whose union grows the least are merged first
+        self.assertEqual(sorted(cluster_boxes(boxes, 2, merge_distance=5)), [(0, 0, 110, 20), (200, 200, 210, 210)])
+        self.assertEqual(cluster_boxes(boxes, 1), [(0, 0, 210, 210)])
+        self.assertEqual(cluster_boxes([], 2), [])
+
+    def test_motion_regions(self):
+        config = self._config()
+        config.md_max_regions = 2
+        md = SimpleMotionDetector(config)
+        rng = np.random.default_rng(0)
+        background = rng.integers(60, 120, (240, 320, 3), dtype=np.uint8)
+        md.detect(background.copy())
+        frame = background.copy()
+        # motion at opposite ends of the frame
+        frame[20:60, 10:40] = 230
+        frame[180:230, 270:310] = 230
+        crop = md.detect(frame)[1]
+        self.assertEqual(len(md.regions), 2)
+        for (minX, minY, maxX, maxY) in md.regions:
+            self.assertLess((maxX - minX) * (maxY - minY), 4000)
+            self.assertTrue(crop[0] <= minX and crop[1] <= minY and maxX <= crop[2] and maxY <= crop[3])
+
+        # the regions are filtered on their own, the union crop is kept if none passes
+        config.md_box_threshold_x = 35
+        md.detect(background.copy())
+        md.detect(frame)
+        self.assertEqual(len(md.regions), 1)
+        config.md_box_threshold_x = 45
+        md.detect(background.copy())
+        crop = md.detect(frame)[1]
+        self.assertEqual(md.regions, [crop])
+
+    def _restricted_crops(self, mask, nmask=None, frames=None):
+        config = self._config()
+        config.md_mask = mask
+        config.md_nmask = nmask
+        config.md_restrict_to_mask = True
+        md = SimpleMotionDetector(config)
+        return md, [md.detect(frame)[1:] for frame in frames]
+
+    def test_restrict_to_mask(self):
+        frames = list(self._frames(5))
+        unrestricted = SimpleMotionDetector(self._config())
+        unrestricted_crops = [unrestricted.detect(frame.copy())[1] for frame in frames]
+
+        # motion within the mask is found the same way, only the bounding box of the mask is analysed
+        md, results = self._restricted_crops((5, 20, 200, 200), frames=[frame.copy() for frame in frames])
+        self.assertEqual(md.buffers.thresh.shape, (181, 196))
+        self.assertEqual([crop for crop, _ in results], unrestricted_crops)
+        self.assertTrue(all(motion_outside is False for _, motion_outside in results[1:]))
+
+        # motion crossing the outline of a polygon mask is outside of it
+        background = frames[0]
+        inside, crossing = background.copy(), background.copy()
+        inside[160:210, 100:150] = 230
+        crossing[160:210, 10:60] = 230
+        rectangle, triangle = [(30, 0), (300, 0), (300, 239), (30, 239)], [(30, 0), (300, 0), (300, 239)]
+        self.assertEqual(self._restricted_crops(rectangle, frames=[background, inside])[1][1][1], False)
+        crop, motion_outside = self._restricted_crops(rectangle, frames=[background, crossing])[1][1]
+        self.assertEqual(crop[0], 30)
+        self.assertEqual(motion_outside, True)
+        # the motion in the corner cut off by a triangle mask is ignored
+        diagonal = background.copy()
+        diagonal[160:210, 200:260] = 230
+        md, results = self._restricted_crops(triangle, frames=[background, diagonal])
+        self.assertIsNotNone(md.buffers.mask_bitmap)
+        self.assertEqual(results[1][1], True)
+        self.assertEqual(self._restricted_crops(triangle, frames=[background, crossing])[1][1], (None, None))
+
+        # the pixels of the nmask never show motion
+        md, results = self._restricted_crops(None, nmask=[(0, 0), (319, 0), (319, 239), (0, 239)],
+                                             frames=[frame.copy() for frame in frames])
+        self.assertEqual(md.buffers.thresh.shape, (240, 320))
+        self.assertEqual([crop for crop, _ in results], [None] * 5)
@@ -0,0 +1,49 @@
+import unittest
+
+import numpy as np
+from parameterized import parameterized
+
+from configs.config_base import ConfigBase
+from detection.object_detector_base import BaseTFObjectDetector
+
+
+class TestObjectDetectorFilters(unittest.TestCase):
+    LABEL_NAMES = np.array(['person', 'bicycle', 'car', 'dog', 'cat'], dtype=object)
+
+    def _random_raw_detections(self, num_boxes, seed):
+        rng = np.random.default_rng(seed)
+        mins = rng.integers(0, 400, size=(num_boxes, 2))
+        sizes = rng.integers(0, 400, size=(num_boxes, 2))
+        pixel_boxes = np.concatenate([mins, mins + sizes], axis=1)
+        class_ids = rng.integers(0, len(TestObjectDetectorFilters.LABEL_NAMES), size=num_boxes)
+        scores = rng.random(num_boxes).astype(np.float32)
+        return pixel_boxes, class_ids, scores
+
+    @parameterized.expand([
+        [0.5, None, None, None, None],
+        [0.2, ['person', 'dog'], None, None, None],
+        [0.2, ['person'], (150, 150), None, None],
+        [0.1, None, (100, 50), [(0, 0, 500, 500)], None],
+        [0.1, ['dog', 'cat'], None, [(0, 0, 300, 800), (200, 0, 800, 800)], None],
+        [0.1, None, None, None, [(0, 0, 400, 400)]],
+        [0.0, ['person', 'car'], (20, 20), [(0, 0, 700, 700)], [(0, 0, 300, 300), (300, 300, 800, 800)]],
+        [0.0, None, None, [[(0, 0), (800, 0), (0, 800)], (100, 100, 600, 700)], [[[50, 50], [400, 80], [300, 400]]]],
+    ])
+    def test_raw_filters_match_filters(self, accuracy_threshold, labels, box_thresholds, masks, nmasks):
+        config = ConfigBase()
+        config.tf_accuracy_threshold = accuracy_threshold
+        config.tf_detection_labels = labels
+        config.tf_box_thresholds = box_thresholds
+        config.tf_detection_masks = masks
+        config.tf_detection_nmasks = nmasks
+        od = BaseTFObjectDetector(config)
+
+        for seed in range(20):
+            raw_detections = self._random_raw_detections(100, seed)
+            pixel_boxes, class_ids, scores = raw_detections
+            det_boxes = [tuple(box) + (TestObjectDetectorFilters.LABEL_NAMES[class_id], float(score))
+                         for box, class_id, score in zip(pixel_boxes.tolist(), class_ids, scores)]
+
+            self.assertEqual(
+                od.apply_od_filters(det_boxes),
+                od.apply_od_filters_raw(raw_detections, TestObjectDetectorFilters.LABEL_NAMES))
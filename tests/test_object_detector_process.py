@@ -0,0 +1,125 @@
+import multiprocessing
+import os
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from configs.config_base import ConfigBase
+from detection.object_detector_base import BaseTFObjectDetector
+from detection.object_detector_process import ProcessTFObjectDetector
+from detection.object_detector_streaming import ResultKind
+from lib.task_queue import BlockingTaskQueue
+
+
+class StubDetector():
+    """
+    a detector without TF: every frame has a single detection, whose box is the value of its first pixel.
+    the worker process detecting a frame of value DEADLY dies
+    """
+    label_names = np.array(['person'])
+    DEADLY = 99
+
+    def DetectRawFromImages(self, imgs):
+        if any(int(img[0, 0, 0]) == StubDetector.DEADLY for img in imgs):
+            # dies while detecting, once the feeder thread of the result queue has sent the taken jobs
+            time.sleep(0.2)
+            os._exit(1)
+        return [(np.array([[value, value, value + 10, value + 10]]), np.array([0]), np.array([0.9]))
+                for value in [int(img[0, 0, 0]) for img in imgs]]
+
+    def DisplayDetection(self, img, box, det_time=None):
+        return img
+
+
+class RecordingObjectDetector(ProcessTFObjectDetector):
+    def __init__(self, config):
+        super().__init__(config, BlockingTaskQueue(10000))
+        # the worker processes are forked, so that they inherit the stub detector
+        self.mp_context = multiprocessing.get_context('fork')
+        self.job_q = self.mp_context.Queue()
+        self.result_q = self.mp_context.Queue()
+        self.commits = []
+
+    def commit_task(self, result):
+        slot_id, ts, kind, detection_result = result
+        self.commits.append((ts, kind))
+        super().commit_task(result)
+
+    def process_detection_final(self, label, accuracy, image_path, ts):
+        pass
+
+
+class TestProcessTFObjectDetector(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(BaseTFObjectDetector, 'create_tf_detector', return_value=StubDetector())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.config = ConfigBase()
+
+    def _detect(self, od, timestamps, value=5):
+        od.start()
+        od.wait_for_ready()
+        for ts in timestamps:
+            frame = np.full((40, 40, 3), value, dtype=np.uint8)
+            od.add_task((frame, frame[10:30, 10:30], (10, 10), ts))
+            while od.get_current_lag():
+                time.sleep(0.001)
+        od.stop()
+
+    def test_carried_over_tasks_skip_the_workers(self):
+        self.config.od_tracker_enabled = True
+        od = RecordingObjectDetector(self.config)
+        self._detect(od, range(1, 31))
+
+        self.assertEqual([ts for (ts, kind) in od.commits], list(range(1, 31)))
+        detected = [ts for (ts, kind) in od.commits if kind == ResultKind.DETECTED]
+        carried = [ts for (ts, kind) in od.commits if kind == ResultKind.CARRIED_OVER]
+        self.assertEqual(len(detected) + len(carried), 30)
+        # re-detected every reinference_frames frames
+        self.assertEqual(detected, [1, 7, 13, 19, 25])
+        self.assertEqual(od.fps.sliding_total, len(detected))
+
+    def test_workers_own_the_cache_and_the_writes(self):
+        self.config.od_cache_enabled = True
+        self.config.od_async_writer = True
+        self.config.od_num_workers = 2
+        od = RecordingObjectDetector(self.config)
+        self.assertIsNone(od.detection_writer)
+        self.assertIsNone(od.detection_cache)
+        self._detect(od, range(1, 11))
+
+        cached = [ts for (ts, kind) in od.commits if kind == ResultKind.CACHED]
+        # the first crop of every worker misses its cache
+        self.assertGreaterEqual(len(cached), 8)
+        status = od.detection_cache_status()
+        self.assertEqual(status['hits'], len(cached))
+        self.assertEqual(status['hits'] + status['misses'], 10)
+        self.assertEqual(od.fps.sliding_total, status['misses'])
+
+    def test_jobs_of_a_dead_worker_are_failed(self):
+        self.config.od_num_workers = 2
+        self.config.od_batch_size = 3
+        od = RecordingObjectDetector(self.config)
+        od.start()
+        od.wait_for_ready()
+        for ts in range(1, 13):
+            frame = np.full((40, 40, 3), StubDetector.DEADLY if ts == 5 else ts, dtype=np.uint8)
+            od.add_task((frame, frame[10:30, 10:30], (10, 10), ts))
+        while od.get_current_lag():
+            time.sleep(0.01)
+        self.assertFalse(od.is_alive())
+        # every slot is released once the jobs of the dead worker are failed
+        self.assertEqual(len(od.frame_pool.free_slots), self.config.od_shared_frame_slots)
+        od.stop()
+
+        self.assertEqual([ts for (ts, kind) in od.commits], list(range(1, 13)))
+        failed = [ts for (ts, kind) in od.commits if kind == ResultKind.SKIPPED]
+        detected = [ts for (ts, kind) in od.commits if kind == ResultKind.DETECTED]
+        # the batch the worker died on, the other worker detects the jobs queued after it
+        self.assertIn(5, failed)
+        self.assertLessEqual(len(failed), self.config.od_batch_size)
+        self.assertEqual(len(failed) + len(detected), 12)
+        self.assertEqual(od.fps.sliding_total, len(detected))
+        self.assertEqual(sum(not p.is_alive() for p in od.worker_processes), 2)
@@ -0,0 +1,170 @@
+import threading
+import time
+import unittest
+
+import numpy as np
+from parameterized import parameterized
+
+from configs.config_base import ConfigBase
+from detection.object_detector_streaming import StreamingTFObjectDetector, ResultKind
+from lib.task_queue import BlockingTaskQueue, DroppedTasks
+
+
+class StubDetector():
+    """
+    a detector without TF: every frame has a single detection, whose box is the value of its first pixel
+    """
+    label_names = np.array(['person'])
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.invoked_buffers = set()
+
+    def AllocateInputBuffer(self, batch_size):
+        return np.zeros(batch_size, dtype=np.int64)
+
+    def PrepareImages(self, imgs, input_buffer=None):
+        input_buffer[:len(imgs)] = [int(img[0, 0, 0]) for img in imgs]
+        return input_buffer, len(imgs)
+
+    def DetectRawFromPrepared(self, prepared):
+        input_buffer, num_imgs = prepared
+        with self.lock:
+            self.invoked_buffers.add(id(input_buffer))
+        # give the prepare thread the time to overwrite the buffer, if it were to reuse it too early
+        time.sleep(0.002)
+        return [self._raw_detections(value) for value in input_buffer[:num_imgs].tolist()]
+
+    def DetectRawFromImages(self, imgs):
+        return [self._raw_detections(int(img[0, 0, 0])) for img in imgs]
+
+    @staticmethod
+    def _raw_detections(value):
+        return np.array([[value, value, value + 10, value + 10]]), np.array([0]), np.array([0.9])
+
+    def DisplayDetection(self, img, box, det_time=None):
+        return img
+
+
+class SkipEveryThird():
+    def skip_task(self, ts):
+        return ts % 3 == 0
+
+
+class RecordingObjectDetector(StreamingTFObjectDetector):
+    def __init__(self, config):
+        super().__init__(config, BlockingTaskQueue(10000))
+        self.task_skipper = SkipEveryThird()
+        self.commits = []
+        self.carried = []
+        self.cached = []
+        self.rendered = []
+        self.committed_offsets = []
+        self.detected = {}
+
+    def create_tf_detector(self):
+        return StubDetector()
+
+    def commit_task(self, result):
+        task, kind, detections = result
+        self.commits.append(task)
+        if kind == ResultKind.DETECTED and detections:
+            self.detected[task[3]] = detections[0][0]
+        if kind == ResultKind.CARRIED_OVER:
+            self.carried.append(task[3])
+        if kind == ResultKind.CACHED:
+            self.cached.append(detections)
+        super().commit_task(result)
+        self.committed_offsets.append(self.latest_committed_offset)
+
+    def process_detections_intermediate(self, frame, detections):
+        self.rendered.append(detections)
+
+    def process_detection_final(self, label, accuracy, image_path, ts):
+        pass
+
+
+class TestStreamingTFObjectDetector(unittest.TestCase):
+    @parameterized.expand([
+        [1, 1],
+        [1, 4],
+        [3, 2],
+    ])
+    def test_pipelined_commits_in_queue_order(self, num_workers, batch_size):
+        config = ConfigBase()
+        config.od_pipelined = True
+        config.od_num_workers = num_workers
+        config.od_batch_size = batch_size
+        # drops the oldest tasks when more than 8 are queued
+        config.od_max_lag_frames = 8
+        od = RecordingObjectDetector(config)
+        od.start()
+        od.wait_for_ready()
+        for ts in range(1, 201):
+            frame = np.full((40, 40, 3), ts % 200, dtype=np.uint8)
+            od.add_task((frame, frame[10:30, 10:30], (10, 10), ts))
+        while od.get_current_lag():
+            time.sleep(0.01)
+        od.stop()
+
+        # every task is committed once, the dropped ones as part of a run, in the order they were queued
+        committed_ts = []
+        for task in od.commits:
+            if isinstance(task, DroppedTasks):
+                committed_ts.extend(range(task.min_ts, task.max_ts + 1))
+            else:
+                committed_ts.append(task[3])
+        self.assertEqual(committed_ts, list(range(1, 201)))
+        self.assertTrue(any(isinstance(task, DroppedTasks) for task in od.commits))
+        self.assertEqual(od.committed_offsets, sorted(od.committed_offsets))
+        self.assertEqual(od.latest_committed_offset, 200)
+
+        # the skipped tasks aren't detected, the others are detected from their own prepared input
+        detected = [task[3] for task in od.commits if not isinstance(task, DroppedTasks) and task[3] % 3 != 0]
+        self.assertEqual(sorted(od.detected), detected)
+        self.assertEqual(od.detected, {ts: ts % 200 for ts in detected})
+        # the prepare thread of every worker rotates over its 3 input buffers
+        for tf_detector in od.tf_detectors:
+            self.assertLessEqual(len(tf_detector.invoked_buffers), 3)
+
+    def test_carried_over_tasks_are_not_counted_as_inferences(self):
+        config = ConfigBase()
+        config.od_tracker_enabled = True
+        od = RecordingObjectDetector(config)
+        od.start()
+        od.wait_for_ready()
+        # the same object in every frame, its detection is carried over between the re-inferences
+        for ts in range(1, 31):
+            frame = np.full((40, 40, 3), 5, dtype=np.uint8)
+            od.add_task((frame, frame[10:30, 10:30], (10, 10), ts))
+            while od.get_current_lag():
+                time.sleep(0.001)
+        od.stop()
+
+        self.assertGreater(len(od.carried), 0)
+        self.assertEqual(od.fps.sliding_total, len(od.detected))
+
+    @parameterized.expand([
+        [False],
+        [True],
+    ])
+    def test_cache_hits_are_not_counted_nor_written(self, pipelined):
+        config = ConfigBase()
+        config.od_pipelined = pipelined
+        config.od_cache_enabled = True
+        od = RecordingObjectDetector(config)
+        od.start()
+        od.wait_for_ready()
+        # the same crop in every frame, only the first one is detected
+        for ts in [1, 2, 4, 5]:
+            frame = np.full((40, 40, 3), 5, dtype=np.uint8)
+            od.add_task((frame, frame[10:30, 10:30], (10, 10), ts))
+            while od.get_current_lag():
+                time.sleep(0.001)
+        od.stop()
+
+        self.assertEqual(list(od.detected), [1])
+        self.assertEqual(od.fps.sliding_total, 1)
+        self.assertEqual(len(od.rendered), 1)
+        # the hits refer to the image of the detection they were cached from
+        self.assertEqual(od.cached, od.rendered * 3)
@@ -0,0 +1,52 @@
+import unittest
+
+from detection.object_tracker import ObjectTracker, box_iou
+
+
+class TestObjectTracker(unittest.TestCase):
+    PERSON = (100, 100, 200, 300, 'person', 0.9)
+
+    def setUp(self):
+        self.tracker = ObjectTracker(iou_threshold=0.3, max_centroid_distance=20, reinference_frames=2,
+                                     max_misses=1, max_age=2)
+
+    def test_box_iou(self):
+        self.assertEqual(box_iou((0, 0, 10, 10), (0, 0, 10, 10)), 1.0)
+        self.assertEqual(box_iou((0, 0, 10, 10), (10, 10, 20, 20)), 0.0)
+        self.assertAlmostEqual(box_iou((0, 0, 10, 10), (5, 0, 15, 10)), 1 / 3)
+
+    def test_new_object_is_detected(self):
+        self.assertIsNone(self.tracker.track((90, 90, 210, 310), 0))
+
+    def test_tracked_object_is_carried_over_then_redetected(self):
+        crop = (90, 90, 210, 310)
+        self.tracker.update(crop, [(TestObjectTracker.PERSON, 'person.jpg')], 0)
+        self.assertEqual(self.tracker.track(crop, 0.1), [(TestObjectTracker.PERSON, 'person.jpg')])
+        self.assertEqual(self.tracker.track(crop, 0.2), [(TestObjectTracker.PERSON, 'person.jpg')])
+        self.assertIsNone(self.tracker.track(crop, 0.3))
+
+    def test_unrelated_crop_is_detected(self):
+        self.tracker.update((90, 90, 210, 310), [(TestObjectTracker.PERSON, 'person.jpg')], 0)
+        self.assertIsNone(self.tracker.track((500, 500, 600, 600), 0.1))
+
+    def test_object_is_lost_when_missed(self):
+        crop = (90, 90, 210, 310)
+        self.tracker.update(crop, [(TestObjectTracker.PERSON, 'person.jpg')], 0)
+        self.tracker.update(crop, [], 0.1)
+        self.assertEqual(len(self.tracker.tracks), 1)
+        self.tracker.update(crop, [], 0.2)
+        self.assertEqual(len(self.tracker.tracks), 0)
+
+    def test_object_is_lost_when_not_seen(self):
+        crop = (90, 90, 210, 310)
+        self.tracker.update(crop, [(TestObjectTracker.PERSON, 'person.jpg')], 0)
+        self.assertIsNone(self.tracker.track(crop, 3))
+        self.assertEqual(len(self.tracker.tracks), 0)
+
+    def test_moving_object_keeps_its_track(self):
+        crop = (90, 90, 210, 310)
+        self.tracker.update(crop, [(TestObjectTracker.PERSON, 'person.jpg')], 0)
+        moved = (110, 100, 210, 300, 'person', 0.8)
+        self.tracker.update(crop, [(moved, 'person2.jpg')], 0.1)
+        self.assertEqual(len(self.tracker.tracks), 1)
+        self.assertEqual(self.tracker.tracks[0].box, moved)
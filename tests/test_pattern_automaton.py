@@ -0,0 +1,138 @@
+import random
+import unittest
+
+import numpy as np
+from parameterized import parameterized
+
+from configs.config_patterns import door_movement
+from detection.pattern_automaton import PatternAutomaton, PatternTrie
+from detection.pattern_detector import PatternDetector
+from detection.state_managers.door_state_manager import DoorStates
+from detection.state_managers.motion_state_manager import MotionStates
+from detection.state_managers.object_state_manager import ObjectStates
+from detection.states import StateHistoryStep, NotState
+
+
+class TestPatternAutomaton(unittest.TestCase):
+    STATES = [ObjectStates.OBJECT_DETECTED, DoorStates.DOOR_OPEN, DoorStates.DOOR_CLOSED,
+              MotionStates.MOTION_INSIDE_MASK]
+
+    def _random_pattern(self, rng):
+        pattern_steps = []
+        for _ in range(rng.randint(1, 5)):
+            state = rng.choice(TestPatternAutomaton.STATES)
+            if rng.random() < 0.35:
+                pattern_steps.append(NotState(state, rng.choice([1, 2, 5, np.inf])))
+            else:
+                pattern_steps.append(state)
+        if all(type(step) is NotState for step in pattern_steps):
+            pattern_steps.append(rng.choice(TestPatternAutomaton.STATES))
+        return pattern_steps
+
+    def _random_state_history(self, rng, length):
+        ts = 100
+        state_history = []
+        for _ in range(length):
+            ts += rng.choice([0, 0.5, 1, 2, 3, 6])
+            state_history.append(StateHistoryStep(rng.choice(TestPatternAutomaton.STATES), ts=ts))
+        return state_history
+
+    @parameterized.expand([[seed] for seed in range(5)])
+    def test_automaton_matches_scan(self, seed):
+        rng = random.Random(seed)
+        pd = PatternDetector(None, door_movement.pattern_steps, detection_interval=None)
+        for _ in range(200):
+            pattern_steps = self._random_pattern(rng)
+            steps = self._random_state_history(rng, rng.randint(0, 20))
+
+            # insert the steps out of order, the way lagging state managers do
+            automaton = PatternAutomaton(pattern_steps)
+            state_history = []
+            for step in rng.sample(steps, len(steps)):
+                i = 0
+                while i < len(state_history) and step.ts >= state_history[i].ts:
+                    i += 1
+                state_history.insert(i, step)
+                automaton.insert(i, step)
+
+            last_ts = state_history[-1].ts if state_history else 100
+            for now in [None] + [rng.uniform(100, last_ts + 10) for _ in range(3)]:
+                self.assertEqual(
+                    pd.find_mov_ptn_in_state_history(pattern_steps, state_history, now),
+                    automaton.match(now),
+                    "pattern: %s, state history: %s, now: %s" % (
+                        pattern_steps, [(step.state, step.ts) for step in state_history], now))
+
+    @parameterized.expand([[seed] for seed in range(5)])
+    def test_memoized_states_in_demand(self, seed):
+        rng = random.Random(seed)
+        pattern_steps = [(i, self._random_pattern(rng)) for i in range(4)]
+        pd = PatternDetector(None, pattern_steps, detection_interval=None)
+        reference_pd = PatternDetector(None, pattern_steps, detection_interval=None)
+        memoized_count = 0
+        ts = 100
+        for _ in range(300):
+            if rng.random() < 0.3:
+                step = StateHistoryStep(rng.choice(TestPatternAutomaton.STATES), ts=ts + rng.uniform(-5, 1))
+                pd.add_to_state_history(step)
+                reference_pd.add_to_state_history(step)
+            ts += rng.choice([0, 0.1, 0.5, 1])
+            states_in_demand, memoized = pd.states_in_demand(ts)
+            memoized_count += memoized
+            reference_pd.states_in_demand_cache = None
+            self.assertEqual(states_in_demand, reference_pd.states_in_demand(ts)[0])
+        self.assertGreater(memoized_count, 0)
+
+    @parameterized.expand([[seed] for seed in range(5)])
+    def test_shared_prefixes_match_scan(self, seed):
+        rng = random.Random(seed)
+        for _ in range(50):
+            prefixes = [self._random_pattern(rng) for _ in range(2)]
+            pattern_steps = [(i, rng.choice(prefixes)[:rng.randint(1, 5)] +
+                              self._random_pattern(rng)[:rng.randint(0, 3)]) for i in range(6)]
+            pd = PatternDetector(None, pattern_steps, detection_interval=None)
+            self.assertLess(len(pd.pattern_trie.nodes), sum(len(ptn_steps) for (ptn, ptn_steps) in pattern_steps))
+            steps = self._random_state_history(rng, rng.randint(0, 20))
+            for step in rng.sample(steps, len(steps)):
+                pd.add_to_state_history(step)
+
+            state_history = pd.state_history.snapshot()
+            last_ts = steps[-1].ts if steps else 100
+            for now in [None] + [rng.uniform(100, last_ts + 10) for _ in range(3)]:
+                for (ptn, ptn_steps) in pattern_steps:
+                    self.assertEqual(
+                        pd.find_mov_ptn_in_state_history(ptn_steps, state_history, now),
+                        pd.match_pattern(ptn, ptn_steps, now),
+                        "pattern: %s, state history: %s, now: %s" % (
+                            ptn_steps, [(step.state, step.ts) for step in state_history], now))
+
+    @parameterized.expand([[seed] for seed in range(5)])
+    def test_evict_matches_scan(self, seed):
+        rng = random.Random(seed)
+        pd = PatternDetector(None, door_movement.pattern_steps, detection_interval=None)
+        for _ in range(100):
+            patterns_steps = [self._random_pattern(rng) for _ in range(3)]
+            # evicting from the front of the state history, as pruning it does
+            trie = PatternTrie(patterns_steps)
+            state_history = []
+            for step in self._random_state_history(rng, rng.randint(0, 30)):
+                state_history.append(step)
+                trie.insert(len(state_history) - 1, step)
+                if rng.random() < 0.3:
+                    count = rng.randint(0, min(3, len(state_history)))
+                    del state_history[:count]
+                    trie.evict(count)
+
+                rebuilt = PatternTrie(patterns_steps)
+                rebuilt.reset([step.state for step in state_history], [step.ts for step in state_history])
+                self.assertEqual(trie.next_deadline(), rebuilt.next_deadline())
+                first_ts = state_history[0].ts if state_history else 100
+                for now in [None] + [rng.uniform(first_ts, step.ts + 10) for _ in range(3)]:
+                    for i, pattern_steps in enumerate(patterns_steps):
+                        self.assertEqual(
+                            pd.find_mov_ptn_in_state_history(pattern_steps, state_history, now),
+                            trie.match(i, now),
+                            "pattern: %s, state history: %s, now: %s" % (
+                                pattern_steps, [(step.state, step.ts) for step in state_history], now))
+                    if now is not None:
+                        self.assertEqual(trie.deadline_after(now), rebuilt.deadline_after(now))
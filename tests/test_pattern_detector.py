@@ -6,7 +6,7 @@ from parameterized import parameterized
 from configs.config_patterns import door_movement
 from configs.config_patterns.door_movement import MovementPatterns
 from detection.pattern_detector import PatternMatch, PatternDetector
-from detection.state_managers.door_state_manager import DoorStates
+from detection.state_managers.door_state_manager import DoorStates, DoorState
 from detection.state_managers.motion_state_manager import MotionStates
 from detection.state_managers.object_state_manager import ObjectStates
 from detection.states import StateHistoryStep, NotState
@@ -50,6 +50,17 @@ class TestDoorDetect(unittest.TestCase):
          [(ObjectStates.OBJECT_DETECTED, 1), (DoorStates.DOOR_OPEN, 1), (ObjectStates.OBJECT_DETECTED, 1),
           (DoorStates.DOOR_CLOSED, 1)],
          PatternMatch.PARTIAL_MATCH],
+        # the states of the doors of a camera watching many doors only match the steps of their door
+        [[DoorState('garage', DoorStates.DOOR_OPEN), DoorState('garage', DoorStates.DOOR_CLOSED)],
+         [(DoorState('garage', DoorStates.DOOR_OPEN), 1), (DoorState('front', DoorStates.DOOR_CLOSED), 1)],
+         PatternMatch.PARTIAL_MATCH],
+        [[DoorState('garage', DoorStates.DOOR_OPEN), DoorState('garage', DoorStates.DOOR_CLOSED)],
+         [(DoorState('garage', DoorStates.DOOR_OPEN), 1), (DoorState('front', DoorStates.DOOR_CLOSED), 1),
+          (DoorState('garage', DoorStates.DOOR_CLOSED), 1)],
+         PatternMatch.MATCHED],
+        [[DoorStates.DOOR_OPEN, DoorStates.DOOR_CLOSED],
+         [(DoorState('garage', DoorStates.DOOR_OPEN), 1), (DoorState('garage', DoorStates.DOOR_CLOSED), 1)],
+         PatternMatch.NOT_MATCHED],
         [[NotState(ObjectStates.OBJECT_DETECTED), DoorStates.DOOR_OPEN, ObjectStates.OBJECT_DETECTED],
          [(MotionStates.MOTION_INSIDE_MASK, 1), (DoorStates.DOOR_OPEN, 1), (ObjectStates.OBJECT_DETECTED, 1),
           (DoorStates.DOOR_CLOSED, 1)],
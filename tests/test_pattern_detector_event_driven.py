@@ -0,0 +1,47 @@
+import time
+import unittest
+
+from configs.config_patterns.door_movement import MovementPatterns
+from detection.pattern_detector import PatternDetector
+from detection.state_managers.door_state_manager import DoorStates
+from detection.state_managers.object_state_manager import ObjectStates
+from detection.states import StateHistoryStep, NotState
+from lib.task_queue import BlockingTaskQueue
+from notifier import NotificationTypes
+
+
+class TestEventDrivenPatternDetector(unittest.TestCase):
+    def setUp(self):
+        self.broker_q = BlockingTaskQueue(100)
+        pattern_steps = [
+            (MovementPatterns.PERSON_EXITING_DOOR, [ObjectStates.OBJECT_DETECTED, DoorStates.DOOR_CLOSED,
+                                                    NotState(ObjectStates.OBJECT_DETECTED, 1)]),
+            (MovementPatterns.PERSON_VISITED_AT_DOOR, [ObjectStates.OBJECT_DETECTED, DoorStates.DOOR_OPEN])
+        ]
+        # a long interval, so that any detection within the test is event driven
+        self.pd = PatternDetector(self.broker_q, pattern_steps, detection_interval=60, event_driven=True)
+
+    def tearDown(self):
+        self.pd.stop()
+
+    def _wait_for_pattern(self, timeout):
+        start = time.time()
+        while self.broker_q.size() == 0 and time.time() - start < timeout:
+            time.sleep(0.01)
+        self.assertEqual(self.broker_q.size(), 1)
+        notification_type, (ptn, state_attrs) = self.broker_q.dequeue()
+        self.assertEqual(notification_type, NotificationTypes.PATTERN_DETECTED)
+        return ptn, time.time() - start
+
+    def test_pattern_detected_on_new_state(self):
+        self.pd.add_to_state_history(StateHistoryStep(ObjectStates.OBJECT_DETECTED, ('person', 0.9, 'person.jpg')))
+        self.pd.add_to_state_history(StateHistoryStep(DoorStates.DOOR_OPEN))
+        ptn, latency = self._wait_for_pattern(1)
+        self.assertEqual(ptn, MovementPatterns.PERSON_VISITED_AT_DOOR)
+
+    def test_pattern_detected_when_not_state_expires(self):
+        self.pd.add_to_state_history(StateHistoryStep(ObjectStates.OBJECT_DETECTED, ('person', 0.9, 'person.jpg')))
+        self.pd.add_to_state_history(StateHistoryStep(DoorStates.DOOR_CLOSED))
+        ptn, latency = self._wait_for_pattern(2)
+        self.assertEqual(ptn, MovementPatterns.PERSON_EXITING_DOOR)
+        self.assertLess(abs(latency - 1), 0.5)
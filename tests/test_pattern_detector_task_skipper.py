@@ -0,0 +1,23 @@
+import unittest
+
+from appmetrics import metrics
+
+from detection.pattern_detector import PatternDetector
+from detection.pattern_detector_task_skipper import PatternBasedSkipAheadOptimizer
+from detection.state_managers.door_state_manager import DoorStates
+from detection.state_managers.object_state_manager import ObjectStates
+from detection.states import StateHistoryStep
+
+
+class TestPatternBasedSkipAheadOptimizer(unittest.TestCase):
+    def test_speedup_gauge(self):
+        pd = PatternDetector(None, [(0, [ObjectStates.OBJECT_DETECTED, DoorStates.DOOR_OPEN])],
+                             detection_interval=None)
+        pd.add_to_state_history(StateHistoryStep(ObjectStates.OBJECT_DETECTED, ts=100))
+        task_skipper = PatternBasedSkipAheadOptimizer(pd, ObjectStates.OBJECT_DETECTED,
+                                                      metric_prefix='test_pattern_skipper')
+        with self.assertNoLogs('detection.StateDetectorBase', 'INFO'):
+            # a person is looked for till one is seen, then the door is
+            self.assertFalse(task_skipper.skip_task(50))
+            self.assertTrue(task_skipper.skip_task(101))
+        self.assertEqual(metrics.metric('test_pattern_skipper.speedup').get()['value'], 0.5)
@@ -0,0 +1,57 @@
+import random
+import threading
+import time
+import unittest
+
+from lib.reorder_buffer import ReorderBuffer
+
+
+class TestReorderBuffer(unittest.TestCase):
+    def setUp(self):
+        self.processed = []
+        self.processing_threads = set()
+
+    def _process(self, result):
+        self.processing_threads.add(threading.current_thread())
+        self.processed.append(result)
+
+    def _run(self, reorder_buffer, workers):
+        commit_thread = threading.Thread(target=reorder_buffer.process_continuously)
+        commit_thread.start()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        reorder_buffer.stop()
+        commit_thread.join()
+        return commit_thread
+
+    def test_processed_in_order_by_one_thread(self):
+        reorder_buffer = ReorderBuffer(self._process, metric_prefix='test_reorder_buffer')
+        rng = random.Random(0)
+
+        def worker():
+            for _ in range(50):
+                seq = reorder_buffer.next_sequence(2)
+                time.sleep(rng.random() * 0.001)
+                reorder_buffer.complete(seq + 1, seq + 1)
+                reorder_buffer.complete(seq, seq)
+
+        commit_thread = self._run(reorder_buffer, [threading.Thread(target=worker) for _ in range(4)])
+        self.assertEqual(self.processed, list(range(400)))
+        self.assertEqual(self.processing_threads, {commit_thread})
+        self.assertEqual(reorder_buffer.pending(), 0)
+
+    def test_max_pending(self):
+        reorder_buffer = ReorderBuffer(self._process, max_pending=2, metric_prefix='test_reorder_buffer')
+        seqs = [reorder_buffer.next_sequence() for _ in range(6)]
+        self.assertEqual(reorder_buffer.pending(), 6)
+
+        # the results are completed in reverse order: the ones after the next one block till it's processed
+        def worker(seq):
+            time.sleep((len(seqs) - seq) * 0.01)
+            reorder_buffer.complete(seq, seq)
+
+        self._run(reorder_buffer, [threading.Thread(target=worker, args=(seq,)) for seq in seqs])
+        self.assertEqual(self.processed, seqs)
+        self.assertEqual(reorder_buffer.pending(), 0)
@@ -0,0 +1,120 @@
+import random
+import threading
+import unittest
+
+from detection.pattern_automaton import PatternAutomaton, PatternMatch
+from detection.state_history import StateHistory, ColumnarStateHistory
+from detection.state_managers.door_state_manager import DoorStates
+from detection.state_managers.object_state_manager import ObjectStates
+from detection.states import StateHistoryStep
+
+
+class TestStateHistory(unittest.TestCase):
+    def setUp(self):
+        self.state_history = self._state_history()
+
+    def _state_history(self):
+        return StateHistory()
+
+    def _timestamps(self, steps):
+        return [step.ts for step in steps]
+
+    def test_insert_keeps_sorted(self):
+        for ts in [5, 1, 3, 3, 9, 0]:
+            self.state_history.insert(StateHistoryStep(DoorStates.DOOR_OPEN, ts=ts))
+        self.assertEqual(self._timestamps(self.state_history), [0, 1, 3, 3, 5, 9])
+
+    def test_insert_equal_ts_after_existing(self):
+        first = StateHistoryStep(DoorStates.DOOR_OPEN, ts=1)
+        second = StateHistoryStep(DoorStates.DOOR_CLOSED, ts=1)
+        self.assertEqual(self.state_history.insert(first), 0)
+        self.assertEqual(self.state_history.insert(second), 1)
+
+    def test_avoid_duplicates(self):
+        self.state_history.insert(StateHistoryStep(DoorStates.DOOR_OPEN, ts=1))
+        self.assertIsNone(self.state_history.insert(StateHistoryStep(DoorStates.DOOR_OPEN, ts=2), True))
+        self.assertEqual(self.state_history.insert(StateHistoryStep(DoorStates.DOOR_CLOSED, ts=2), True), 1)
+        self.assertEqual(self.state_history.insert(StateHistoryStep(DoorStates.DOOR_OPEN, ts=0), True), 0)
+
+    def test_views_are_snapshots(self):
+        for ts in [1.0, 2.0, 3.0]:
+            self.state_history.insert(StateHistoryStep(DoorStates.DOOR_OPEN, ts=ts))
+        till = self.state_history.till(2)
+        after = self.state_history.after(2)
+        snapshot = self.state_history.snapshot()
+        self.state_history.insert(StateHistoryStep(DoorStates.DOOR_CLOSED, ts=1.5))
+        self.state_history.evict_till(2)
+        self.assertEqual(self._timestamps(till), [1, 2])
+        self.assertEqual(self._timestamps(after), [3])
+        self.assertEqual(self._timestamps(snapshot), [1, 2, 3])
+        self.assertEqual(self._timestamps(self.state_history), [3])
+        self.assertEqual(repr(till), '[DoorStates.DOOR_OPEN[1.0], DoorStates.DOOR_OPEN[0.0]]')
+
+    def test_eviction(self):
+        for ts in [1, 2, 2, 3, 4]:
+            self.state_history.insert(StateHistoryStep(DoorStates.DOOR_OPEN, ts=ts))
+        self.assertEqual(self.state_history.evict_before(2), 1)
+        self.assertEqual(self.state_history.evict_till(2), 2)
+        self.assertEqual(self.state_history.evict_before(1), 0)
+        self.assertEqual(self._timestamps(self.state_history), [3, 4])
+        self.assertEqual(self.state_history.clear(), 2)
+        self.assertEqual(len(self.state_history), 0)
+
+    def test_listeners_in_sync(self):
+        automaton = PatternAutomaton([ObjectStates.OBJECT_DETECTED, DoorStates.DOOR_OPEN])
+        self.state_history.add_listener(automaton)
+        self.state_history.insert(StateHistoryStep(DoorStates.DOOR_OPEN, ts=2))
+        self.state_history.insert(StateHistoryStep(ObjectStates.OBJECT_DETECTED, ts=1))
+        self.assertEqual(automaton.match(3)[0], PatternMatch.MATCHED)
+        self.state_history.evict_till(1)
+        self.assertEqual(automaton.match(3)[0], PatternMatch.NOT_MATCHED)
+
+    def test_concurrent_inserts(self):
+        rng = random.Random(0)
+        timestamps = [rng.uniform(0, 100) for _ in range(2000)]
+
+        def insert(timestamps):
+            for ts in timestamps:
+                self.state_history.insert(StateHistoryStep(DoorStates.DOOR_OPEN, ts=ts))
+                self.state_history.till(ts)
+
+        threads = [threading.Thread(target=insert, args=(timestamps[i::4],)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self._timestamps(self.state_history), sorted(timestamps))
+
+    def test_view_indexing(self):
+        for ts in range(6):
+            self.state_history.insert(StateHistoryStep(DoorStates.DOOR_OPEN, ('attrs', ts), ts=ts))
+        snapshot = self.state_history.snapshot()
+        self.assertEqual(snapshot[-1].state_attrs, ('attrs', 5))
+        self.assertEqual(snapshot[2].state, DoorStates.DOOR_OPEN)
+        self.assertEqual(self._timestamps(snapshot[1:5][::2]), [1, 3])
+        self.assertEqual([step.state_attrs for step in snapshot[-2:]], [('attrs', 4), ('attrs', 5)])
+        with self.assertRaises(IndexError):
+            snapshot[6]
+
+    def test_latest_state_attrs(self):
+        self.assertIsNone(self.state_history.latest_state_attrs(ObjectStates.OBJECT_DETECTED))
+        self.state_history.insert(StateHistoryStep(ObjectStates.OBJECT_DETECTED, ('person', 0.9, 'a.jpg'), ts=1))
+        self.state_history.insert(StateHistoryStep(ObjectStates.OBJECT_DETECTED, ('person', 0.8, 'b.jpg'), ts=3))
+        self.state_history.insert(StateHistoryStep(DoorStates.DOOR_OPEN, ts=4))
+        self.assertEqual(self.state_history.latest_state_attrs(ObjectStates.OBJECT_DETECTED), ('person', 0.8, 'b.jpg'))
+        self.assertEqual(self.state_history.latest_ts(), 4)
+
+
+class TestColumnarStateHistory(TestStateHistory):
+    def _state_history(self):
+        # a small capacity, to compact and grow the arrays
+        return ColumnarStateHistory(capacity=4)
+
+    def test_sliding_window(self):
+        for ts in range(100):
+            self.state_history.insert(StateHistoryStep(DoorStates.DOOR_OPEN, ('attrs', ts), ts=ts))
+            self.state_history.evict_before(ts - 2)
+        self.assertEqual(self._timestamps(self.state_history), [97, 98, 99])
+        self.assertEqual([step.state_attrs for step in self.state_history], [('attrs', 97), ('attrs', 98), ('attrs', 99)])
+        # compacted in place instead of growing
+        self.assertEqual(len(self.state_history.ts), 8)
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+
+from configs.config_patterns import door_movement
+from configs.config_patterns.door_movement import MovementPatterns
+from detection.pattern_detector import PatternDetector
+from detection.state_history_log import read_state_history_log
+from detection.state_managers.door_state_manager import DoorStates, DoorState
+from detection.state_managers.object_state_manager import ObjectStates
+from detection.states import StateHistoryStep
+from tools.backtest_patterns import SimulatedClock, replay
+
+
+class TestStateHistoryLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.tmp_dir.name, 'state_history.log')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _record(self, steps):
+        clock = SimulatedClock()
+        pd = PatternDetector(None, door_movement.pattern_steps, detection_interval=None,
+                             state_history_log_path=self.log_path, clock=clock)
+        for (added_ts, step, avoid_duplicates) in steps:
+            clock.now = added_ts
+            pd.add_to_state_history(step, avoid_duplicates)
+        pd.stop()
+
+    def test_log_round_trip(self):
+        steps = [(100, StateHistoryStep(ObjectStates.OBJECT_DETECTED, ('person', 0.9, 'person.jpg'), 99.5), False),
+                 (101, StateHistoryStep(DoorStates.DOOR_OPEN, ts=101), True),
+                 (102, StateHistoryStep('dummy', ts=102), False),
+                 (103, StateHistoryStep(DoorState('garage', DoorStates.DOOR_CLOSED), 'garage', ts=103), True)]
+        self._record(steps)
+        replayed = list(read_state_history_log(self.log_path))
+        self.assertEqual([(added_ts, step.state, step.state_attrs, step.ts, avoid_duplicates)
+                          for (added_ts, step, avoid_duplicates) in replayed],
+                         [(added_ts, step.state, step.state_attrs, step.ts, avoid_duplicates)
+                          for (added_ts, step, avoid_duplicates) in steps])
+
+    def test_backtest_replay(self):
+        steps = []
+        # a person exits: seen, then the door closes, then no person for 5 seconds
+        for ts, state in [(1000, ObjectStates.OBJECT_DETECTED), (1002, DoorStates.DOOR_CLOSED)]:
+            steps.append((ts, StateHistoryStep(state, ts=ts), False))
+        # an hour later a person enters: the door opens, then a person is seen
+        for ts, state in [(4600, DoorStates.DOOR_OPEN), (4601, ObjectStates.OBJECT_DETECTED)]:
+            steps.append((ts, StateHistoryStep(state, ts=ts), False))
+        self._record(steps)
+
+        collector, pd, num_states, simulated = replay(door_movement.pattern_steps, [self.log_path])
+        self.assertEqual(num_states, 4)
+        self.assertEqual([(ptn, round(ts)) for (ptn, ts) in collector.matches],
+                         [(MovementPatterns.PERSON_EXITING_DOOR, 1008),
+                          (MovementPatterns.PERSON_ENTERING_DOOR, 4602)])
+        self.assertGreater(pd.pattern_timings[MovementPatterns.PERSON_EXITING_DOOR][0], 0)
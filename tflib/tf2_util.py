@@ -12,32 +12,100 @@ class DetectorTF2:
         categories = label_map_util.convert_label_map_to_categories(label_map, max_num_classes=90,
                                                                     use_display_name=True)
         self.category_index = label_map_util.create_category_index(categories)
+        # lookup of label names by class id, None for the ids missing in the label map
+        self.label_names = np.full(max(self.category_index.keys()) + 1, None, dtype=object)
+        for class_id, category in self.category_index.items():
+            self.label_names[class_id] = category['name']
 
         tf.keras.backend.clear_session()
         self.detect_fn = tf.saved_model.load(path_to_checkpoint)
 
     def DetectFromImage(self, img):
-        im_height, im_width, _ = img.shape
-        # Expand dimensions since the model expects images to have shape: [1, None, None, 3]
-        input_tensor = np.expand_dims(img, 0)
+        return self.DetectFromImages([img])[0]
+
+    def DetectFromImages(self, imgs):
+        """
+        runs the model once over a batch of images (of any size). the images are letterboxed: centered
+        and padded to the largest height and width in the batch without being resized, the detected
+        boxes are mapped back to every original image by its padding offsets
+        :return: list of detected boxes for every image in imgs
+        """
+        return [self.ExtractBBoxes(*raw_output) for raw_output in self.RunImages(imgs)]
+
+    def DetectRawFromImages(self, imgs):
+        """
+        same as DetectFromImages but returns the raw (pixel boxes, class ids, scores) arrays for every image
+        """
+        return [self.ExtractRawBBoxes(*raw_output) for raw_output in self.RunImages(imgs)]
+
+    def AllocateInputBuffer(self, batch_size):
+        # the input tensor is built by tensorflow itself
+        return None
+
+    def PrepareImages(self, imgs, input_buffer=None):
+        """
+        builds the input tensor for a batch of images so that it can be detected later by
+        DetectRawFromPrepared. lets the preprocessing of one batch overlap the inference of another
+        """
+        batch_height = max(img.shape[0] for img in imgs)
+        batch_width = max(img.shape[1] for img in imgs)
+        # (image height, image width, top padding, left padding, batch height, batch width) of every image
+        layouts = [(img.shape[0], img.shape[1], (batch_height - img.shape[0]) // 2,
+                    (batch_width - img.shape[1]) // 2, batch_height, batch_width) for img in imgs]
+        if len(imgs) == 1:
+            # Expand dimensions since the model expects images to have shape: [1, None, None, 3]
+            input_tensor = np.expand_dims(imgs[0], 0)
+        else:
+            # stretching the images to the size of the batch would distort the objects in them
+            input_tensor = np.zeros((len(imgs), batch_height, batch_width, 3), dtype=imgs[0].dtype)
+            for i, (img, (im_height, im_width, top, left, _, _)) in enumerate(zip(imgs, layouts)):
+                input_tensor[i, top:top + im_height, left:left + im_width] = img
+        return input_tensor, layouts
+
+    def DetectRawFromPrepared(self, prepared):
+        return [self.ExtractRawBBoxes(*raw_output) for raw_output in self.RunPrepared(*prepared)]
+
+    def RunImages(self, imgs):
+        return self.RunPrepared(*self.PrepareImages(imgs))
+
+    def RunPrepared(self, input_tensor, layouts):
         detections = self.detect_fn(input_tensor)
 
-        bboxes = detections['detection_boxes'][0].numpy()
-        bclasses = detections['detection_classes'][0].numpy().astype(np.int32)
-        bscores = detections['detection_scores'][0].numpy()
-        det_boxes = self.ExtractBBoxes(bboxes, bclasses, bscores, im_width, im_height)
+        bboxes = detections['detection_boxes'].numpy()
+        bclasses = detections['detection_classes'].numpy().astype(np.int32)
+        bscores = detections['detection_scores'].numpy()
+
+        raw_outputs = []
+        for i, layout in enumerate(layouts):
+            raw_outputs.append((bboxes[i], bclasses[i], bscores[i], layout))
+        return raw_outputs
+
+    def BoxesToPixels(self, bboxes, layout):
+        """
+        :param layout: (image height, image width, top padding, left padding, batch height, batch width)
+        :return: int array of (x_min, y_min, x_max, y_max) pixel coordinates of the image for every box
+                 normalized to the (padded) input of the batch
+        """
+        im_height, im_width, top, left, batch_height, batch_width = layout
+        scale = np.array([batch_height, batch_width, batch_height, batch_width], dtype=bboxes.dtype)
+        y_min, x_min, y_max, x_max = np.trunc(bboxes * scale).astype(np.int64).T
+        # boxes reaching into the padding are clipped to the image
+        x_min, x_max = np.clip(x_min - left, 0, im_width), np.clip(x_max - left, 0, im_width)
+        y_min, y_max = np.clip(y_min - top, 0, im_height), np.clip(y_max - top, 0, im_height)
+        return np.stack([x_min, y_min, x_max, y_max], axis=1)
 
-        return det_boxes
+    def ExtractRawBBoxes(self, bboxes, bclasses, bscores, layout):
+        """
+        :return: (pixel boxes, class ids, scores) as arrays, the class ids index into self.label_names
+        """
+        return self.BoxesToPixels(bboxes, layout), bclasses.astype(np.int64), bscores
 
-    def ExtractBBoxes(self, bboxes, bclasses, bscores, im_width, im_height):
+    def ExtractBBoxes(self, bboxes, bclasses, bscores, layout):
         bbox = []
-        for idx in range(len(bboxes)):
-            y_min = int(bboxes[idx][0] * im_height)
-            x_min = int(bboxes[idx][1] * im_width)
-            y_max = int(bboxes[idx][2] * im_height)
-            x_max = int(bboxes[idx][3] * im_width)
-            class_label = self.category_index[int(bclasses[idx])]['name']
-            bbox.append([x_min, y_min, x_max, y_max, class_label, float(bscores[idx])])
+        pixel_boxes = self.BoxesToPixels(bboxes, layout)
+        for (x_min, y_min, x_max, y_max), class_id, score in zip(pixel_boxes.tolist(), bclasses, bscores):
+            class_label = self.category_index[int(class_id)]['name']
+            bbox.append([x_min, y_min, x_max, y_max, class_label, float(score)])
         return bbox
 
     def DisplayDetection(self, image, box, det_time=None):
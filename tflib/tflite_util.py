@@ -12,8 +12,9 @@ else:
 
 class DetectorTFLite:
 
-    def __init__(self, path_to_checkpoint, path_to_labelmap, filter_labels=None):
+    def __init__(self, path_to_checkpoint, path_to_labelmap, filter_labels=None, num_threads=None, zero_copy=False):
         self.filter_labels = filter_labels
+        self.zero_copy = zero_copy
 
         with open(path_to_labelmap, 'r') as f:
             self.labels = [line.strip() for line in f.readlines()]
@@ -23,8 +24,9 @@ class DetectorTFLite:
         # First label is '???', which has to be removed.
         if self.labels[0] == '???':
             del (self.labels[0])
+        self.label_names = np.array(self.labels, dtype=object)
 
-        self.interpreter = Interpreter(model_path=path_to_checkpoint)
+        self.interpreter = Interpreter(model_path=path_to_checkpoint, num_threads=num_threads)
         self.interpreter.allocate_tensors()
 
         # Get model details
@@ -34,45 +36,147 @@ class DetectorTFLite:
         self.tf_width = self.input_details[0]['shape'][2]
 
         self.floating_model = (self.input_details[0]['dtype'] == np.float32)
+        self.batch_size = self.input_details[0]['shape'][0]
 
         self.input_mean = 127.5
         self.input_std = 127.5
 
+        # accessors of numpy views over the interpreter's own input and output buffers (used in zero copy mode)
+        # a view must not be held across calls to invoke() or allocate_tensors()
+        self.input_tensor = self.interpreter.tensor(self.input_details[0]['index'])
+        self.output_tensors = [self.interpreter.tensor(self.output_details[i]['index']) for i in range(3)]
+        # scratch buffer for the resized frame of floating models, which is normalized into the input tensor
+        self.resized_buffer = np.empty((self.tf_height, self.tf_width, 3), dtype=np.uint8)
+
+    def BoxesToPixels(self, imH, imW, boxes):
+        """
+        :return: int array of (minx, miny, maxx, maxy) pixel coordinates for every normalized box
+        """
+        # Interpreter can return coordinates that are outside of image dimensions, need to force them to be within image using max() and min()
+        miny = np.trunc(np.maximum(1, boxes[:, 0] * imH))
+        minx = np.trunc(np.maximum(1, boxes[:, 1] * imW))
+        maxy = np.trunc(np.minimum(imH, boxes[:, 2] * imH))
+        maxx = np.trunc(np.minimum(imW, boxes[:, 3] * imW))
+        return np.stack([minx, miny, maxx, maxy], axis=1).astype(np.int64)
+
+    def ExtractRawBoxes(self, imH, imW, boxes, classes, scores):
+        """
+        :return: (pixel boxes, class ids, scores) as arrays, the class ids index into self.label_names
+        """
+        return self.BoxesToPixels(imH, imW, boxes), classes.astype(np.int64), scores
+
     def ExtractBoxes(self, imH, imW, boxes, classes, scores):
+        pixel_boxes, class_ids, scores = self.ExtractRawBoxes(imH, imW, boxes, classes, scores)
         det_boxes = []
-        for i in range(len(scores)):
-            # Get bounding box coordinates and draw box
-            # Interpreter can return coordinates that are outside of image dimensions, need to force them to be within image using max() and min()
-            miny = int(max(1, (boxes[i][0] * imH)))
-            minx = int(max(1, (boxes[i][1] * imW)))
-            maxy = int(min(imH, (boxes[i][2] * imH)))
-            maxx = int(min(imW, (boxes[i][3] * imW)))
-            label = self.labels[int(classes[i])]
-            det_boxes.append((minx, miny, maxx, maxy, label, float(scores[i])))
+        for (minx, miny, maxx, maxy), class_id, score in zip(pixel_boxes.tolist(), class_ids, scores):
+            det_boxes.append((minx, miny, maxx, maxy, self.labels[class_id], float(score)))
         return det_boxes
 
-    def DetectFromImage(self, img):
-        imH, imW, _ = img.shape
-        # Acquire frame and resize to expected shape [1xHxWx3]
+    def PreprocessImage(self, img):
+        # Acquire frame and resize to expected shape [HxWx3]
         frame_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         frame_resized = cv2.resize(frame_rgb, (self.tf_width, self.tf_height))
-        input_data = np.expand_dims(frame_resized, axis=0)
 
         # Normalize pixel values if using a floating model (i.e. if model is non-quantized)
         if self.floating_model:
-            input_data = (np.float32(input_data) - self.input_mean) / self.input_std
+            frame_resized = (np.float32(frame_resized) - self.input_mean) / self.input_std
+        return frame_resized
+
+    def PreprocessImageInto(self, img, input_view):
+        """
+        resizes, color converts (and normalizes) the image straight into input_view without any allocation
+        resizing before converting BGR to RGB gives the same result as converting first, since
+        every channel is resized independently
+        """
+        if self.floating_model:
+            cv2.resize(img, (self.tf_width, self.tf_height), dst=self.resized_buffer)
+            cv2.cvtColor(self.resized_buffer, cv2.COLOR_BGR2RGB, dst=self.resized_buffer)
+            np.subtract(self.resized_buffer, self.input_mean, out=input_view, dtype=np.float32)
+            np.divide(input_view, self.input_std, out=input_view)
+        else:
+            cv2.resize(img, (self.tf_width, self.tf_height), dst=input_view)
+            cv2.cvtColor(input_view, cv2.COLOR_BGR2RGB, dst=input_view)
+
+    def ResizeBatch(self, batch_size):
+        # the interpreter has to be re-allocated whenever the batch dimension of the input changes
+        if batch_size != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input_details[0]['index'],
+                                                 [batch_size, self.tf_height, self.tf_width, 3])
+            self.interpreter.allocate_tensors()
+            self.batch_size = batch_size
 
-        # Perform the actual detection by running the model with the image as input
+    def DetectFromImage(self, img):
+        return self.DetectFromImages([img])[0]
+
+    def DetectFromImages(self, imgs):
+        """
+        runs a single invoke of the interpreter over a batch of images (of any size)
+        :return: list of detected boxes for every image in imgs
+        """
+        return [self.ExtractBoxes(*raw_output) for raw_output in self.InvokeImages(imgs)]
+
+    def DetectRawFromImages(self, imgs):
+        """
+        same as DetectFromImages but returns the raw (pixel boxes, class ids, scores) arrays for every image
+        """
+        return [self.ExtractRawBoxes(*raw_output) for raw_output in self.InvokeImages(imgs)]
+
+    def AllocateInputBuffer(self, batch_size):
+        return np.empty((batch_size, self.tf_height, self.tf_width, 3), dtype=self.input_details[0]['dtype'])
+
+    def PrepareImages(self, imgs, input_buffer=None):
+        """
+        preprocesses a batch of images into input_buffer (allocated if None) so that it can be detected
+        later by DetectRawFromPrepared. lets the preprocessing of one batch overlap the inference of another
+        """
+        if input_buffer is None:
+            input_buffer = self.AllocateInputBuffer(len(imgs))
+        input_data = input_buffer[:len(imgs)]
+        for i, img in enumerate(imgs):
+            self.PreprocessImageInto(img, input_data[i])
+        return input_data, [img.shape for img in imgs]
+
+    def DetectRawFromPrepared(self, prepared):
+        return [self.ExtractRawBoxes(*raw_output) for raw_output in self.InvokePrepared(*prepared)]
+
+    def InvokePrepared(self, input_data, shapes):
+        self.ResizeBatch(len(shapes))
+
+        # Perform the actual detection by running the model with the image as input.
+        # input_data is a buffer of the caller (being refilled while this one is invoked), so it's copied
+        # in even with zero_copy
         self.interpreter.set_tensor(self.input_details[0]['index'], input_data)
         self.interpreter.invoke()
-
-        # Retrieve detection results
-        boxes = self.interpreter.get_tensor(self.output_details[0]['index'])[
-            0]  # Bounding box coordinates of detected objects
-        classes = self.interpreter.get_tensor(self.output_details[1]['index'])[0]  # Class index of detected objects
-        scores = self.interpreter.get_tensor(self.output_details[2]['index'])[0]  # Confidence of detected objects
-
-        return self.ExtractBoxes(imH, imW, boxes, classes, scores)
+        return self.ReadOutputs(shapes)
+
+    def ReadOutputs(self, shapes):
+        if self.zero_copy:
+            # views over the output tensors, only valid till the next invoke
+            boxes, classes, scores = [output_tensor() for output_tensor in self.output_tensors]
+        else:
+            # Retrieve detection results
+            boxes = self.interpreter.get_tensor(self.output_details[0]['index'])  # Bounding box coordinates of detected objects
+            classes = self.interpreter.get_tensor(self.output_details[1]['index'])  # Class index of detected objects
+            scores = self.interpreter.get_tensor(self.output_details[2]['index'])  # Confidence of detected objects
+
+        raw_outputs = []
+        for i, (imH, imW, _) in enumerate(shapes):
+            raw_outputs.append((imH, imW, boxes[i], classes[i], scores[i]))
+        return raw_outputs
+
+    def InvokeImages(self, imgs):
+        shapes = [img.shape for img in imgs]
+        if self.zero_copy:
+            self.ResizeBatch(len(imgs))
+            input_data = self.input_tensor()
+            for i, img in enumerate(imgs):
+                self.PreprocessImageInto(img, input_data[i])
+            # the interpreter refuses to invoke while a view of its buffers is alive
+            del input_data
+            self.interpreter.invoke()
+            return self.ReadOutputs(shapes)
+        else:
+            return self.InvokePrepared(np.stack([self.PreprocessImage(img) for img in imgs]), shapes)
 
     def DisplayDetection(self, img, box, det_time=None):
         x_min = box[0]
@@ -0,0 +1,168 @@
+"""
+    backtest pattern configs against state history logs recorded by the pattern detector
+    (see `pattern_detection_state_history_log` in the config).
+
+    the logs are replayed through `PatternDetector` on a simulated clock, as fast as possible, evaluating the patterns
+    every `--interval` simulated seconds like the pattern detector's timer does. every candidate pattern config is
+    replayed in its own process. state managers are not replayed, so the patterns are always evaluated on the
+    whole state history (as if no state manager was lagging)
+
+    usage (from the root of the repo):
+        python -m tools.backtest_patterns -l state_history_*.log \
+            -p configs.config_patterns.door_movement my_patterns:strict_pattern_steps
+"""
+
+import argparse
+import glob
+import importlib
+import logging
+import math
+import time
+from multiprocessing import Pool
+
+from detection.pattern_detector import PatternDetector
+from detection.state_history_log import read_state_history_log
+from lib import setup_logging
+from notifier import NotificationTypes
+
+log = logging.getLogger(__name__)
+
+
+class SimulatedClock():
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class PatternMatchCollector():
+    """
+    stands in for the broker queue of the pattern detector, collecting the patterns detected
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.matches = []
+
+    def enqueue(self, notification):
+        notification_type, (ptn, state_attrs) = notification
+        if notification_type == NotificationTypes.PATTERN_DETECTED:
+            self.matches.append((ptn, self.clock()))
+
+
+class TimedPatternDetector(PatternDetector):
+    """
+    a pattern detector which measures the time spent matching each pattern
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pattern_timings = {ptn: [0, 0] for (ptn, ptn_steps) in self.pattern_steps}
+
+    def match_pattern(self, ptn, ptn_steps, now=None):
+        start = time.perf_counter()
+        result = super().match_pattern(ptn, ptn_steps, now)
+        timing = self.pattern_timings[ptn]
+        timing[0] += 1
+        timing[1] += time.perf_counter() - start
+        return result
+
+
+def load_pattern_steps(candidate):
+    """
+    :param candidate: "module" or "module:attribute" of the pattern steps (the attribute defaults to pattern_steps)
+    """
+    module, _, attribute = candidate.partition(':')
+    return getattr(importlib.import_module(module), attribute or 'pattern_steps')
+
+
+def replay(pattern_steps, log_paths, interval=1, state_history_length=20, state_history_length_partial=300):
+    """
+    :return: (PatternMatchCollector, TimedPatternDetector, number of states replayed, simulated seconds)
+    """
+    clock = SimulatedClock()
+    collector = PatternMatchCollector(clock)
+    pd = TimedPatternDetector(collector, pattern_steps, state_history_length, state_history_length_partial,
+                              detection_interval=None, clock=clock)
+    num_states = 0
+    first_ts = next_tick = None
+
+    def tick_till(ts):
+        nonlocal next_tick
+        while next_tick <= ts:
+            if len(pd.state_history) == 0:
+                # nothing to evaluate till the next state is added, skip to the tick after it
+                next_tick += max(math.ceil((ts - next_tick) / interval), 1) * interval
+                continue
+            clock.now = next_tick
+            pd.detect_patterns()
+            next_tick += interval
+
+    for path in log_paths:
+        for added_ts, state_step, avoid_duplicates in read_state_history_log(path):
+            if next_tick is None:
+                first_ts = next_tick = added_ts
+            tick_till(added_ts)
+            clock.now = max(clock.now, added_ts)
+            pd.add_to_state_history(state_step, avoid_duplicates)
+            num_states += 1
+
+    if next_tick is not None:
+        # let the trailing NotStates and partial matches play out
+        tick_till(clock.now + state_history_length_partial + interval)
+    return collector, pd, num_states, (clock.now - first_ts) if first_ts is not None else 0
+
+
+def backtest(candidate, log_paths, interval, state_history_length, state_history_length_partial):
+    logging.getLogger('detection.pattern_detector').setLevel(logging.WARNING)
+    start = time.perf_counter()
+    collector, pd, num_states, simulated = replay(load_pattern_steps(candidate), log_paths, interval,
+                                                  state_history_length, state_history_length_partial)
+    report = {
+        'candidate': candidate,
+        'states': num_states,
+        'simulated': simulated,
+        'elapsed': time.perf_counter() - start,
+        'patterns': {}
+    }
+    for (ptn, ptn_steps) in pd.pattern_steps:
+        evaluations, seconds = pd.pattern_timings[ptn]
+        report['patterns'][getattr(ptn, 'name', str(ptn))] = {
+            'matches': sum(1 for (matched, ts) in collector.matches if matched == ptn),
+            'evaluations': evaluations,
+            'seconds': seconds
+        }
+    return report
+
+
+def print_report(report):
+    print("%s: %d states over %.1f simulated hours replayed in %.2fs" % (
+        report['candidate'], report['states'], report['simulated'] / 3600, report['elapsed']))
+    for ptn, stats in report['patterns'].items():
+        print("    %-30s matches: %-6d evaluations: %-8d time: %.3fs (%.1fus/evaluation)" % (
+            ptn, stats['matches'], stats['evaluations'], stats['seconds'],
+            stats['seconds'] / max(stats['evaluations'], 1) * 1e6))
+
+
+if __name__ == '__main__':
+    setup_logging()
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-l", "--logs", type=str, nargs='+', required=True,
+                    help="state history log files (or glob patterns), replayed in the order given")
+    ap.add_argument("-p", "--patterns", type=str, nargs='+', required=True,
+                    help="candidate pattern configs as module[:attribute], the attribute defaults to pattern_steps")
+    ap.add_argument("-i", "--interval", type=float, default=1,
+                    help="simulated seconds between evaluations of the patterns")
+    ap.add_argument("--state_history_length", type=int, default=20)
+    ap.add_argument("--state_history_length_partial", type=int, default=300)
+    ap.add_argument("-j", "--processes", type=int, default=None,
+                    help="number of processes to backtest the candidates in (defaults to the number of cpus)")
+    args = vars(ap.parse_args())
+
+    log_paths = [path for pattern in args['logs'] for path in (sorted(glob.glob(pattern)) or [pattern])]
+    with Pool(args['processes']) as pool:
+        reports = pool.starmap(backtest, [(candidate, log_paths, args['interval'], args['state_history_length'],
+                                           args['state_history_length_partial']) for candidate in args['patterns']])
+    for report in reports:
+        print_report(report)
@@ -0,0 +1,107 @@
+"""
+    micro-benchmark of `DoorStateDetectorGroup` against running its door state detectors one by one,
+    over random frames.
+
+    for every layout of doors it reports the ops/sec of:
+        individual      `detect_door_state` of every detector
+        group           `detect_door_states` of the group of the same detectors
+    and the speedup of the group. the group is expected to be no slower than the detectors, also when its
+    doors are far apart in the frame (it then integrates a separate area around every cluster of doors)
+
+    usage (from the root of the repo):
+        python -m tools.benchmark_door_state_detectors --layouts corners nearby --resolution 1920 1080
+"""
+
+import argparse
+
+import numpy as np
+
+from detection.door_state_detectors import SingleShotDoorStateDetector, SingleShotFrameDiffDoorStateDetector, \
+    DoorStateDetectorGroup
+from tools.benchmark_pattern_detector import measure
+
+DOOR_CLOSED_AVG_RGB = (118, 80, 26)
+DOOR_OPEN_AVG_RGB = (151, 117, 72)
+
+
+def corners(width, height):
+    # small doors at opposite corners of the frame
+    return {
+        'front': SingleShotFrameDiffDoorStateDetector((10, 10, 30, 25), (40, 10, 55, 25)),
+        'garage': SingleShotDoorStateDetector((width - 40, height - 40, width - 10, height - 10),
+                                              DOOR_CLOSED_AVG_RGB, DOOR_OPEN_AVG_RGB)
+    }
+
+
+def nearby(width, height):
+    # doors next to each other in the middle of the frame
+    x, y = width // 2, height // 2
+    return {
+        'front': SingleShotFrameDiffDoorStateDetector((x, y, x + 20, y + 15), (x + 30, y, x + 45, y + 15)),
+        'garage': SingleShotDoorStateDetector((x + 60, y, x + 90, y + 30), DOOR_CLOSED_AVG_RGB, DOOR_OPEN_AVG_RGB),
+        'gate': SingleShotDoorStateDetector((x, y + 40, x + 30, y + 60), DOOR_CLOSED_AVG_RGB, DOOR_OPEN_AVG_RGB)
+    }
+
+
+def grid(width, height):
+    # a door in every cell of a 4x4 grid over the frame
+    detectors = {}
+    for i in range(4):
+        for j in range(4):
+            x, y = (2 * i + 1) * width // 8, (2 * j + 1) * height // 8
+            detectors['door_%d_%d' % (i, j)] = SingleShotFrameDiffDoorStateDetector((x, y, x + 20, y + 15),
+                                                                                     (x + 30, y, x + 45, y + 15))
+    return detectors
+
+
+LAYOUTS = {
+    'corners': corners,
+    'nearby': nearby,
+    'grid': grid
+}
+
+
+def benchmark(detectors, frames, budget):
+    """
+    :param detectors: function returning a new dict of door name -> DoorStateDetector
+    :return: list of (benchmark, ops, seconds)
+    """
+    individual = detectors()
+    group = DoorStateDetectorGroup(detectors())
+
+    def detect_individually():
+        for frame in frames:
+            {door: detector.detect_door_state(frame) for door, detector in individual.items()}
+        return len(frames)
+
+    def detect_group():
+        for frame in frames:
+            group.detect_door_states(frame)
+        return len(frames)
+
+    return [('individual',) + measure(detect_individually, budget),
+            ('group',) + measure(detect_group, budget)]
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-l", "--layouts", type=str, nargs='+', default=list(LAYOUTS), choices=LAYOUTS.keys())
+    ap.add_argument("-r", "--resolution", type=int, nargs=2, default=[1920, 1080], metavar=('WIDTH', 'HEIGHT'))
+    ap.add_argument("-f", "--frames", type=int, default=10, help="number of random frames to cycle through")
+    ap.add_argument("-b", "--budget", type=float, default=1,
+                    help="seconds to run every benchmark for (it always runs at least once)")
+    ap.add_argument("--seed", type=int, default=0)
+    args = vars(ap.parse_args())
+
+    width, height = args['resolution']
+    rng = np.random.default_rng(args['seed'])
+    frames = [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(args['frames'])]
+    print("%-10s %-6s %-12s %12s %10s %14s %10s" % ('layout', 'doors', 'benchmark', 'ops', 'seconds', 'ops/sec',
+                                                    'speedup'))
+    for layout in args['layouts']:
+        results = benchmark(lambda: LAYOUTS[layout](width, height), frames, args['budget'])
+        num_doors = len(LAYOUTS[layout](width, height))
+        individual_rate = results[0][1] / results[0][2]
+        for (name, ops, seconds) in results:
+            print("%-10s %-6d %-12s %12d %10.3f %14.1f %9.2fx" % (layout, num_doors, name, ops, seconds,
+                                                               ops / seconds, ops / seconds / individual_rate))
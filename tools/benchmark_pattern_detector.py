@@ -0,0 +1,233 @@
+"""
+    micro-benchmarks of `PatternDetector` over synthetic state histories, to quantify how it scales with the
+    size of the state history, the mix of states and the patterns (e.g. NotState heavy ones).
+
+    for every state history size it reports the ops/sec of:
+        add_to_state_history        adding steps, a fraction of them out of order like lagging state managers do
+        find_mov_ptn                the reference scan `find_mov_ptn_in_state_history` of every pattern
+        match_pattern               matching every pattern with the compiled patterns
+        states_in_demand            at a new ts on every call, and at the same ts (memoized)
+        add_and_detect              adding a step and running `detect_patterns` after it, like the event driven mode
+        prune                       pruning a sliding window of the state history after adding a step
+    and the memory taken by the state history (with the compiled patterns) per step. run it with --columnar to benchmark
+    the columnar state history.
+
+    only find_mov_ptn is expected to slow down with the size of the state history, it scans all of it. a row which
+    does too has an O(n) cost per op
+
+    usage (from the root of the repo):
+        python -m tools.benchmark_pattern_detector --sizes 10 1000 100000 --patterns door not_heavy --mix uniform
+"""
+
+import argparse
+import logging
+import random
+import time
+import tracemalloc
+from enum import Enum
+
+import numpy as np
+
+from configs.config_patterns import door_movement
+from detection.pattern_detector import PatternDetector
+from detection.state_managers.door_state_manager import DoorStates
+from detection.state_managers.motion_state_manager import MotionStates
+from detection.state_managers.object_state_manager import ObjectStates
+from detection.states import StateHistoryStep, NotState
+from tools.backtest_patterns import SimulatedClock
+
+STATES = [ObjectStates.OBJECT_DETECTED, DoorStates.DOOR_OPEN, DoorStates.DOOR_CLOSED, MotionStates.MOTION_INSIDE_MASK,
+          MotionStates.MOTION_OUTSIDE_MASK]
+
+STATE_MIXES = {
+    'uniform': {state: 1 for state in STATES},
+    'object_heavy': {ObjectStates.OBJECT_DETECTED: 6, DoorStates.DOOR_OPEN: 1, DoorStates.DOOR_CLOSED: 1,
+                     MotionStates.MOTION_INSIDE_MASK: 1, MotionStates.MOTION_OUTSIDE_MASK: 1},
+    'door_heavy': {ObjectStates.OBJECT_DETECTED: 1, DoorStates.DOOR_OPEN: 4, DoorStates.DOOR_CLOSED: 4,
+                   MotionStates.MOTION_INSIDE_MASK: 1, MotionStates.MOTION_OUTSIDE_MASK: 1},
+}
+
+
+def random_patterns(rng, num_patterns, not_state_ratio, prefixes=()):
+    """
+    :param prefixes: prefixes shared by the patterns (e.g. the same door opening in many door/zone patterns),
+                     every pattern starts with one of them if given
+    """
+    patterns = Enum('RandomPatterns', ['RANDOM_%d' % i for i in range(num_patterns)])
+    pattern_steps = []
+    for ptn in patterns:
+        steps = list(rng.choice(prefixes)) if prefixes else []
+        for _ in range(rng.randint(2, 6)):
+            if rng.random() < not_state_ratio:
+                steps.append(NotState(rng.choice(STATES), rng.choice([1, 5, 30, np.inf])))
+            else:
+                steps.append(rng.choice(STATES))
+        if all(type(step) is NotState for step in steps):
+            steps.append(rng.choice(STATES))
+        pattern_steps.append((ptn, steps))
+    return pattern_steps
+
+
+PATTERN_SETS = {
+    'door': lambda rng: door_movement.pattern_steps,
+    'random': lambda rng: random_patterns(rng, 10, 0.2),
+    'not_heavy': lambda rng: random_patterns(rng, 10, 0.6),
+    'shared_prefixes': lambda rng: random_patterns(rng, 50, 0.2, [
+        [ObjectStates.OBJECT_DETECTED, DoorStates.DOOR_OPEN], [DoorStates.DOOR_OPEN, ObjectStates.OBJECT_DETECTED],
+        [MotionStates.MOTION_INSIDE_MASK, ObjectStates.OBJECT_DETECTED, DoorStates.DOOR_CLOSED]]),
+}
+
+
+def state_history(rng, num_steps, state_mix, end_ts, out_of_order=0.0):
+    """
+    :return: steps of the state mix ending at end_ts, in the order they are to be added to the state history.
+             a fraction of them lag behind the step added before them by a few seconds
+    """
+    states, weights = zip(*state_mix.items())
+    steps = []
+    ts = end_ts - num_steps
+    for state in rng.choices(states, weights, k=num_steps):
+        ts += rng.uniform(0.5, 1.5)
+        step_ts = ts - rng.uniform(0, 5) if rng.random() < out_of_order else ts
+        steps.append(StateHistoryStep(state, ts=step_ts))
+    return steps
+
+
+class Collector():
+    def enqueue(self, notification):
+        pass
+
+
+def pattern_detector(pattern_steps, clock, state_history_length=np.inf, columnar=False):
+    return PatternDetector(Collector(), pattern_steps, state_history_length, state_history_length,
+                           detection_interval=None, clock=clock, columnar_state_history=columnar)
+
+
+def measure(fn, budget):
+    """
+    run fn (returning the number of ops it did) till the time budget is spent
+    :return: (ops, seconds)
+    """
+    ops = 0
+    start = time.perf_counter()
+    while True:
+        ops += fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= budget:
+            return ops, elapsed
+
+
+def benchmark(num_steps, pattern_steps, state_mix, rng, budget, out_of_order, max_scan_steps, columnar):
+    """
+    :return: list of (benchmark, ops, seconds)
+    """
+    results = []
+    clock = SimulatedClock()
+    clock.now = end_ts = time.time()
+    steps = state_history(rng, num_steps, state_mix, end_ts, out_of_order)
+
+    def add_all():
+        pd = pattern_detector(pattern_steps, clock, columnar=columnar)
+        for step in steps:
+            pd.add_to_state_history(step)
+        return len(steps)
+    results.append(('add_to_state_history',) + measure(add_all, budget))
+
+    tracemalloc.start()
+    pd = pattern_detector(pattern_steps, clock, columnar=columnar)
+    for step in steps:
+        # the steps are created by the state managers and only kept by the state history
+        pd.add_to_state_history(StateHistoryStep(step.state, step.state_attrs, step.ts))
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    query_ts = [end_ts - rng.uniform(0, min(num_steps, 60)) for _ in range(100)]
+    if num_steps <= max_scan_steps:
+        def find_mov_ptn():
+            shist = pd.state_history.snapshot()
+            ts = rng.choice(query_ts)
+            for (ptn, ptn_steps) in pattern_steps:
+                pd.find_mov_ptn_in_state_history(ptn_steps, shist, ts)
+            return len(pattern_steps)
+        results.append(('find_mov_ptn',) + measure(find_mov_ptn, budget))
+
+    def match_pattern():
+        ts = rng.choice(query_ts)
+        for (ptn, ptn_steps) in pattern_steps:
+            pd.match_pattern(ptn, ptn_steps, ts)
+        return len(pattern_steps)
+    results.append(('match_pattern',) + measure(match_pattern, budget))
+
+    def states_in_demand():
+        pd.states_in_demand_cache = None
+        pd.states_in_demand(rng.choice(query_ts))
+        return 1
+    results.append(('states_in_demand',) + measure(states_in_demand, budget))
+
+    def states_in_demand_memoized():
+        pd.states_in_demand(end_ts)
+        return 1
+    results.append(('states_in_demand (memoized)',) + measure(states_in_demand_memoized, budget))
+
+    def add_and_detect():
+        pd = pattern_detector(pattern_steps, clock, columnar=columnar)
+        for step in steps[:1000]:
+            clock.now = step.ts
+            pd.add_to_state_history(step)
+            pd.detect_patterns()
+        clock.now = end_ts
+        return min(len(steps), 1000)
+    results.append(('add_and_detect',) + measure(add_and_detect, budget))
+
+    # a sliding window of num_steps steps: every step added evicts the oldest one
+    window = num_steps * 1.0
+    pd_window = pattern_detector(pattern_steps, clock, state_history_length=window, columnar=columnar)
+    for step in steps:
+        pd_window.add_to_state_history(step)
+    next_ts = [end_ts]
+
+    def prune():
+        next_ts[0] += 1
+        clock.now = next_ts[0]
+        pd_window.add_to_state_history(StateHistoryStep(rng.choice(STATES), ts=next_ts[0]))
+        pd_window.prune_state_history(False)
+        return 1
+    results.append(('prune',) + measure(prune, budget))
+    clock.now = end_ts
+
+    return results, memory
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-s", "--sizes", type=int, nargs='+', default=[10, 100, 1000, 10000, 100000],
+                    help="number of steps of the state histories")
+    ap.add_argument("-p", "--patterns", type=str, nargs='+', default=['door', 'random', 'not_heavy'],
+                    choices=PATTERN_SETS.keys())
+    ap.add_argument("-m", "--mix", type=str, nargs='+', default=['uniform'], choices=STATE_MIXES.keys())
+    ap.add_argument("-b", "--budget", type=float, default=1,
+                    help="seconds to run every benchmark for (it always runs at least once)")
+    ap.add_argument("--out_of_order", type=float, default=0.05,
+                    help="fraction of the steps added out of order")
+    ap.add_argument("--max_scan_steps", type=int, default=10000,
+                    help="largest state history to run the reference scan on")
+    ap.add_argument("--columnar", action='store_true',
+                    help="store the state history in numpy arrays (see `ColumnarStateHistory`)")
+    ap.add_argument("--seed", type=int, default=0)
+    args = vars(ap.parse_args())
+
+    logging.basicConfig(level=logging.WARNING)
+    print("%-10s %-12s %-8s %-28s %12s %10s %14s" % ('patterns', 'mix', 'steps', 'benchmark', 'ops', 'seconds',
+                                                   'ops/sec'))
+    for patterns in args['patterns']:
+        for mix in args['mix']:
+            for num_steps in args['sizes']:
+                rng = random.Random(args['seed'])
+                results, memory = benchmark(num_steps, PATTERN_SETS[patterns](rng), STATE_MIXES[mix], rng,
+                                            args['budget'], args['out_of_order'], args['max_scan_steps'],
+                                            args['columnar'])
+                for (name, ops, seconds) in results:
+                    print("%-10s %-12s %-8d %-28s %12d %10.3f %14.1f" % (patterns, mix, num_steps, name, ops,
+                                                                       seconds, ops / seconds))
+                print("%-10s %-12s %-8d %-28s %12.1f MB %12.0f bytes/step" % (
+                    patterns, mix, num_steps, 'memory', memory / 2 ** 20, memory / num_steps))